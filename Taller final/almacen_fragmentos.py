@@ -0,0 +1,190 @@
+# ============================================================
+# almacen_fragmentos.py — Almacén compacto de fragmentos en disco
+# Sustituye al docstore pickle de LangChain. Cada fragmento (id, texto y
+# metadatos en JSON) se guarda seguido en un único bloque de bytes; una
+# tabla de offsets indexada por la posición del vector en FAISS dice dónde
+# empieza cada uno, y una tabla de hashes ordenada resuelve id -> posición
+# por búsqueda binaria. Los tres archivos se leen con memory-mapping y un
+# fragmento solo se convierte en Document cuando el retriever lo devuelve:
+# el arranque no depende del tamaño del corpus y no se usa pickle.
+# ============================================================
+
+import hashlib
+import json
+import mmap
+import os
+from collections.abc import MutableMapping
+
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+ARCHIVO_DATOS = "fragmentos.bin"
+ARCHIVO_OFFSETS = "fragmentos_offsets.npy"
+ARCHIVO_IDS = "fragmentos_ids.npy"
+
+# Una fila por posición de FAISS: dónde empieza el fragmento y cuánto miden id, texto y metadatos
+TIPO_OFFSET = np.dtype([("inicio", "<u8"), ("largo_id", "<u2"), ("largo_texto", "<u4"), ("largo_meta", "<u4")])
+
+
+def hash_id(id_fragmento):
+    """Hash de 64 bits de un id de fragmento (para la tabla de búsqueda id -> posición)."""
+    return int.from_bytes(hashlib.blake2b(id_fragmento.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class AlmacenFragmentos:
+    """Vista de solo lectura de un almacén escrito con `escribir`."""
+
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        self._offsets = np.load(os.path.join(carpeta, ARCHIVO_OFFSETS), mmap_mode="r")
+        ids = np.load(os.path.join(carpeta, ARCHIVO_IDS), mmap_mode="r")
+        self._hashes, self._posiciones = ids[0], ids[1] # Hashes ordenados y su posición en FAISS
+        with open(os.path.join(carpeta, ARCHIVO_DATOS), "rb") as f:
+            self._datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    @staticmethod
+    def existe(carpeta):
+        return all(os.path.exists(os.path.join(carpeta, a)) for a in (ARCHIVO_DATOS, ARCHIVO_OFFSETS, ARCHIVO_IDS))
+
+    @staticmethod
+    def archivos(carpeta, sufijo=""):
+        """Rutas de los archivos del almacén (con `sufijo`, las de una copia escrita con ese sufijo)."""
+        return [os.path.join(carpeta, nombre + sufijo) for nombre in (ARCHIVO_DATOS, ARCHIVO_OFFSETS, ARCHIVO_IDS)]
+
+    @staticmethod
+    def escribir(carpeta, fragmentos, sufijo=""):
+        """Escribe pares (id, Document) en el orden de las posiciones de FAISS.
+           Cada archivo se escribe en uno temporal y se reemplaza con os.replace. Con `sufijo`
+           se escriben junto a los actuales (p. ej. ".tmp") para renombrarlos después.
+        """
+        ruta_datos = os.path.join(carpeta, ARCHIVO_DATOS + sufijo)
+        offsets, hashes = [], []
+        inicio = 0
+        with open(ruta_datos + ".tmp", "wb") as f:
+            for id_fragmento, documento in fragmentos:
+                id_bytes = id_fragmento.encode("utf-8")
+                texto = documento.page_content.encode("utf-8")
+                meta = json.dumps(documento.metadata, ensure_ascii=False, default=str).encode("utf-8")
+                f.write(id_bytes)
+                f.write(texto)
+                f.write(meta)
+                offsets.append((inicio, len(id_bytes), len(texto), len(meta)))
+                hashes.append(hash_id(id_fragmento))
+                inicio += len(id_bytes) + len(texto) + len(meta)
+
+        tabla_offsets = np.array(offsets, dtype=TIPO_OFFSET)
+        hashes = np.array(hashes, dtype=np.uint64)
+        orden = np.argsort(hashes, kind="stable")
+        tabla_ids = np.stack([hashes[orden], orden.astype(np.uint64)]) if len(hashes) else np.zeros((2, 0), np.uint64)
+        for nombre, tabla in ((ARCHIVO_OFFSETS, tabla_offsets), (ARCHIVO_IDS, tabla_ids)):
+            with open(os.path.join(carpeta, nombre + sufijo + ".tmp"), "wb") as f:
+                np.save(f, tabla)
+        for ruta in AlmacenFragmentos.archivos(carpeta, sufijo):
+            os.replace(ruta + ".tmp", ruta)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _campos(self, posicion):
+        inicio, largo_id, largo_texto, largo_meta = (int(x) for x in self._offsets[posicion])
+        fin_id = inicio + largo_id
+        fin_texto = fin_id + largo_texto
+        return inicio, fin_id, fin_texto, fin_texto + largo_meta
+
+    def id_en(self, posicion):
+        """Id del fragmento guardado en la posición de FAISS indicada."""
+        inicio, fin_id, _, _ = self._campos(posicion)
+        return self._datos[inicio:fin_id].decode("utf-8")
+
+    def documento(self, posicion):
+        """Materializa el fragmento de una posición como Document."""
+        _, fin_id, fin_texto, fin_meta = self._campos(posicion)
+        return Document(
+            page_content=self._datos[fin_id:fin_texto].decode("utf-8"),
+            metadata=json.loads(self._datos[fin_texto:fin_meta]),
+        )
+
+    def posicion(self, id_fragmento):
+        """Posición de un id por búsqueda binaria en la tabla de hashes, o None si no está."""
+        clave = np.uint64(hash_id(id_fragmento))
+        i = int(np.searchsorted(self._hashes, clave))
+        while i < len(self._hashes) and self._hashes[i] == clave:
+            posicion = int(self._posiciones[i])
+            if self.id_en(posicion) == id_fragmento: # Descarta colisiones del hash
+                return posicion
+            i += 1
+        return None
+
+
+class DocstoreFragmentos(Docstore, AddableMixin):
+    """Docstore de LangChain sobre un AlmacenFragmentos.
+
+       Las altas y bajas de una actualización incremental se guardan en memoria hasta que
+       el vectorstore se vuelve a escribir en disco.
+    """
+
+    def __init__(self, almacen=None):
+        self.almacen = almacen
+        self._nuevos = {}
+        self._eliminados = set()
+
+    def search(self, search):
+        if search in self._nuevos:
+            return self._nuevos[search]
+        if search not in self._eliminados and self.almacen is not None:
+            posicion = self.almacen.posicion(search)
+            if posicion is not None:
+                return self.almacen.documento(posicion)
+        return f"ID {search} not found."
+
+    def posicion(self, id_fragmento):
+        """Posición en FAISS de un fragmento del almacén, o None si es nuevo, se borró o no está."""
+        if id_fragmento in self._nuevos or id_fragmento in self._eliminados or self.almacen is None:
+            return None
+        return self.almacen.posicion(id_fragmento)
+
+    def add(self, texts):
+        # Como InMemoryDocstore: un id que ya existe no se sobrescribe
+        existentes = [i for i in texts if i in self._nuevos or (
+            i not in self._eliminados and self.almacen is not None and self.almacen.posicion(i) is not None)]
+        if existentes:
+            raise ValueError(f"Tried to add ids that already exist: {set(existentes)}")
+        self._nuevos.update(texts)
+        self._eliminados.difference_update(texts)
+
+    def delete(self, ids):
+        for id_fragmento in ids:
+            self._nuevos.pop(id_fragmento, None)
+            self._eliminados.add(id_fragmento)
+
+
+class IdsPorPosicion(MutableMapping):
+    """Reemplazo de `index_to_docstore_id` que lee los ids del almacén solo cuando se piden.
+       Las posiciones añadidas en memoria (add_embeddings) tienen prioridad sobre las del almacén.
+    """
+
+    def __init__(self, almacen=None):
+        self.almacen = almacen
+        self._base = len(almacen) if almacen is not None else 0
+        self._extra = {}
+
+    def __getitem__(self, posicion):
+        if posicion in self._extra:
+            return self._extra[posicion]
+        if 0 <= posicion < self._base:
+            return self.almacen.id_en(posicion)
+        raise KeyError(posicion)
+
+    def __setitem__(self, posicion, id_fragmento):
+        self._extra[posicion] = id_fragmento
+
+    def __delitem__(self, posicion):
+        raise TypeError("IdsPorPosicion no admite borrar posiciones sueltas")
+
+    def __iter__(self):
+        yield from range(self._base)
+        yield from (p for p in sorted(self._extra) if p >= self._base)
+
+    def __len__(self):
+        return self._base + sum(1 for p in self._extra if p >= self._base)
@@ -7,23 +7,58 @@
 
 # 📦 Importar bibliotecas necesarias
 import os
-import csv
-import gradio as gr
-import re # Importar el módulo re para expresiones regulares
+import asyncio
+import atexit
+import json
+import hashlib
+import threading
+import time
+import functools
+import multiprocessing
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
 # Importaciones de LangChain
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import (
-    TextLoader, CSVLoader, UnstructuredExcelLoader, UnstructuredPDFLoader
-)
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain.prompts import PromptTemplate
 from langchain.chains import RetrievalQA
 
 # Importaciones de langchain_core para Document
 from langchain_core.documents import Document
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Carga y fragmentación de archivos, también en procesos aparte (módulo local)
+from carga_archivos import es_costoso, procesar_archivo
+# Caché persistente de embeddings (módulo local)
+from cache_embeddings import CacheEmbeddings
+# Caché de respuestas del RAG (módulo local)
+from cache_respuestas import CacheRespuestas
+# Embeddings por lotes con reintentos para construir el índice (módulo local)
+from embeddings_lotes import embeber_en_lotes
+# Índice léxico BM25 y retriever híbrido (módulo local)
+from indice_lexico import IndiceLexico, RetrieverHibrido
+# Contexto del RAG con fragmentos fusionados, MMR y presupuesto de tokens (módulo local)
+from empaquetado_contexto import RetrieverEmpaquetado
+# Tipos de índice FAISS (plano, HNSW, IVF, IVF-PQ) y lectura con memory-mapping (módulo local)
+from indices_faiss import (
+    TIPOS_INDICE, borrar_posiciones, convertir_indice, configurar_busqueda, escribir_indice, leer_indice,
+    tipo_de_indice,
+)
+# Almacén compacto de fragmentos con memory-mapping, en lugar del docstore pickle (módulo local)
+from almacen_fragmentos import AlmacenFragmentos, DocstoreFragmentos, IdsPorPosicion
+# Índices FAISS por partición (fuente) y enrutado de consultas por temas (módulo local)
+from particiones import Particiones, construir_particiones
+# Índice en memoria de pedidos y catálogo para las tools (módulo local)
+from indice_comercial import IndiceComercial, normalizar_nombre
+# Enrutador de intenciones de una sola pasada (módulo local)
+from enrutador import analizar_consulta, Consulta, ESTADO, REEMBOLSO, REGISTRO, ELEGIBILIDAD
+# Registro de solicitudes con escritura diferida en SQLite (módulo local)
+from registro_solicitudes import RegistroSolicitudes
+# Tiempos por etapa, contadores y trazas lentas con exportación Prometheus (módulo local)
+from metricas import metricas, BUCKETS_TOKENS
 
 import warnings
 
@@ -55,222 +90,871 @@ load_dotenv() # Esto cargará .env si existe, pero la línea anterior ya setea l
 DATA_DIR = "content"
 VECTORSTORE_PATH = "vectorstore"
 
+# Caché de respuestas del RAG: TTL en segundos, tamaño máximo y umbral de similitud
+# para preguntas casi idénticas (0 desactiva la búsqueda por similitud)
+RESPUESTAS_CACHE_TTL = float(os.getenv("ECOMARKET_RESPUESTAS_CACHE_TTL", "3600"))
+RESPUESTAS_CACHE_MAX = int(os.getenv("ECOMARKET_RESPUESTAS_CACHE_MAX", "1000"))
+RESPUESTAS_CACHE_SIMILITUD = float(os.getenv("ECOMARKET_RESPUESTAS_CACHE_SIMILITUD", "0"))
+cache_respuestas = CacheRespuestas(
+    ttl=RESPUESTAS_CACHE_TTL,
+    max_entradas=RESPUESTAS_CACHE_MAX,
+    umbral_similitud=RESPUESTAS_CACHE_SIMILITUD,
+)
+
+# Métricas: puerto del endpoint local /metrics (0 lo desactiva) y trazas de peticiones lentas
+METRICAS_HOST = os.getenv("ECOMARKET_METRICAS_HOST", "127.0.0.1")
+METRICAS_PUERTO = int(os.getenv("ECOMARKET_METRICAS_PUERTO", "9464"))
+TRAZAS_UMBRAL_MS = float(os.getenv("ECOMARKET_TRAZAS_UMBRAL_MS", "2000"))
+TRAZAS_MUESTREO = float(os.getenv("ECOMARKET_TRAZAS_MUESTREO", "1.0")) # fracción de las lentas que se guarda
+TRAZAS_ARCHIVO = os.getenv("ECOMARKET_TRAZAS_ARCHIVO") or None # JSONL opcional con las trazas lentas
+metricas.configurar_trazas(umbral_segundos=TRAZAS_UMBRAL_MS / 1000, muestreo=TRAZAS_MUESTREO, archivo=TRAZAS_ARCHIVO)
+metricas.definir_contador("ecomarket_rutas_total", "Mensajes por intención elegida por el enrutador")
+metricas.definir_contador("ecomarket_cache_respuestas_total", "Consultas a la caché de respuestas por resultado")
+metricas.definir_contador("ecomarket_tokens_total", "Tokens consumidos por el LLM por tipo")
+metricas.definir_histograma("ecomarket_tokens_peticion", "Tokens por llamada al LLM", BUCKETS_TOKENS)
+metricas.definir_indicador("ecomarket_cache_respuestas_entradas", "Respuestas guardadas en la caché",
+                           lambda: cache_respuestas.estadisticas()["entradas"])
+
+
+def iniciar_servidor_metricas():
+    """Arranca el endpoint local de métricas (/metrics y /trazas) si ECOMARKET_METRICAS_PUERTO no es 0."""
+    if not METRICAS_PUERTO:
+        return None
+    try:
+        servidor = metricas.iniciar_servidor(METRICAS_PUERTO, METRICAS_HOST)
+    except OSError as e:
+        print(f"⚠️ No se pudo iniciar el servidor de métricas en el puerto {METRICAS_PUERTO}: {e}")
+        return None
+    print(f"📈 Métricas en http://{METRICAS_HOST}:{METRICAS_PUERTO}/metrics (trazas lentas en /trazas)")
+    return servidor
+
 
 # ==========================
 # 3️⃣ Funciones auxiliares (Tools)
 # ==========================
-# Funciones para verificar elegibilidad, calcular reembolso y registrar solicitud
-def verificar_elegibilidad_producto(entrada: str) -> str:
+# Pedidos, catálogo y solicitudes documentadas que consultan las tools. Se leen en el
+# primer uso y se vuelven a leer solo cuando cambian los archivos.
+indice_comercial = IndiceComercial(
+    os.path.join(DATA_DIR, "pedidos_detallados.txt"),
+    os.path.join(DATA_DIR, "catalogo_productos.txt"),
+    os.path.join(DATA_DIR, "solicitudes_detalladas.txt"),
+)
+
+
+def _campos(consulta, n):
+    """Campos del formato con ';' limitados a n (los sobrantes se unen en el último, como split(';', n-1))."""
+    campos = consulta.campos
+    if len(campos) > n:
+        campos = campos[:n - 1] + [";".join(campos[n - 1:]).strip()]
+    return campos
+
+
+# Registro de solicitudes de devolución: SQLite (WAL) indexado por pedido, con copia en el CSV
+# histórico. Un hilo escritor guarda las solicitudes en lotes cada SOLICITUDES_FLUSH segundos;
+# SOLICITUDES_FSYNC elige la durabilidad ('siempre', 'lote' o 'nunca').
+SOLICITUDES_DB_PATH = os.path.join("data", "solicitudes.sqlite")
+SOLICITUDES_CSV_PATH = os.path.join("data", "solicitudes.csv")
+SOLICITUDES_FLUSH = float(os.getenv("ECOMARKET_SOLICITUDES_FLUSH", "0.2"))
+SOLICITUDES_FSYNC = os.getenv("ECOMARKET_SOLICITUDES_FSYNC", "lote")
+_registro_solicitudes = None
+_registro_lock = threading.Lock()
+
+
+def obtener_registro_solicitudes():
+    """Devuelve el registro de solicitudes, creándolo (y arrancando su hilo escritor) en el primer uso."""
+    global _registro_solicitudes
+    with _registro_lock:
+        if _registro_solicitudes is None:
+            _registro_solicitudes = RegistroSolicitudes(
+                SOLICITUDES_DB_PATH,
+                ruta_csv=SOLICITUDES_CSV_PATH,
+                intervalo_flush=SOLICITUDES_FLUSH,
+                fsync=SOLICITUDES_FSYNC,
+            )
+            # Al salir, escribir las solicitudes que sigan en memoria
+            atexit.register(_registro_solicitudes.cerrar)
+    return _registro_solicitudes
+
+
+# Funciones para verificar elegibilidad, calcular reembolso y registrar solicitud.
+# Reciben el texto y, opcionalmente, la Consulta ya analizada por el enrutador
+# (si no se pasa, la analizan ellas mismas).
+def verificar_elegibilidad_producto(entrada: str, consulta: Consulta = None) -> str:
     """Verifica la elegibilidad de un producto para devolución.
        Puede recibir formato 'pedido;producto;fecha;motivo' o lenguaje natural.
     """
     print(f"DEBUG: verificar_elegibilidad_producto recibió: {entrada}")
+    consulta = consulta or analizar_consulta(entrada)
     pedido, producto, fecha, motivo = "desconocido", "producto no identificado", "no especificada", "motivo no especificado"
 
-    if ";" in entrada:
-        try:
-            partes = [x.strip() for x in entrada.split(";", 3)] # Limitar split a 3 para capturar motivo completo
-            if len(partes) == 4:
-                pedido, producto, fecha, motivo = partes
-            else:
-                 return "⚠️ Formato incorrecto. Usa: pedido; producto; fecha; motivo"
-        except Exception as e:
-            return f"⚠️ Error al parsear entrada con ';': {e}. Usa: pedido; producto; fecha; motivo"
+    if consulta.campos is not None:
+        partes = _campos(consulta, 4)
+        if len(partes) == 4:
+            pedido, producto, fecha, motivo = partes
+        else:
+             return "⚠️ Formato incorrecto. Usa: pedido; producto; fecha; motivo"
     else:
-        # Intenta extraer información de lenguaje natural
-        entrada_lower = entrada.lower()
-        pedido_match = re.search(r"pedido\s*(\d+)", entrada_lower)
-        if pedido_match: pedido = pedido_match.group(1)
-
-        producto_match = re.search(
-            r"(?:el|la|los|las)\s+([a-záéíóúñ\s]+?)(?=\s*(?:del|de|porque|por|que|llegó|dañado|defectuoso|no corresponde|$))",
-            entrada_lower
-        )
-        if producto_match: producto = producto_match.group(1).strip()
-
-        motivo_match = re.search(r"(dañado|defectuoso|no corresponde)", entrada_lower)
-        if motivo_match: motivo = motivo_match.group(1)
-
-
+        # Datos extraídos del lenguaje natural por el enrutador
+        pedido = consulta.pedido or pedido
+        producto = consulta.producto or producto
+        motivo = consulta.motivo or motivo
         print(f"DEBUG: Extracción NL - Pedido: {pedido}, Producto: {producto}, Motivo: {motivo}")
 
+    # Si el pedido existe en pedidos_detallados.txt, usar su producto y su fecha de compra reales
+    registro = indice_comercial.pedido(pedido)
+    if registro:
+        producto = registro.producto or producto
 
     # Lógica de elegibilidad simplificada
     motivos_elegibles = ["defectuoso", "dañado", "no corresponde"]
-    if motivo.lower() in motivos_elegibles:
-        return f"✅ El producto '{producto}' del pedido {pedido} es elegible para devolución por el motivo: {motivo}."
-    else:
+    if motivo.lower() not in motivos_elegibles:
         return f"❌ El producto '{producto}' del pedido {pedido} no cumple los criterios de devolución por el motivo: {motivo}."
 
+    # Plazo de devolución (Artículo 5): 7 días por defecto, 14 para el resto, desde la entrega estimada
+    if registro and registro.fecha_compra:
+        limite = registro.fecha_limite_devolucion(defectuoso=motivo.lower() in ("defectuoso", "dañado"))
+        if date.today() > limite:
+            return (f"❌ El producto '{producto}' del pedido {pedido} (comprado el {registro.fecha_compra:%d/%m/%Y}) "
+                    f"está fuera del plazo de devolución, que venció el {limite:%d/%m/%Y}.")
+        return (f"✅ El producto '{producto}' del pedido {pedido} es elegible para devolución por el motivo: {motivo} "
+                f"(plazo hasta el {limite:%d/%m/%Y}).")
+    return f"✅ El producto '{producto}' del pedido {pedido} es elegible para devolución por el motivo: {motivo}."
 
-def calcular_monto_reembolso(entrada: str) -> str:
+
+def calcular_monto_reembolso(entrada: str, consulta: Consulta = None) -> str:
     """Calcula un monto estimado de reembolso.
        Puede recibir formato 'producto;cantidad;precio' o lenguaje natural.
+       Si falta el precio, se toma del pedido (ECO-xxxx) o del catálogo.
     """
     print(f"DEBUG: calcular_monto_reembolso recibió: {entrada}")
+    consulta = consulta or analizar_consulta(entrada)
     producto, cantidad, precio = "producto", 0, 0.0
 
-    if ";" in entrada:
+    if consulta.campos is not None:
+        partes = _campos(consulta, 3)
+        if len(partes) != 3:
+             return "⚠️ Formato incorrecto. Usa: producto; cantidad; precio"
         try:
-            partes = [x.strip() for x in entrada.split(";", 2)] # Limitar split a 2
-            if len(partes) == 3:
-                 producto, cantidad_str, precio_str = partes
-                 cantidad = int(cantidad_str)
+             producto, cantidad_str, precio_str = partes
+             cantidad = int(cantidad_str)
+             if precio_str:
                  precio = float(precio_str)
-            else:
-                 return "⚠️ Formato incorrecto. Usa: producto; cantidad; precio"
+             else:
+                 # Precio vacío: usar el precio del catálogo
+                 producto_catalogo = indice_comercial.producto(producto)
+                 if not producto_catalogo or producto_catalogo.precio is None:
+                     return f"⚠️ No encontré '{producto}' en el catálogo. Indica el precio: producto; cantidad; precio"
+                 producto, precio = producto_catalogo.nombre, producto_catalogo.precio
         except ValueError:
             return "⚠️ Cantidad y precio deben ser números. Usa: producto; cantidad; precio"
-        except Exception as e:
-             return f"⚠️ Error al parsear entrada con ';': {e}. Usa: producto; cantidad; precio"
     else:
-         # Intenta extraer información de lenguaje natural
-        match = re.search(
-            r"(?:reembolso|devolver|compré|quiero un reembolso por|quiero reembolso de)\s*(?:el|la|los|las)?\s*([a-záéíóúñ\s]+?)\s*(?:por)?\s*\$?(\d+(?:\.\d{1,2})?)",
-            entrada.lower()
-        )
-        if match:
-            producto = match.group(1).strip()
-            cantidad = 1 # Asumir cantidad 1 si no se especifica
-            precio = float(match.group(2))
+        # Datos extraídos del lenguaje natural por el enrutador
+        registro = indice_comercial.pedido(consulta.pedido) if consulta.pedido else None
+        if registro and registro.precio_unitario is not None:
+            # Pedido conocido: producto, cantidad y precio reales del pedido
+            producto = registro.producto
+            cantidad = consulta.cantidad or registro.cantidad or 1
+            precio = registro.precio_unitario
+            print(f"DEBUG: Datos del pedido {registro.numero} - Producto: {producto}, Cantidad: {cantidad}, Precio: {precio}")
+        elif consulta.precio is not None:
+            producto = consulta.producto or producto
+            cantidad = consulta.cantidad or 1 # Asumir cantidad 1 si no se especifica
+            precio = consulta.precio
             print(f"DEBUG: Extracción NL - Producto: {producto}, Cantidad: {cantidad}, Precio: {precio}")
         else:
-             return "⚠️ No pude entender los datos para calcular el reembolso. Usa: producto; cantidad; precio o describe claramente el producto y precio."
+            # Sin precio en el texto: usar el del catálogo, solo si el mensaje nombra el producto o su
+            # código (las palabras sueltas del mensaje, como "tela" en "mi pedido de tela", no bastan)
+            referencia = consulta.codigo_producto or consulta.producto
+            if not referencia:
+                return ("⚠️ ¿De qué producto quieres el reembolso? Indica su nombre o código (p. ej. PROD-001), "
+                        "o usa: producto; cantidad; precio")
+            producto_catalogo = indice_comercial.producto(referencia)
+            if not producto_catalogo or producto_catalogo.precio is None:
+                return (f"⚠️ No encontré '{referencia}' en el catálogo. ¿Qué producto es? Indica su nombre o código, "
+                        "o usa: producto; cantidad; precio")
+            producto = producto_catalogo.nombre
+            cantidad = consulta.cantidad or 1
+            precio = producto_catalogo.precio
+            print(f"DEBUG: Precio de catálogo - Producto: {producto}, Cantidad: {cantidad}, Precio: {precio}")
 
     return f"💵 Monto estimado de reembolso para {cantidad} x '{producto}': ${cantidad * precio:.2f}"
 
 
-def registrar_solicitud_devolucion(entrada: str) -> str:
-    """Registra una solicitud de devolución en un archivo CSV.
+def registrar_solicitud_devolucion(entrada: str, consulta: Consulta = None) -> str:
+    """Registra una solicitud de devolución (SQLite + CSV, escritura en segundo plano).
        Puede recibir formato 'pedido;producto;motivo' o lenguaje natural.
     """
     print(f"DEBUG: registrar_solicitud_devolucion recibió: {entrada}")
+    consulta = consulta or analizar_consulta(entrada)
     pedido, producto, motivo = "desconocido", "producto no identificado", "motivo no especificado"
 
-    if ";" in entrada:
-        try:
-            partes = [x.strip() for x in entrada.split(";", 2)] # Limitar split a 2
-            if len(partes) == 3:
-                pedido, producto, motivo = partes
-            else:
-                return "⚠️ Formato incorrecto. Usa: pedido; producto; motivo"
-        except Exception as e:
-             return f"⚠️ Error al parsear entrada con ';': {e}. Usa: pedido; producto; motivo"
+    if consulta.campos is not None:
+        partes = _campos(consulta, 3)
+        if len(partes) == 3:
+            pedido, producto, motivo = partes
+        else:
+            return "⚠️ Formato incorrecto. Usa: pedido; producto; motivo"
     else:
-        # Intenta extraer información de lenguaje natural
-        entrada_lower = entrada.lower()
-        pedido_match = re.search(r"pedido\s*(\d+)", entrada_lower)
-        if pedido_match: pedido = pedido_match.group(1)
-
-        producto_match = re.search(r"(?:el|la|los|las)\s+([a-záéíóúñ\s]+?)(?=\s*(?:del|de|porque|por|que|$))", entrada_lower)
-        if producto_match: producto = producto_match.group(1).strip()
-
-        motivo_match = re.search(r"(dañado|defectuoso|no corresponde)", entrada_lower)
-        if motivo_match: motivo = motivo_match.group(1)
-
+        # Datos extraídos del lenguaje natural por el enrutador
+        pedido = consulta.pedido or pedido
+        producto = consulta.producto or producto
+        motivo = consulta.motivo or motivo
         print(f"DEBUG: Extracción NL - Pedido: {pedido}, Producto: {producto}, Motivo: {motivo}")
 
 
-    # Asegurarse de que la carpeta 'data' existe
-    os.makedirs("data", exist_ok=True)
-    file_path = "data/solicitudes.csv"
+    # Si el pedido existe, completar el producto con el registrado en el pedido
+    registro = indice_comercial.pedido(pedido)
+    if registro and producto == "producto no identificado":
+        producto = registro.producto or producto
 
-    # Escribir en el archivo CSV
+    # Los productos del catálogo (por nombre o código) se guardan con su nombre oficial; los que
+    # no se reconocen se registran tal como se escribieron, con un aviso para revisarlos
+    aviso = ""
+    del_pedido = registro is not None and normalizar_nombre(producto) == normalizar_nombre(registro.producto or "")
+    if not del_pedido:
+        encontrado = indice_comercial.producto(consulta.codigo_producto or producto)
+        if encontrado is not None:
+            producto = encontrado.nombre
+        else:
+            aviso = (f"\n⚠️ '{producto}' no está en el catálogo: se registró tal como lo escribiste. "
+                     "Si no es correcto, indica el nombre o código del producto (p. ej. PROD-001).")
+
+    # Encolar la solicitud: se escribe en disco en segundo plano, sin esperar aquí
+    try:
+        existente = obtener_registro_solicitudes().registrar(
+            pedido, producto, motivo, detectar_duplicados=pedido != "desconocido"
+        )
+    except Exception as e:
+        return f"❌ Error al registrar la solicitud en {SOLICITUDES_DB_PATH}: {e}"
+    if existente:
+        return (f"ℹ️ Ya existe una solicitud para '{existente['producto']}' del pedido {existente['pedido']} "
+                f"con motivo: {existente['motivo']} (estado: {existente['estado']}).")
+    return f"📝 Solicitud registrada para '{producto}' del pedido {pedido} con motivo: {motivo}.{aviso}"
+
+
+def _describir_solicitud(solicitud):
+    """Resumen de una solicitud documentada en solicitudes_detalladas.txt."""
+    pedido = f"del pedido {solicitud.pedido}" if solicitud.pedido else "sin pedido asociado"
+    respuesta = (f"📋 Solicitud {solicitud.numero} {pedido} para '{solicitud.producto}' con motivo: "
+                 f"{solicitud.motivo}. Estado: {solicitud.estado}.")
+    if solicitud.accion:
+        respuesta += f" Acción recomendada: {solicitud.accion}."
+    return respuesta
+
+
+def consultar_estado_solicitud(entrada: str, consulta: Consulta = None) -> str:
+    """Consulta el estado de una solicitud de devolución por su ID (1003) o por su pedido (ECO-1002).
+       Busca en las solicitudes documentadas y en el registro de la app. Devuelve None si no
+       encuentra ninguna, para que responda el RAG.
+    """
+    print(f"DEBUG: consultar_estado_solicitud recibió: {entrada}")
+    consulta = consulta or analizar_consulta(entrada)
+    if not (consulta.solicitud or consulta.pedido):
+        return "⚠️ Indica el ID de la solicitud o el número de pedido (p. ej.: ¿Cuál es el estado de mi solicitud 1003?)."
+
+    partes = []
+    pedido = consulta.pedido
+    documentada = indice_comercial.solicitud(consulta.solicitud) if consulta.solicitud else None
+    if documentada is not None:
+        partes.append(_describir_solicitud(documentada))
+        pedido = pedido or documentada.pedido
+    elif consulta.solicitud and not pedido and indice_comercial.pedido(consulta.solicitud):
+        # No es el ID de una solicitud, pero sí un número de pedido ("¿cómo va mi devolución 1002?")
+        pedido = consulta.solicitud
+    if pedido is None:
+        return "\n".join(partes) or None
+    if documentada is None:
+        partes += [_describir_solicitud(s) for s in indice_comercial.solicitudes_de_pedido(pedido)]
+
+    # El pedido se guarda tal como se escribió: '1003' también se busca como 'ECO-1003'
+    referencias = [pedido] + ([f"ECO-{pedido}"] if pedido.isdigit() else [])
     try:
-        with open(file_path, "a", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerow([pedido, producto, motivo])
-        return f"📝 Solicitud registrada para '{producto}' del pedido {pedido} con motivo: {motivo}."
+        registradas = []
+        for referencia in referencias:
+            registradas += obtener_registro_solicitudes().buscar(referencia)
     except Exception as e:
-        return f"❌ Error al registrar la solicitud en {file_path}: {e}"
+        return f"❌ Error al consultar el registro de solicitudes en {SOLICITUDES_DB_PATH}: {e}"
+    if registradas:
+        ultima = max(registradas, key=lambda s: s["fecha"])
+        respuesta = (f"📋 Solicitud para '{ultima['producto']}' del pedido {ultima['pedido']} con motivo: "
+                     f"{ultima['motivo']}. Estado: {ultima['estado']} (desde el {ultima['fecha'].replace('T', ' ')}).")
+        if len(registradas) > 1:
+            respuesta += f" El pedido tiene {len(registradas)} solicitudes registradas."
+        partes.append(respuesta)
+    # Sin datos estructurados se responde con el RAG (que también lee los documentos)
+    return "\n".join(partes) or None
 
 
 # ==========================
 # 4️⃣ Crear carpeta 'content' (si no existe)
 # ==========================
 # En un script standalone, asegúrate de que los archivos estén en la carpeta 'content'
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
-    print(f"📁 Carpeta '{DATA_DIR}' creada. Asegúrate de colocar tus documentos aquí (.txt, .csv, .pdf, .xlsx).")
-else:
-    print(f"📁 Carpeta '{DATA_DIR}' ya existe.")
+# Se comprueba al construir el vectorstore, no al importar el módulo.
+def asegurar_carpeta_datos():
+    """Crea DATA_DIR si no existe."""
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+        print(f"📁 Carpeta '{DATA_DIR}' creada. Asegúrate de colocar tus documentos aquí (.txt, .csv, .pdf, .xlsx).")
 
 
 # ==========================
-# 5️⃣ Crear vectorstore con OpenAI embeddings
+# 5️⃣ Crear vectorstore con embeddings (OpenAI o locales)
 # ==========================
+# Junto a vectorstore/index.faiss se guarda un manifest con el hash de cada archivo
+# y de cada fragmento. Así una reconstrucción solo embebe lo nuevo o modificado.
+MANIFEST_PATH = os.path.join(VECTORSTORE_PATH, "manifest.json")
+MANIFEST_VERSION = 5 # 5: el manifest guarda la firma de los archivos del índice que describe
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EXTENSIONES_SOPORTADAS = (".txt", ".csv", ".xlsx", ".pdf")
+
+# Backend de embeddings: "openai" (API remota) o "local" (sentence-transformers en CPU, sin red)
+BACKENDS_EMBEDDINGS = ("openai", "local")
+EMBEDDINGS_BACKEND = os.getenv("ECOMARKET_EMBEDDINGS_BACKEND", "openai").strip().lower()
+if EMBEDDINGS_BACKEND not in BACKENDS_EMBEDDINGS:
+    raise ValueError(f"Backend de embeddings desconocido: {EMBEDDINGS_BACKEND!r} (usa {', '.join(BACKENDS_EMBEDDINGS)})")
+EMBEDDINGS_MODELO_OPENAI = "text-embedding-3-small"
+EMBEDDINGS_MODELO_LOCAL = os.getenv("ECOMARKET_EMBEDDINGS_MODELO_LOCAL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+# Hilos de CPU y tamaño de lote del modelo local (0 hilos = valor por defecto de torch)
+EMBEDDINGS_HILOS = int(os.getenv("ECOMARKET_EMBEDDINGS_HILOS", "0"))
+EMBEDDINGS_LOTE_LOCAL = int(os.getenv("ECOMARKET_EMBEDDINGS_LOTE_LOCAL", "32"))
+EMBEDDING_MODEL = EMBEDDINGS_MODELO_LOCAL if EMBEDDINGS_BACKEND == "local" else EMBEDDINGS_MODELO_OPENAI
+DIMENSIONES_OPENAI = {"text-embedding-3-small": 1536, "text-embedding-3-large": 3072, "text-embedding-ada-002": 1536}
+# Los vectores locales salen normalizados: se indexan por producto interno (equivale al coseno).
+# El vectorstore guardado no incluye la estrategia, así que se pasa también al cargar.
+ESTRATEGIA_DISTANCIA = (
+    DistanceStrategy.MAX_INNER_PRODUCT if EMBEDDINGS_BACKEND == "local" else DistanceStrategy.EUCLIDEAN_DISTANCE
+)
+
+# Caché de embeddings en disco compartida por la construcción del índice y las consultas
+EMBEDDINGS_CACHE_PATH = os.getenv("ECOMARKET_EMBEDDINGS_CACHE", os.path.join("cache", "embeddings.sqlite"))
+# Entradas máximas de la caché. Con 0 (por defecto) se ajusta al corpus indexado: al menos
+# EMBEDDINGS_CACHE_MIN y siempre el corpus entero más un margen para las consultas. Si la caché
+# no cabe el corpus, una construcción interrumpida o una reconstrucción vuelven a embeber los
+# fragmentos desalojados (se avisa al construir)
+EMBEDDINGS_CACHE_MAX = int(os.getenv("ECOMARKET_EMBEDDINGS_CACHE_MAX", "0"))
+EMBEDDINGS_CACHE_MIN = 50000
+EMBEDDINGS_CACHE_MARGEN = 0.2
+# URL alternativa del servicio de embeddings (por ejemplo, un servidor falso local para pruebas)
+EMBEDDINGS_BASE_URL = os.getenv("ECOMARKET_EMBEDDINGS_URL") or None
+
+# Construcción del índice: tamaño de lote, hilos en paralelo y reintentos ante límites de tasa (429)
+EMBEDDINGS_TAM_LOTE = int(os.getenv("ECOMARKET_EMBEDDINGS_TAM_LOTE", "64"))
+EMBEDDINGS_TRABAJADORES = int(os.getenv("ECOMARKET_EMBEDDINGS_TRABAJADORES", "4"))
+EMBEDDINGS_REINTENTOS = int(os.getenv("ECOMARKET_EMBEDDINGS_REINTENTOS", "6"))
+
+# Procesos para cargar y fragmentar en paralelo los PDF, XLSX y archivos grandes (costosos de
+# parsear). Los .txt y .csv se cargan siempre en serie; ECOMARKET_PROCESOS_CARGA=1 lo carga todo en serie
+PROCESOS_CARGA = int(os.getenv("ECOMARKET_PROCESOS_CARGA", str(os.cpu_count() or 1)))
+
+# Informe de la última construcción o actualización del vectorstore (también se guarda en disco)
+INFORME_PATH = os.path.join(VECTORSTORE_PATH, "informe_construccion.json")
+informe_construccion = {}
+
+# Índice léxico (BM25) sobre los mismos fragmentos que FAISS, guardado junto a él
+INDICE_LEXICO_PATH = os.path.join(VECTORSTORE_PATH, "indice_lexico.json")
+
+# Tipo de índice FAISS: flat (exacto), hnsw, ivf o ivfpq, con sus parámetros de construcción y búsqueda
+INDICE_TIPO = os.getenv("ECOMARKET_INDICE_TIPO", "flat").strip().lower()
+if INDICE_TIPO not in TIPOS_INDICE:
+    raise ValueError(f"Tipo de índice FAISS desconocido: {INDICE_TIPO!r} (usa {', '.join(TIPOS_INDICE)})")
+INDICE_NLIST = int(os.getenv("ECOMARKET_INDICE_NLIST", "0")) # 0 = automático (~4·√n)
+INDICE_NPROBE = int(os.getenv("ECOMARKET_INDICE_NPROBE", "16"))
+INDICE_HNSW_M = int(os.getenv("ECOMARKET_INDICE_HNSW_M", "32"))
+INDICE_EF_CONSTRUCCION = int(os.getenv("ECOMARKET_INDICE_EF_CONSTRUCCION", "200"))
+INDICE_EF_BUSQUEDA = int(os.getenv("ECOMARKET_INDICE_EF_BUSQUEDA", "64"))
+INDICE_PQ_M = int(os.getenv("ECOMARKET_INDICE_PQ_M", "0")) # 0 = automático (subvectores de ~16 valores)
+INDICE_MUESTRA_ENTRENAMIENTO = int(os.getenv("ECOMARKET_INDICE_MUESTRA", "50000"))
+# Leer el índice con memory-mapping: varios procesos comparten una copia de los vectores
+INDICE_MMAP = os.getenv("ECOMARKET_INDICE_MMAP", "1") != "0"
+
+# Particiones: un índice FAISS por fuente (pedidos, catálogo, políticas...) además del global.
+# Cada consulta busca solo en las particiones que elige el enrutador, sembrado con el mapa de
+# temas de indice_maestro.txt; si no puede descartar ninguna, se usa el índice global.
+PARTICIONES_ACTIVAS = os.getenv("ECOMARKET_PARTICIONES", "1") != "0"
+PARTICIONES_PATH = os.path.join(VECTORSTORE_PATH, "particiones")
+PARTICIONES_HILOS = int(os.getenv("ECOMARKET_PARTICIONES_HILOS", "4"))
+MAPA_TEMAS_PATH = os.getenv("ECOMARKET_MAPA_TEMAS", os.path.join(DATA_DIR, "indice_maestro.txt"))
+metricas.definir_contador("ecomarket_particiones_total", "Consultas híbridas por partición buscada")
+_embeddings = None
+metricas.definir_indicador("ecomarket_cache_embeddings_aciertos", "Embeddings servidos desde la caché en disco",
+                           lambda: _embeddings.aciertos if _embeddings is not None else None)
+metricas.definir_indicador("ecomarket_cache_embeddings_fallos", "Embeddings que hubo que calcular",
+                           lambda: _embeddings.fallos if _embeddings is not None else None)
+
+
+def obtener_embeddings(api_key):
+    """Devuelve el objeto de embeddings del backend configurado envuelto en la caché persistente.
+       Se crea una sola vez y se reutiliza en todas las llamadas (el backend local no usa `api_key`).
+    """
+    global _embeddings
+    if _embeddings is None:
+        if EMBEDDINGS_BACKEND == "local":
+            from embeddings_locales import EmbeddingsLocales
+            base = EmbeddingsLocales(EMBEDDING_MODEL, tam_lote=EMBEDDINGS_LOTE_LOCAL, hilos=EMBEDDINGS_HILOS or None)
+        else:
+            # Sin reintentos propios del SDK: los 429 de la construcción los reintenta embeber_en_lotes
+            # (una sola política de espera); una consulta que recibe un 429 falla y muestra el aviso
+            base = OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=api_key, base_url=EMBEDDINGS_BASE_URL,
+                                    max_retries=0)
+        _embeddings = CacheEmbeddings(base, EMBEDDING_MODEL, EMBEDDINGS_CACHE_PATH,
+                                      max_entradas=_capacidad_cache_embeddings(_fragmentos_indexados()))
+        # Los últimos usos de la caché se escriben por lotes: los pendientes se guardan al salir
+        atexit.register(_embeddings.cerrar)
+    return _embeddings
+
+
+def _capacidad_cache_embeddings(fragmentos):
+    """Entradas máximas de la caché de embeddings para un corpus de `fragmentos` fragmentos."""
+    if EMBEDDINGS_CACHE_MAX > 0:
+        return EMBEDDINGS_CACHE_MAX
+    return max(EMBEDDINGS_CACHE_MIN, int(fragmentos * (1 + EMBEDDINGS_CACHE_MARGEN)))
+
+
+def _fragmentos_indexados():
+    """Vectores del índice guardado según su manifest (0 si no hay), sin validarlo."""
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            return int(json.load(f).get("num_vectores", 0))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return 0
+
+
+def embeddings_disponibles():
+    """Indica si el backend de embeddings puede usarse (OpenAI necesita OPENAI_API_KEY)."""
+    return EMBEDDINGS_BACKEND == "local" or bool(os.getenv("OPENAI_API_KEY"))
+
+
+def dimension_embeddings():
+    """Dimensión de los vectores del backend configurado, o None si no se conoce sin llamar a la API."""
+    if EMBEDDINGS_BACKEND == "local":
+        return obtener_embeddings(None).embeddings.dimension
+    return DIMENSIONES_OPENAI.get(EMBEDDING_MODEL)
+
+
+@metricas.medido("carga_archivos")
+def _cargar_archivos(filenames):
+    """Carga y fragmenta archivos de DATA_DIR. Los PDF, XLSX y archivos grandes se reparten entre
+       hasta PROCESOS_CARGA procesos si hay al menos dos; el resto se carga en serie.
+       Los resultados (fragmentos, segundos, error) se devuelven en el mismo orden que `filenames`
+       y los tiempos y errores de cada archivo quedan en informe_construccion["archivos"].
+    """
+    rutas = [os.path.join(DATA_DIR, filename) for filename in filenames]
+    inicio = time.perf_counter()
+    procesar = functools.partial(procesar_archivo, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    resultados = [None] * len(rutas)
+    costosos = [i for i, ruta in enumerate(rutas) if es_costoso(ruta)]
+    procesos = min(PROCESOS_CARGA, len(costosos))
+    if procesos > 1:
+        try:
+            # "spawn" evita heredar locks de otros hilos (p. ej. el de precalentamiento) al hacer fork.
+            # La función del pool vive en carga_archivos, así que los procesos no importan app como
+            # módulo (solo vuelven a ejecutar el script principal, como hace siempre "spawn")
+            contexto = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+                for i, resultado in zip(costosos, pool.map(procesar, [rutas[i] for i in costosos])):
+                    resultados[i] = resultado
+        except Exception as e:
+            print(f"⚠️ Falló la carga en paralelo ({e}). Cargando los archivos en serie...")
+            procesos = 1
+    else:
+        procesos = 1
+    for i, ruta in enumerate(rutas):
+        if resultados[i] is None:
+            resultados[i] = procesar(ruta)
+
+    informe_construccion["procesos_carga"] = procesos
+    informe_construccion["segundos_carga"] = time.perf_counter() - inicio
+    informe_construccion["archivos"] = []
+    for filename, (fragmentos, segundos, error) in zip(filenames, resultados):
+        informe_construccion["archivos"].append(
+            {"archivo": filename, "fragmentos": len(fragmentos), "segundos": segundos, "error": error}
+        )
+        if error:
+            print(f"⚠️ Error al cargar '{filename}': {error}")
+        else:
+            print(f"✅ '{filename}' cargado ({len(fragmentos)} fragmentos, {segundos:.2f}s).")
+    return resultados
+
+
+def _guardar_informe():
+    """Guarda informe_construccion junto al índice."""
+    try:
+        with open(INFORME_PATH, "w", encoding="utf-8") as f:
+            json.dump(informe_construccion, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar el informe de construcción: {e}")
+
+
+@metricas.medido("conversion_indice")
+def _convertir_indice(db):
+    """Convierte el índice plano del vectorstore al tipo configurado y registra el recall frente a él."""
+    if INDICE_TIPO == "flat":
+        return
+    db.index, informe = convertir_indice(
+        db.index,
+        INDICE_TIPO,
+        producto_interno=ESTRATEGIA_DISTANCIA == DistanceStrategy.MAX_INNER_PRODUCT,
+        muestra=INDICE_MUESTRA_ENTRENAMIENTO,
+        nprobe=INDICE_NPROBE,
+        ef_busqueda=INDICE_EF_BUSQUEDA,
+        nlist=INDICE_NLIST,
+        hnsw_m=INDICE_HNSW_M,
+        ef_construccion=INDICE_EF_CONSTRUCCION,
+        pq_m=INDICE_PQ_M,
+    )
+    informe_construccion["indice"] = informe
+    if informe["tipo_efectivo"] != "flat":
+        print(f"🧭 Índice {informe['tipo_efectivo']} construido en {informe['segundos']:.1f}s "
+              f"(recall@10 frente al índice plano: {informe['recall_a_10']:.3f}).")
+
+
+def _abrir_almacen(db):
+    """Conecta el vectorstore al almacén de fragmentos en disco: ids y textos se leen bajo demanda."""
+    almacen = AlmacenFragmentos(VECTORSTORE_PATH)
+    if len(almacen) != db.index.ntotal:
+        raise ValueError(f"El almacén tiene {len(almacen)} fragmentos y el índice {db.index.ntotal} vectores.")
+    db.docstore = DocstoreFragmentos(almacen)
+    db.index_to_docstore_id = IdsPorPosicion(almacen)
+    return db
+
+
+def _firma_vectorstore(sufijo=""):
+    """Tamaño de cada archivo del índice, el almacén y el índice léxico, y hash de la tabla de ids
+       del almacén. Con `sufijo` se calcula sobre los temporales, que al renombrarse dan la misma.
+    """
+    rutas = [os.path.join(VECTORSTORE_PATH, "index.faiss"), INDICE_LEXICO_PATH, *AlmacenFragmentos.archivos(VECTORSTORE_PATH)]
+    firma = {os.path.basename(ruta): os.path.getsize(ruta + sufijo) for ruta in rutas}
+    firma["ids_sha256"] = _hash_archivo(AlmacenFragmentos.archivos(VECTORSTORE_PATH, sufijo)[-1])
+    return firma
+
+
+@metricas.medido("guardado_vectorstore")
+def guardar_vectorstore(db, archivos):
+    """Guarda el índice FAISS, los fragmentos (en el orden de sus vectores), el índice léxico y el
+       manifest con los `archivos` indexados en VECTORSTORE_PATH.
+
+       Todo se escribe primero en archivos temporales y después se renombra, el manifest el último
+       y con la firma de los demás: si el proceso se interrumpe entre dos renombrados, la firma no
+       coincide, el manifest se descarta y el vectorstore se reconstruye (desde la caché de embeddings).
+    """
+    def fragmentos():
+        for posicion in range(db.index.ntotal):
+            id_fragmento = db.index_to_docstore_id[posicion]
+            documento = db.docstore.search(id_fragmento)
+            if not isinstance(documento, Document):
+                raise ValueError(f"Fragmento {id_fragmento} ausente del docstore.")
+            yield id_fragmento, documento
+
+    ruta_indice = os.path.join(VECTORSTORE_PATH, "index.faiss")
+    AlmacenFragmentos.escribir(VECTORSTORE_PATH, fragmentos(), sufijo=".tmp")
+    escribir_indice(db.index, ruta_indice + ".tmp")
+    _reconstruir_indice_lexico(db, INDICE_LEXICO_PATH + ".tmp") # No necesita embeddings: se rehace completo
+    _guardar_manifest(archivos, db, _firma_vectorstore(".tmp"), MANIFEST_PATH + ".tmp")
+    for ruta in (*AlmacenFragmentos.archivos(VECTORSTORE_PATH), ruta_indice, INDICE_LEXICO_PATH, MANIFEST_PATH):
+        os.replace(ruta + ".tmp", ruta)
+    # El docstore pickle de versiones anteriores ya no se usa
+    pickle_anterior = os.path.join(VECTORSTORE_PATH, "index.pkl")
+    if os.path.exists(pickle_anterior):
+        os.remove(pickle_anterior)
+    # Los fragmentos en memoria se sustituyen por la vista sobre disco
+    return _abrir_almacen(db)
+
+
+def _leer_vectorstore(embeddings, mmap=INDICE_MMAP):
+    """Lee el vectorstore guardado con guardar_vectorstore. El índice se lee con memory-mapping si `mmap`;
+       los fragmentos no se cargan: se materializan cuando el retriever los devuelve.
+    """
+    index = leer_indice(os.path.join(VECTORSTORE_PATH, "index.faiss"), mmap=mmap)
+    configurar_busqueda(index, INDICE_NPROBE, INDICE_EF_BUSQUEDA)
+    db = FAISS(embeddings, index, DocstoreFragmentos(), {}, distance_strategy=ESTRATEGIA_DISTANCIA)
+    return _abrir_almacen(db)
+
+
+@metricas.medido("indice_lexico")
+def _reconstruir_indice_lexico(db, ruta=INDICE_LEXICO_PATH):
+    """Construye y guarda el índice léxico a partir de los fragmentos del vectorstore."""
+    fragmentos = ((i, db.docstore.search(i).page_content) for i in db.index_to_docstore_id.values())
+    indice = IndiceLexico.construir(fragmentos)
+    indice.guardar(ruta)
+    return indice
+
+
+def cargar_indice_lexico(db):
+    """Carga el índice léxico guardado; si no existe o no coincide con el vectorstore, lo reconstruye."""
+    try:
+        indice = IndiceLexico.cargar(INDICE_LEXICO_PATH)
+        if indice.num_documentos == db.index.ntotal:
+            return indice
+        print("⚠️ El índice léxico no coincide con el vectorstore. Reconstruyéndolo...")
+    except FileNotFoundError:
+        print("⚙️ No existe índice léxico. Construyéndolo...")
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ Índice léxico ilegible ({e}). Reconstruyéndolo...")
+    return _reconstruir_indice_lexico(db)
+
+
+def _configuracion_particiones(db):
+    """Configuración con la que se crean las particiones: si cambia, se reconstruyen todas."""
+    return {"modelo_embeddings": EMBEDDING_MODEL, "dimension": db.index.d, "tipo_indice": INDICE_TIPO,
+            "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+
+@metricas.medido("particiones")
+def _construir_particiones(db, archivos):
+    """Crea o actualiza los índices por partición; solo se rehacen los de archivos que cambiaron."""
+    if not PARTICIONES_ACTIVAS:
+        return
+    informe = construir_particiones(
+        PARTICIONES_PATH,
+        db.index,
+        db.docstore.almacen,
+        archivos,
+        _configuracion_particiones(db),
+        mapa_temas=MAPA_TEMAS_PATH,
+        tipo=INDICE_TIPO,
+        producto_interno=ESTRATEGIA_DISTANCIA == DistanceStrategy.MAX_INNER_PRODUCT,
+        firma_vectorstore=_firma_vectorstore(),
+        muestra=INDICE_MUESTRA_ENTRENAMIENTO,
+        nprobe=INDICE_NPROBE,
+        ef_busqueda=INDICE_EF_BUSQUEDA,
+        nlist=INDICE_NLIST,
+        hnsw_m=INDICE_HNSW_M,
+        ef_construccion=INDICE_EF_CONSTRUCCION,
+        pq_m=INDICE_PQ_M,
+    )
+    informe_construccion["particiones"] = informe
+    if informe:
+        print(f"🗂️ Particiones reconstruidas: {', '.join(sorted(informe))}.")
+
+
+def cargar_particiones(db):
+    """Carga los índices por partición (construyéndolos si faltan). None si están desactivados
+       o no pueden crearse: el retriever usa entonces solo el índice global."""
+    if not PARTICIONES_ACTIVAS or db is None:
+        return None
+    try:
+        argumentos = dict(mmap=INDICE_MMAP, hilos=PARTICIONES_HILOS, nprobe=INDICE_NPROBE,
+                          ef_busqueda=INDICE_EF_BUSQUEDA, firma_vectorstore=_firma_vectorstore())
+        particiones = Particiones.cargar(PARTICIONES_PATH, _configuracion_particiones(db), db.index.ntotal, **argumentos)
+        if particiones is None:
+            manifest = _cargar_manifest()
+            if not manifest or not manifest["archivos"]:
+                return None
+            print("⚙️ Construyendo los índices por partición...")
+            _construir_particiones(db, manifest["archivos"])
+            particiones = Particiones.cargar(PARTICIONES_PATH, _configuracion_particiones(db), db.index.ntotal, **argumentos)
+    except Exception as e:
+        print(f"⚠️ No se pudieron cargar las particiones ({e}). Se busca en el índice global.")
+        return None
+    if particiones is not None:
+        print(f"🗂️ {len(particiones.indices)} particiones: {', '.join(sorted(particiones.indices))}.")
+    return particiones
+
+
+def _hash_archivo(filepath):
+    """Calcula el SHA-256 del contenido binario de un archivo."""
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _ids_fragmentos(filename, fragmentos):
+    """Asigna a cada fragmento un id estable derivado de su archivo y de su contenido.
+       Los fragmentos repetidos dentro del mismo archivo reciben un sufijo '-n'.
+    """
+    ids, vistos = [], {}
+    for fragmento in fragmentos:
+        base = hashlib.sha256(f"{filename}\0{fragmento.page_content}".encode("utf-8")).hexdigest()
+        n = vistos.get(base, 0)
+        vistos[base] = n + 1
+        ids.append(base if n == 0 else f"{base}-{n}")
+    return ids
+
+
+def _archivos_datos():
+    """Lista (ordenada) los archivos soportados de DATA_DIR."""
+    asegurar_carpeta_datos()
+    archivos = []
+    for filename in sorted(os.listdir(DATA_DIR)):
+        filepath = os.path.join(DATA_DIR, filename)
+        if not os.path.isfile(filepath): # Ignorar directorios
+            continue
+        if not filename.endswith(EXTENSIONES_SOPORTADAS):
+            print(f"⏭️ Saltando archivo '{filename}': Tipo no soportado.")
+            continue
+        archivos.append(filename)
+    return archivos
+
+
+def _cargar_manifest():
+    """Lee el manifest del vectorstore. Devuelve None si no existe o es incompatible."""
+    try:
+        with open(MANIFEST_PATH, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ Manifest ilegible en {MANIFEST_PATH}: {e}")
+        return None
+
+    if (manifest.get("version") != MANIFEST_VERSION
+            or manifest.get("backend_embeddings") != EMBEDDINGS_BACKEND
+            or manifest.get("modelo_embeddings") != EMBEDDING_MODEL
+            or manifest.get("chunk_size") != CHUNK_SIZE
+            or manifest.get("chunk_overlap") != CHUNK_OVERLAP
+            or manifest.get("tipo_indice") != INDICE_TIPO):
+        print("⚠️ El manifest fue creado con otra configuración de fragmentos, embeddings o índice.")
+        return None
+    try:
+        firma = _firma_vectorstore()
+    except OSError:
+        firma = None
+    if manifest.get("firma") != firma:
+        print("⚠️ El manifest no corresponde a los archivos del índice (¿escritura interrumpida?).")
+        return None
+    dimension = dimension_embeddings()
+    if dimension is not None and manifest.get("dimension") != dimension:
+        print(f"⚠️ El índice tiene vectores de dimensión {manifest.get('dimension')} y el backend "
+              f"'{EMBEDDINGS_BACKEND}' produce {dimension}.")
+        return None
+    return manifest
+
+
+def _guardar_manifest(archivos, db, firma, ruta=MANIFEST_PATH):
+    """Escribe el manifest de forma atómica (archivo temporal + os.replace).
+       Incluye el número de vectores y las fuentes indexadas para no tener que consultar el índice,
+       y la firma de los archivos que describe (ver guardar_vectorstore).
+    """
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "backend_embeddings": EMBEDDINGS_BACKEND,
+        "modelo_embeddings": EMBEDDING_MODEL,
+        "dimension": db.index.d,
+        "tipo_indice": INDICE_TIPO,
+        "tipo_indice_efectivo": tipo_de_indice(db.index),
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "num_vectores": db.index.ntotal,
+        "fuentes": sorted(archivos) if archivos else ["dummy"],
+        "archivos": archivos,
+        "firma": firma,
+    }
+    tmp_path = ruta + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, ruta)
+
+
+def vectorstore_tiene_documentos(manifest):
+    """Indica, a partir de los metadatos del manifest, si el índice contiene documentos reales
+       (y no solo el documento dummy).
+    """
+    if not manifest or manifest.get("num_vectores", 0) <= 0:
+        return False
+    return any(fuente != "dummy" for fuente in manifest.get("fuentes", []))
+
+
+@metricas.medido("embeddings_construccion")
+def _embeber_fragmentos(fragmentos, embeddings, fragmentos_corpus=None):
+    """Embebe los fragmentos por lotes y registra el rendimiento en informe_construccion.
+       `fragmentos_corpus` es el tamaño del corpus completo (por defecto, los fragmentos dados):
+       la caché se amplía para que quepa entero. Devuelve los pares (texto, vector) y los
+       metadatos, listos para FAISS.
+    """
+    textos = [fragmento.page_content for fragmento in fragmentos]
+    corpus = fragmentos_corpus or len(textos)
+    capacidad = getattr(embeddings, "max_entradas", None)
+    if capacidad is not None:
+        capacidad = embeddings.asegurar_capacidad(_capacidad_cache_embeddings(corpus))
+        if capacidad < corpus:
+            print(f"⚠️ La caché de embeddings admite {capacidad} entradas y el corpus tiene {corpus} fragmentos "
+                  "(ECOMARKET_EMBEDDINGS_CACHE_MAX): reanudar o reconstruir volverá a embeber los desalojados.")
+    desalojadas_previas = getattr(embeddings, "desalojadas", 0)
+    vectores, informe = embeber_en_lotes(
+        textos,
+        embeddings,
+        tam_lote=EMBEDDINGS_TAM_LOTE,
+        # El modelo local ya paraleliza en CPU y atiende un lote a la vez: un solo hilo basta
+        trabajadores=EMBEDDINGS_TRABAJADORES if EMBEDDINGS_BACKEND == "openai" else 1,
+        max_reintentos=EMBEDDINGS_REINTENTOS,
+    )
+    informe["desalojados_cache"] = getattr(embeddings, "desalojadas", 0) - desalojadas_previas
+    informe_construccion["embeddings"] = informe
+    print(f"⚡ {informe['fragmentos']} fragmentos embebidos en {informe['segundos']:.1f}s "
+          f"({informe['fragmentos_por_segundo']:.1f} fragmentos/s, {informe['desde_cache']} desde caché, "
+          f"{informe['reintentos']} reintentos).")
+    if informe["desalojados_cache"]:
+        print(f"⚠️ La caché de embeddings desalojó {informe['desalojados_cache']} entradas durante la construcción: "
+              "no todo el corpus podrá reutilizarse desde la caché.")
+    return list(zip(textos, vectores)), [fragmento.metadata for fragmento in fragmentos]
+
+
+@metricas.medido("construccion_completa")
 def crear_vectorstore():
     """Crea y guarda un vectorstore FAISS a partir de documentos en DATA_DIR."""
     print("⚙️ Creando nuevo vectorstore desde documentos...")
-    documentos = []
-    archivos_cargados = 0
+    texts, ids = [], []
+    archivos = {}
+    informe_construccion.clear()
+    informe_construccion.update({"tipo": "completa", "fecha": time.strftime("%Y-%m-%dT%H:%M:%S")})
 
     # Asegúrate de que la carpeta VECTORSTORE_PATH exista para evitar errores al guardar
     os.makedirs(VECTORSTORE_PATH, exist_ok=True)
 
-    for filename in os.listdir(DATA_DIR):
-        filepath = os.path.join(DATA_DIR, filename)
-        if not os.path.isfile(filepath): # Ignorar directorios
-             continue
+    filenames = _archivos_datos()
+    for filename, (fragmentos, _, error) in zip(filenames, _cargar_archivos(filenames)):
+        if error:
+            continue
         try:
-            if filename.endswith(".txt"):
-                loader = TextLoader(filepath)
-            elif filename.endswith(".csv"):
-                loader = CSVLoader(filepath)
-            elif filename.endswith(".xlsx"):
-                loader = UnstructuredExcelLoader(filepath)
-            elif filename.endswith(".pdf"):
-                 # Asegúrate de que poppler-utils esté instalado en el entorno para PDFs
-                 loader = UnstructuredPDFLoader(filepath)
-            else:
-                print(f"⏭️ Saltando archivo '{filename}': Tipo no soportado.")
-                continue # Saltar archivos no soportados
+            hash_archivo = _hash_archivo(os.path.join(DATA_DIR, filename))
+        except OSError as e:
+            print(f"⚠️ Error al leer '{filename}': {e}")
+            continue
 
-            docs = loader.load()
-            documentos.extend(docs)
-            archivos_cargados += 1
-            print(f"✅ '{filename}' cargado.")
+        ids_archivo = _ids_fragmentos(filename, fragmentos)
+        texts.extend(fragmentos)
+        ids.extend(ids_archivo)
+        archivos[filename] = {"hash": hash_archivo, "fragmentos": ids_archivo}
 
-        except Exception as e:
-            print(f"⚠️ Error al cargar '{filename}': {e}")
-
-    if not documentos:
+    if not texts:
         # No lanzar error aquí, permitir que la app corra sin RAG si no hay documentos
         print("❌ No se encontraron documentos válidos o hubo errores al cargarlos. El RAG no estará disponible.")
         # Intentar crear un vectorstore vacío para que la carga posterior no falle completamente
         try:
-             embeddings = OpenAIEmbeddings(model="text-embedding-3-small", api_key=os.getenv("OPENAI_API_KEY"))
-             # Crear un documento dummy si no hay documentos reales para inicializar FAISS
-             # Esto es una solución alternativa si FAISS.from_documents necesita al menos un documento
-             from langchain_core.documents import Document
-             # Crear un documento dummy solo si realmente no hay documentos
-             if not documentos:
-                 documentos_para_faiss = [Document(page_content="No hay documentos cargados para el RAG.", metadata={"source": "dummy"})]
-             else:
-                 documentos_para_faiss = documentos # Usar documentos reales si se cargó alguno a pesar de errores
-
-             db = FAISS.from_documents(documentos_para_faiss, embeddings)
-             db.save_local(VECTORSTORE_PATH)
+             embeddings = obtener_embeddings(os.getenv("OPENAI_API_KEY"))
+             # Crear un documento dummy para inicializar FAISS, que necesita al menos un documento
+             documentos_para_faiss = [Document(page_content="No hay documentos cargados para el RAG.", metadata={"source": "dummy"})]
+             db = FAISS.from_documents(documentos_para_faiss, embeddings, distance_strategy=ESTRATEGIA_DISTANCIA)
+             guardar_vectorstore(db, {})
              print("✅ Vectorstore (inicializado) creado.")
              return db
         except Exception as e_empty:
              print(f"❌ Error fatal al intentar inicializar vectorstore: {e_empty}")
              return None # Retornar None si incluso la inicialización falla
 
-
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    texts = splitter.split_documents(documentos)
     print(f"📄 Total de fragmentos generados: {len(texts)}")
 
-    # Asegúrate de que la API key de OpenAI esté disponible aquí
+    # Con el backend de OpenAI, asegúrate de que la API key esté disponible aquí
     api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    if not embeddings_disponibles():
          print("⚠️ OPENAI_API_KEY no está configurada. No se pueden crear embeddings.")
          return None
 
     try:
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-small", api_key=api_key)
-        db = FAISS.from_documents(texts, embeddings)
-        db.save_local(VECTORSTORE_PATH)
+        embeddings = obtener_embeddings(api_key)
+        # Si la construcción falla a mitad, los lotes ya embebidos quedan en la caché de embeddings
+        # y el siguiente intento solo envía al proveedor los que faltan
+        pares, metadatos = _embeber_fragmentos(texts, embeddings)
+        db = FAISS.from_embeddings(pares, embeddings, metadatas=metadatos, ids=ids,
+                                   distance_strategy=ESTRATEGIA_DISTANCIA)
+        _convertir_indice(db)
+        guardar_vectorstore(db, archivos)
+        _construir_particiones(db, archivos) # Las particiones sin cambios se conservan
+        cache_respuestas.invalidar() # Las respuestas previas se basaban en el índice anterior
+        _guardar_informe()
         print("✅ Vectorstore creado correctamente en:", VECTORSTORE_PATH)
         return db
     except Exception as e:
@@ -278,22 +962,142 @@ def crear_vectorstore():
         return None # Retornar None si la creación falla
 
 
+@metricas.medido("actualizacion_incremental")
+def _borrar_fragmentos(db, ids):
+    """Como FAISS.delete, pero borrando con borrar_posiciones: en IVF los vectores restantes
+       se renumeran igual que index_to_docstore_id y no hace falta reconstruir el índice."""
+    posicion_de = {id_fragmento: posicion for posicion, id_fragmento in db.index_to_docstore_id.items()}
+    posiciones = {posicion_de[id_fragmento] for id_fragmento in ids}
+    borrar_posiciones(db.index, posiciones)
+    db.docstore.delete(ids)
+    restantes = [i for posicion, i in sorted(db.index_to_docstore_id.items()) if posicion not in posiciones]
+    db.index_to_docstore_id = dict(enumerate(restantes))
+
+
+def actualizar_vectorstore(db):
+    """Sincroniza un vectorstore cargado con DATA_DIR usando el manifest de hashes.
+       Solo embebe los fragmentos nuevos o modificados y borra los de archivos eliminados.
+       Si no hay manifest compatible, reconstruye el vectorstore completo.
+    """
+    manifest = _cargar_manifest()
+    if manifest is None:
+        print("⚙️ Sin manifest compatible. Reconstruyendo el vectorstore completo...")
+        return crear_vectorstore()
+
+    anteriores = manifest["archivos"]
+    archivos = {}
+    docs_nuevos, ids_nuevos, ids_eliminar = [], [], []
+    informe_construccion.clear()
+    informe_construccion.update({"tipo": "incremental", "fecha": time.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    modificados = {}
+    for filename in _archivos_datos():
+        previo = anteriores.get(filename)
+        try:
+            hash_archivo = _hash_archivo(os.path.join(DATA_DIR, filename))
+        except OSError as e:
+            print(f"⚠️ Error al leer '{filename}': {e}")
+            if previo:
+                archivos[filename] = previo # Conservar la versión ya indexada
+            continue
+        if previo and previo["hash"] == hash_archivo:
+            archivos[filename] = previo # Sin cambios: no se vuelve a cargar ni embeber
+        else:
+            modificados[filename] = hash_archivo
+
+    filenames = list(modificados)
+    for filename, (fragmentos, _, error) in zip(filenames, _cargar_archivos(filenames)):
+        previo = anteriores.get(filename)
+        hash_archivo = modificados[filename]
+        if error:
+            if previo:
+                archivos[filename] = previo # Conservar la versión ya indexada
+            continue
+
+        ids_archivo = _ids_fragmentos(filename, fragmentos)
+        ids_previos = set(previo["fragmentos"]) if previo else set()
+        ids_actuales = set(ids_archivo)
+        nuevos = 0
+        for fragmento, id_fragmento in zip(fragmentos, ids_archivo):
+            if id_fragmento not in ids_previos:
+                docs_nuevos.append(fragmento)
+                ids_nuevos.append(id_fragmento)
+                nuevos += 1
+        eliminados = [i for i in ids_previos if i not in ids_actuales]
+        ids_eliminar.extend(eliminados)
+        archivos[filename] = {"hash": hash_archivo, "fragmentos": ids_archivo}
+        print(f"🔄 '{filename}' {'modificado' if previo else 'nuevo'}: {nuevos} fragmentos a embeber, {len(eliminados)} a eliminar.")
+
+    for filename, previo in anteriores.items():
+        if filename not in archivos:
+            ids_eliminar.extend(previo["fragmentos"])
+            print(f"🗑️ '{filename}' ya no existe: {len(previo['fragmentos'])} fragmentos a eliminar.")
+
+    if not docs_nuevos and not ids_eliminar:
+        print("✅ Vectorstore al día con los documentos de", DATA_DIR)
+        return db
+
+    if not anteriores:
+        # El índice solo tenía el documento dummy: se reconstruye en lugar de sumar a él
+        return crear_vectorstore()
+
+    if not any(a["fragmentos"] for a in archivos.values()):
+        # Sin documentos restantes: se recrea el vectorstore (con el documento dummy)
+        return crear_vectorstore()
+
+    existentes = set(db.index_to_docstore_id.values())
+    ids_eliminar = [i for i in ids_eliminar if i in existentes]
+    if ids_eliminar and tipo_de_indice(db.index) == "hnsw":
+        # HNSW no permite borrar: se reconstruye (los fragmentos sin cambios salen de la caché de embeddings)
+        print("⚙️ El índice HNSW no admite borrados. Reconstruyendo el vectorstore completo...")
+        return crear_vectorstore()
+
+    try:
+        if INDICE_MMAP:
+            # Un índice mapeado es de solo lectura: se lee a memoria antes de modificarlo
+            db.index = configurar_busqueda(leer_indice(os.path.join(VECTORSTORE_PATH, "index.faiss"), mmap=False),
+                                           INDICE_NPROBE, INDICE_EF_BUSQUEDA)
+        # Primero se embeben los nuevos: si falla, el vectorstore y el manifest quedan intactos
+        if docs_nuevos:
+            pares, metadatos = _embeber_fragmentos(
+                docs_nuevos, db.embeddings, fragmentos_corpus=sum(len(a["fragmentos"]) for a in archivos.values())
+            )
+            db.add_embeddings(pares, metadatas=metadatos, ids=ids_nuevos)
+        if ids_eliminar:
+            _borrar_fragmentos(db, ids_eliminar)
+        if tipo_de_indice(db.index) == "flat":
+            _convertir_indice(db) # Si el índice era plano por falta de vectores, puede que ya alcancen
+        guardar_vectorstore(db, archivos)
+        _construir_particiones(db, archivos)
+        cache_respuestas.invalidar() # Las respuestas previas se basaban en el índice anterior
+        _guardar_informe()
+        print(f"✅ Vectorstore actualizado: {len(docs_nuevos)} fragmentos embebidos, {len(ids_eliminar)} eliminados.")
+    except Exception as e:
+        print(f"❌ Error al actualizar el vectorstore de forma incremental: {e}")
+    return db
+
+
 def cargar_o_crear_vectorstore():
-    """Carga un vectorstore existente o crea uno nuevo."""
+    """Carga un vectorstore existente (actualizándolo si cambiaron los documentos) o crea uno nuevo."""
     index_path = os.path.join(VECTORSTORE_PATH, "index.faiss")
     try:
-        if not os.path.exists(index_path):
+        if not os.path.exists(index_path) or not AlmacenFragmentos.existe(VECTORSTORE_PATH):
             print("⚙️ No existe vectorstore previo. Creando uno nuevo...")
             return crear_vectorstore()
         else:
+            # Un índice creado con otro backend, modelo o dimensión no se carga: sus vectores
+            # no son comparables con los de las consultas
+            if _cargar_manifest() is None:
+                print("⚙️ El vectorstore existente no coincide con la configuración de embeddings. Reconstruyendo...")
+                return crear_vectorstore()
             print("✅ Cargando vectorstore existente desde:", VECTORSTORE_PATH)
-            # Asegúrate de que la API key de OpenAI esté disponible aquí
+            # Con el backend de OpenAI, asegúrate de que la API key esté disponible aquí
             api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
+            if not embeddings_disponibles():
                  print("⚠️ OPENAI_API_KEY no está configurada. No se pueden cargar embeddings.")
                  # Intentar cargar sin embeddings si es posible o retornar None
                  try:
-                     db = FAISS.load_local(VECTORSTORE_PATH, allow_dangerous_deserialization=True)
+                     db = _leer_vectorstore(None)
                      print("💾 Vectorstore cargado SIN embeddings (funcionalidad limitada).")
                      return db
                  except Exception as e_no_emb:
@@ -301,153 +1105,364 @@ def cargar_o_crear_vectorstore():
                       return None
 
             try:
-                embeddings = OpenAIEmbeddings(model="text-embedding-3-small", api_key=api_key)
-                db = FAISS.load_local(VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
+                embeddings = obtener_embeddings(api_key)
+                db = _leer_vectorstore(embeddings)
                 print("💾 Vectorstore cargado correctamente.")
-                return db
             except Exception as e_load:
                  print(f"❌ Error al cargar vectorstore CON embeddings: {e_load}")
                  print("🔁 Intentando regenerarlo desde documentos...")
                  return crear_vectorstore()
+            return actualizar_vectorstore(db)
 
     except Exception as e:
         print(f"⚠️ Error general al cargar el vectorstore: {e}")
         print("🔁 Intentando regenerarlo desde documentos...")
         return crear_vectorstore()
 
-# Cargar o crear el vectorstore al inicio
-vectorstore = cargar_o_crear_vectorstore()
-
-
 # ==========================
-# 6️⃣ LLM (GPT-4o-mini) + RAG
+# 6️⃣ LLM (GPT-4o-mini) + RAG (inicialización diferida)
 # ==========================
+# Importar este módulo no carga el índice ni crea el LLM: todo se inicializa en el primer
+# uso a través de obtener_rag_chain(), o antes en un hilo de fondo con iniciar_precalentamiento().
+vectorstore = None
 llm = None
 rag_chain = None
 retriever = None # Inicializar retriever
+vectorstore_tiene_documentos_reales = False
+_rag_inicializado = False
+_rag_lock = threading.Lock()
+# Si la inicialización falla (sin API key, índice vacío, error de red...), se reintenta en el
+# siguiente uso pasados estos segundos
+RAG_REINTENTO_SEGUNDOS = float(os.getenv("ECOMARKET_RAG_REINTENTO_SEGUNDOS", "30"))
+_rag_ultimo_fallo = None
+
+# Precalentar el RAG en segundo plano al lanzar la interfaz (ECOMARKET_PRECALENTAR=0 lo desactiva)
+PRECALENTAR_RAG = os.getenv("ECOMARKET_PRECALENTAR", "1") == "1"
+
+PROMPT_RAG = PromptTemplate(
+    input_variables=["context", "question"],
+    template=(
+        "Eres un asistente de atención al cliente de EcoMarket.\n"
+        "Usa el siguiente contexto para responder de forma clara y amable en español.\n"
+        "Responde usando únicamente la información contenida en los documentos proporcionados.\n"
+        "Si no encuentras la respuesta en los documentos, responde con: \"No tengo esa información en mis registros.\"\n\n"
+        "Contexto:\n{context}\n\n"
+        "Pregunta: {question}\n"
+        "Respuesta:"
+    ),
+)
 
-api_key = os.getenv("OPENAI_API_KEY")
 
-# Solo inicializar LLM y RAG si la API key y el vectorstore están disponibles y el vectorstore no está vacío
-# Verificar si el vectorstore tiene documentos reales (no solo el dummy)
-vectorstore_tiene_documentos_reales = False
-if vectorstore:
-    try:
-        # Una forma simple de verificar si tiene documentos reales (puede variar según la implementación)
-        # Intentar obtener el retriever y ver si tiene documentos (puede fallar si no hay embeddings/api_key)
-        if api_key:
-            temp_retriever = vectorstore.as_retriever(search_kwargs={"k": 1})
-            test_docs = temp_retriever.get_relevant_documents("test query")
-            # Check if the test query returned any meaningful documents (not just the dummy)
-            if test_docs and not (len(test_docs) == 1 and "dummy" in test_docs[0].metadata.get("source", "")):
-                 vectorstore_tiene_documentos_reales = True
-                 print("✅ Vectorstore contiene documentos reales.")
-            else:
-                 print("⚠️ Vectorstore parece estar vacío o solo contiene documento dummy.")
-        else:
-             print("⚠️ API KEY no disponible, no se puede verificar el contenido del vectorstore.")
-    except Exception as e:
-         print(f"⚠️ Error al verificar contenido del vectorstore: {e}")
+# Contexto del RAG: se recuperan CONTEXTO_CANDIDATOS fragmentos, se fusionan los solapados,
+# se diversifican con MMR (lambda 1 = solo relevancia) y se envían los que quepan en
+# CONTEXTO_TOKENS. ECOMARKET_CONTEXTO_EMPAQUETAR=0 vuelve a los 3 primeros fragmentos sin más.
+# El presupuesto por defecto cubre esos 3 fragmentos (3 × 1000 caracteres ≈ 750 tokens), así
+# que el ahorro sale de quitar duplicados y no de recortar contexto.
+CONTEXTO_EMPAQUETAR = os.getenv("ECOMARKET_CONTEXTO_EMPAQUETAR", "1") != "0"
+CONTEXTO_TOKENS = int(os.getenv("ECOMARKET_CONTEXTO_TOKENS", "750"))
+CONTEXTO_CANDIDATOS = int(os.getenv("ECOMARKET_CONTEXTO_CANDIDATOS", "10"))
+CONTEXTO_MMR_LAMBDA = float(os.getenv("ECOMARKET_CONTEXTO_MMR_LAMBDA", "0.7"))
+CONTEXTO_MAX_FRAGMENTOS = int(os.getenv("ECOMARKET_CONTEXTO_MAX_FRAGMENTOS", "6"))
 
 
-if api_key and vectorstore and vectorstore_tiene_documentos_reales:
-    try:
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3, api_key=api_key)
-
-        prompt = PromptTemplate(
-            input_variables=["context", "question"],
-            template=(
-                "Eres un asistente de atención al cliente de EcoMarket.\n"
-                "Usa el siguiente contexto para responder de forma clara y amable en español.\n"
-                "Responde usando únicamente la información contenida en los documentos proporcionados.\n"
-                "Si no encuentras la respuesta en los documentos, responde con: \"No tengo esa información en mis registros.\"\n\n"
-                "Contexto:\n{context}\n\n"
-                "Pregunta: {question}\n"
-                "Respuesta:"
-            ),
-        )
+metricas.definir_indicador("ecomarket_vectores", "Vectores en el índice FAISS cargado",
+                           lambda: vectorstore.index.ntotal if vectorstore is not None else None)
 
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
 
-        rag_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            retriever=retriever,
-            chain_type="stuff",
-            return_source_documents=False,
-            chain_type_kwargs={"prompt": prompt},
-        )
-        print("✅ Cadena RAG inicializada.")
-    except Exception as e:
-        print(f"⚠️ Error al inicializar la cadena RAG: {e}")
-        rag_chain = None # Asegurarse de que rag_chain sea None si falla la inicialización
-        retriever = None
-else:
-    if not api_key:
-        print("⚠️ OPENAI_API_KEY no configurada. La funcionalidad RAG no estará disponible.")
-    if not vectorstore:
-         print("⚠️ Vectorstore no disponible. La funcionalidad RAG no estará disponible.")
-    elif not vectorstore_tiene_documentos_reales:
-         print("⚠️ Vectorstore vacío o con documento dummy. La funcionalidad RAG no estará completamente operativa.")
+class _MetricasLLM(BaseCallbackHandler):
+    """Mide cada llamada al LLM y registra los tokens de prompt y de respuesta."""
+
+    run_inline = True # Se ejecuta en el propio event loop: solo anota tiempos y contadores
+
+    def __init__(self):
+        self._inicios = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._inicios[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._inicios[run_id] = time.perf_counter()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._inicios.pop(run_id, None)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        inicio = self._inicios.pop(run_id, None)
+        if inicio is not None:
+            metricas.registrar_etapa("llm", inicio, time.perf_counter() - inicio)
+
+        uso = (response.llm_output or {}).get("token_usage") or {}
+        tokens_prompt, tokens_respuesta = uso.get("prompt_tokens"), uso.get("completion_tokens")
+        if tokens_prompt is None:
+            # En streaming el uso llega en los metadatos del mensaje
+            for generaciones in response.generations:
+                for generacion in generaciones:
+                    meta = getattr(getattr(generacion, "message", None), "usage_metadata", None)
+                    if meta:
+                        tokens_prompt, tokens_respuesta = meta.get("input_tokens"), meta.get("output_tokens")
+        if tokens_prompt is None:
+            return
+        metricas.contar("ecomarket_tokens_total", tokens_prompt, tipo="prompt")
+        metricas.contar("ecomarket_tokens_total", tokens_respuesta or 0, tipo="respuesta")
+        metricas.observar("ecomarket_tokens_peticion", tokens_prompt, tipo="prompt")
+        metricas.observar("ecomarket_tokens_peticion", tokens_respuesta or 0, tipo="respuesta")
+        metricas.anotar(tokens_prompt=tokens_prompt, tokens_respuesta=tokens_respuesta)
+
+
+def _inicializar_rag():
+    """Carga (o crea) el vectorstore y construye el LLM, el retriever y la cadena RAG."""
+    global vectorstore, llm, retriever, rag_chain, vectorstore_tiene_documentos_reales
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    # La carga (o construcción) queda como traza: si es lenta se guarda con sus etapas
+    with metricas.traza("carga_vectorstore"):
+        vectorstore = cargar_o_crear_vectorstore()
+
+    # Verificar si el vectorstore tiene documentos reales (no solo el dummy) con los metadatos
+    # guardados junto al índice, sin lanzar una consulta de prueba
+    if vectorstore:
+        vectorstore_tiene_documentos_reales = vectorstore_tiene_documentos(_cargar_manifest())
+        if vectorstore_tiene_documentos_reales:
+            print("✅ Vectorstore contiene documentos reales.")
+        else:
+            print("⚠️ Vectorstore parece estar vacío o solo contiene documento dummy.")
+
+    # Solo inicializar LLM y RAG si la API key y el vectorstore están disponibles y el vectorstore no está vacío
+    if api_key and vectorstore and vectorstore_tiene_documentos_reales:
+        try:
+            # stream_usage: también las respuestas en streaming informan de los tokens consumidos
+            llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3, api_key=api_key,
+                             stream_usage=True, callbacks=[_MetricasLLM()])
+
+            # Retriever híbrido: identificadores (ECO-1001, PROD-001...) solo por el índice léxico,
+            # el resto fusionando BM25 y búsqueda vectorial en las particiones que elija el enrutador
+            indice = cargar_indice_lexico(vectorstore)
+            particiones = cargar_particiones(vectorstore)
+            if CONTEXTO_EMPAQUETAR:
+                # Se piden más candidatos de los que caben y el contexto se empaqueta por tokens
+                hibrido = RetrieverHibrido(vectorstore=vectorstore, indice=indice, particiones=particiones,
+                                           k=CONTEXTO_CANDIDATOS, k_candidatos=max(10, CONTEXTO_CANDIDATOS))
+                retriever = RetrieverEmpaquetado(
+                    base=hibrido, presupuesto_tokens=CONTEXTO_TOKENS, k_base=3,
+                    lambda_mmr=CONTEXTO_MMR_LAMBDA, max_fragmentos=CONTEXTO_MAX_FRAGMENTOS,
+                )
+            else:
+                retriever = RetrieverHibrido(vectorstore=vectorstore, indice=indice, particiones=particiones, k=3)
+
+            # La caché de respuestas usa los mismos embeddings (y su caché) para detectar casi-duplicados
+            cache_respuestas.embeddings = obtener_embeddings(api_key)
+
+            rag_chain = RetrievalQA.from_chain_type(
+                llm=llm,
+                retriever=retriever,
+                chain_type="stuff",
+                return_source_documents=False,
+                chain_type_kwargs={"prompt": PROMPT_RAG},
+            )
+            print("✅ Cadena RAG inicializada.")
+        except Exception as e:
+            print(f"⚠️ Error al inicializar la cadena RAG: {e}")
+            rag_chain = None # Asegurarse de que rag_chain sea None si falla la inicialización
+            retriever = None
+    else:
+        if not api_key:
+            print("⚠️ OPENAI_API_KEY no configurada. La funcionalidad RAG no estará disponible.")
+        if not vectorstore:
+             print("⚠️ Vectorstore no disponible. La funcionalidad RAG no estará disponible.")
+        elif not vectorstore_tiene_documentos_reales:
+             print("⚠️ Vectorstore vacío o con documento dummy. La funcionalidad RAG no estará completamente operativa.")
+
+
+def obtener_rag_chain():
+    """Devuelve la cadena RAG, inicializándola en el primer uso (una sola vez, aunque haya varios hilos).
+       Retorna None si el RAG no está disponible; un fallo se reintenta pasados RAG_REINTENTO_SEGUNDOS.
+    """
+    global _rag_inicializado, _rag_ultimo_fallo
+    if not _rag_inicializado:
+        with _rag_lock:
+            if not _rag_inicializado and (
+                _rag_ultimo_fallo is None or time.monotonic() - _rag_ultimo_fallo >= RAG_REINTENTO_SEGUNDOS
+            ):
+                _rag_ultimo_fallo = time.monotonic() # Si _inicializar_rag lanza, también cuenta como fallo
+                _inicializar_rag()
+                if rag_chain is not None:
+                    _rag_inicializado = True
+                    _rag_ultimo_fallo = None
+    return rag_chain
+
+
+def iniciar_precalentamiento():
+    """Inicializa el RAG en un hilo de fondo para que la primera pregunta no tenga que esperar."""
+    hilo = threading.Thread(target=obtener_rag_chain, name="precalentamiento-rag", daemon=True)
+    hilo.start()
+    return hilo
 
 
 # ==========================
 # 7️⃣ Función de chat (Gradio)
 # ==========================
+# Límite de conversaciones atendidas a la vez por chat_ecomarket_stream y tamaño de la cola de Gradio
+MAX_CONCURRENCIA = int(os.getenv("ECOMARKET_MAX_CONCURRENCIA", "8"))
+MAX_COLA = int(os.getenv("ECOMARKET_MAX_COLA", "64"))
+_semaforo_chat = asyncio.Semaphore(MAX_CONCURRENCIA)
+
+# Tool asociada a cada intención del enrutador (la intención "rag" no tiene tool)
+HERRAMIENTAS = {
+    ESTADO: consultar_estado_solicitud,
+    ELEGIBILIDAD: verificar_elegibilidad_producto,
+    REEMBOLSO: calcular_monto_reembolso,
+    REGISTRO: registrar_solicitud_devolucion,
+}
+
+MENSAJE_SIN_INFORMACION = "No tengo esa información en mis registros."
+MENSAJE_RAG_NO_DISPONIBLE = "No tengo esa información en mis registros (Funcionalidad RAG no activa). Asegúrate de tener la API key configurada y documentos cargados en 'content'."
+
+
+def _responder_con_tools(pregunta, lanzar_errores=False):
+    """Ejecuta la tool que corresponda a la pregunta. Devuelve None si ninguna aplica (se usa el RAG).
+       Con `lanzar_errores`, un fallo de la tool se propaga en vez de devolver el aviso."""
+    # El enrutador analiza el mensaje una sola vez (intención + entidades) y la tool recibe ese análisis
+    with metricas.medir("enrutamiento"):
+        consulta = analizar_consulta(pregunta)
+    metricas.contar("ecomarket_rutas_total", intencion=consulta.intencion)
+    metricas.anotar(intencion=consulta.intencion)
+    herramienta = HERRAMIENTAS.get(consulta.intencion)
+    if herramienta is None:
+        return None
+
+    print(f"DEBUG: Enrutado a {herramienta.__name__} ({consulta.puntuaciones}).")
+    try:
+        with metricas.medir("tool", herramienta=herramienta.__name__):
+            return herramienta(pregunta, consulta)
+    except Exception as e:
+         if lanzar_errores:
+             raise
+         print(f"⚠️ Error al ejecutar {herramienta.__name__}: {e}")
+         return f"⚠️ Ocurrió un error al procesar tu solicitud. Por favor, verifica el formato."
+
+
+def _normalizar_respuesta_rag(texto):
+    """Sustituye respuestas vacías o de 'sin información' por el mensaje estándar."""
+    texto = texto.strip()
+    if not texto or "no tengo esa información" in texto.lower():
+        return MENSAJE_SIN_INFORMACION
+    return texto
+
+
 def chat_ecomarket(pregunta, historial=[]):
-    """Función principal de chat que usa tools o RAG."""
+    """Función principal de chat que usa tools o RAG. Cada llamada se registra como una traza."""
+    with metricas.traza("chat"):
+        return _chat_ecomarket(pregunta)
+
+
+def _consultar_cache_respuestas(pregunta):
+    with metricas.medir("cache_respuestas"):
+        respuesta = cache_respuestas.obtener(pregunta)
+    resultado = "acierto" if respuesta is not None else "fallo"
+    metricas.contar("ecomarket_cache_respuestas_total", resultado=resultado)
+    metricas.anotar(cache_respuestas=resultado)
+    return respuesta
+
+
+def _chat_ecomarket(pregunta, lanzar_errores=False):
+    # Con lanzar_errores (modo por lotes), los fallos de las tools y del RAG se propagan como
+    # excepciones en vez de convertirse en una respuesta de aviso
     # Limpiar espacios en blanco de la pregunta
     pregunta = pregunta.strip()
 
     if not pregunta:
         return "⚠️ Por favor, escribe una pregunta."
 
-    # Priorizar las funciones auxiliares si la pregunta sugiere su uso (ej: tiene ";", o palabras clave)
-    # Una implementación más avanzada podría usar un agente para decidir si usar RAG o una tool
-    pregunta_lower = pregunta.lower()
-    if ";" in pregunta:
-        # Si la pregunta contiene ';', intentar usar una tool
-        try:
-            if "reembolso" in pregunta_lower:
-                 return calcular_monto_reembolso(pregunta)
-            elif "registrar" in pregunta_lower or "solicitud" in pregunta_lower:
-                 return registrar_solicitud_devolucion(pregunta)
-            else: # Por defecto, si tiene ";" pero no las otras palabras clave, usar verificar elegibilidad
-                 return verificar_elegibilidad_producto(pregunta)
-        except Exception as e:
-             print(f"⚠️ Error al procesar solicitud con ';': {e}")
-             return f"⚠️ Ocurrió un error al procesar tu solicitud con ';'. Por favor, verifica el formato."
-    # Considerar palabras clave para activar tools incluso sin ";" si la intención es clara
-    elif "reembolso" in pregunta_lower or "me devuelven" in pregunta_lower or "cuanto me dan" in pregunta_lower:
-         # Intentar activar calcular_monto_reembolso si la pregunta parece relacionada
-         print("DEBUG: Intentando activar calcular_monto_reembolso por palabras clave.")
-         return calcular_monto_reembolso(pregunta) # Pasa la pregunta original para que la función la parsee
-
-    elif "devolver" in pregunta_lower or "devolución" in pregunta_lower or "producto dañado" in pregunta_lower or "producto defectuoso" in pregunta_lower:
-         # Intentar activar verificar_elegibilidad_producto si la pregunta parece relacionada
-         print("DEBUG: Intentando activar verificar_elegibilidad_producto por palabras clave.")
-         return verificar_elegibilidad_producto(pregunta) # Pasa la pregunta original para que la función la parsee
-
-    elif "registrar" in pregunta_lower or "solicitud" in pregunta_lower or "anotar" in pregunta_lower:
-         # Intentar activar registrar_solicitud_devolucion si la pregunta parece relacionada
-         print("DEBUG: Intentando activar registrar_solicitud_devolucion por palabras clave.")
-         return registrar_solicitud_devolucion(pregunta) # Pasa la pregunta original para que la función la parsee
-
+    respuesta_tool = _responder_con_tools(pregunta, lanzar_errores)
+    if respuesta_tool is not None:
+        return respuesta_tool
 
     # Si no contiene ";" y no activa ninguna tool por palabras clave, usar la cadena RAG si está disponible
+    rag_chain = obtener_rag_chain()
     if rag_chain:
         try:
-            respuesta = rag_chain.invoke({"query": pregunta})
+            # Preguntas repetidas (o casi idénticas) se responden desde la caché
+            respuesta_cacheada = _consultar_cache_respuestas(pregunta)
+            if respuesta_cacheada is not None:
+                print("DEBUG: Respuesta obtenida de la caché.")
+                return respuesta_cacheada
+
+            generacion = cache_respuestas.generacion
+            with metricas.medir("rag"):
+                respuesta = rag_chain.invoke({"query": pregunta})
             # Verificar si la respuesta de RAG es válida
-            result_text = respuesta.get("result", "").strip()
-            if not result_text or "no tengo esa información" in result_text.lower():
-                 return "No tengo esa información en mis registros."
+            result_text = _normalizar_respuesta_rag(respuesta.get("result", ""))
+            cache_respuestas.guardar(pregunta, result_text, generacion=generacion)
             return result_text
         except Exception as e:
+            if lanzar_errores:
+                raise
             print(f"⚠️ Error en la cadena RAG: {e}")
             return "⚠️ Ocurrió un error al procesar tu pregunta con RAG."
     else:
         # Si rag_chain no está disponible
-        return "No tengo esa información en mis registros (Funcionalidad RAG no activa). Asegúrate de tener la API key configurada y documentos cargados en 'content'."
+        return MENSAJE_RAG_NO_DISPONIBLE
+
+
+async def chat_ecomarket_stream(pregunta, historial=[]):
+    """Versión asíncrona de chat_ecomarket para Gradio: transmite la respuesta del RAG token a token.
+       Cada valor emitido es el texto acumulado hasta el momento. Las tools y las llamadas
+       bloqueantes se ejecutan en hilos para no detener el event loop.
+    """
+    with metricas.traza("chat_stream"):
+        async for texto in _chat_ecomarket_stream(pregunta):
+            yield texto
+
+
+async def _chat_ecomarket_stream(pregunta):
+    pregunta = pregunta.strip()
+
+    if not pregunta:
+        yield "⚠️ Por favor, escribe una pregunta."
+        return
+
+    async with _semaforo_chat:
+        respuesta_tool = await asyncio.to_thread(_responder_con_tools, pregunta)
+        if respuesta_tool is not None:
+            yield respuesta_tool
+            return
+
+        rag_chain = await asyncio.to_thread(obtener_rag_chain)
+        if not rag_chain:
+            yield MENSAJE_RAG_NO_DISPONIBLE
+            return
+
+        try:
+            respuesta_cacheada = await asyncio.to_thread(_consultar_cache_respuestas, pregunta)
+            if respuesta_cacheada is not None:
+                print("DEBUG: Respuesta obtenida de la caché.")
+                yield respuesta_cacheada
+                return
+
+            generacion = cache_respuestas.generacion
+            # Mismo flujo que la cadena "stuff": recuperar, unir los fragmentos y completar el prompt
+            documentos = await retriever.ainvoke(pregunta)
+            with metricas.medir("prompt"):
+                contexto = "\n\n".join(doc.page_content for doc in documentos)
+                prompt_texto = PROMPT_RAG.format(context=contexto, question=pregunta)
+
+            texto = ""
+            inicio_llm = time.perf_counter()
+            async for fragmento in llm.astream(prompt_texto):
+                if not texto:
+                    metricas.registrar_etapa("llm_primer_token", inicio_llm, time.perf_counter() - inicio_llm)
+                texto += fragmento.content
+                yield texto
+        except Exception as e:
+            print(f"⚠️ Error en la cadena RAG: {e}")
+            yield "⚠️ Ocurrió un error al procesar tu pregunta con RAG."
+            return
+
+        result_text = _normalizar_respuesta_rag(texto)
+        if result_text != texto:
+            yield result_text
+        # Con coincidencia semántica, guardar embebe la pregunta (llamada de red): fuera del event loop
+        await asyncio.to_thread(cache_respuestas.guardar, pregunta, result_text, generacion=generacion)
 
 
 # ==========================
@@ -455,9 +1470,15 @@ def chat_ecomarket(pregunta, historial=[]):
 # ==========================
 # Solo lanzar la interfaz si se ejecuta como script principal
 if __name__ == "__main__":
+    # Gradio se importa solo al lanzar la interfaz: es la importación más lenta del módulo
+    import gradio as gr
+
+    iniciar_servidor_metricas()
+    if PRECALENTAR_RAG:
+        iniciar_precalentamiento()
     print("\n🚀 Iniciando interfaz de Gradio...")
     demo = gr.ChatInterface(
-        fn=chat_ecomarket,
+        fn=chat_ecomarket_stream, # Versión asíncrona con streaming (chat_ecomarket sigue disponible)
         title="🛍️ Asistente EcoMarket (RAG + Tools + OpenAI)",
         description="Haz preguntas sobre tus productos, pedidos o devoluciones. Usa ';' para comandos específicos (ej: `pedido;producto;motivo`) o describe tu consulta en lenguaje natural.",
         # Puedes añadir ejemplos si lo deseas
@@ -466,12 +1487,14 @@ if __name__ == "__main__":
             "¿Cuál es la política de devoluciones?",
             "Quiero devolver el Shampoo Ecológico del pedido 123 porque llegó dañado.", # Ejemplo con lenguaje natural
             "¿Cuánto me devuelven por 2 unidades del Jabón Artesanal que compré a $5.50 cada uno?", # Ejemplo con lenguaje natural
-            "Registrar solicitud para pedido 456, producto Crema Facial, motivo no corresponde.", # Ejemplo con lenguaje natural
+            "Registrar solicitud para pedido 456, producto Crema Facial, motivo no corresponde.", # Lenguaje natural (producto fuera del catálogo: se registra con aviso)
             "12345; Camiseta de algodón orgánico; 2023-11-01; dañado", # Ejemplo con formato de tool
             "Jabon; 3; 15.75", # Ejemplo con formato de tool
-            "pedido_789; Detergente líquido; envase roto", # Ejemplo con formato de tool
+            "pedido_789; Detergente líquido; envase roto", # Formato de tool (producto fuera del catálogo: se registra con aviso)
         ],
     )
+    # Cola de peticiones: hasta MAX_CONCURRENCIA conversaciones a la vez y MAX_COLA en espera
+    demo.queue(default_concurrency_limit=MAX_CONCURRENCIA, max_size=MAX_COLA)
     # Para ejecutar en Colab, share=True es útil
     # Para ejecutar localmente, share=False
     demo.launch(debug=True, share=True)
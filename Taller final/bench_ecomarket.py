@@ -0,0 +1,470 @@
+# ============================================================
+# bench_ecomarket.py — Benchmarks sin conexión de EcoMarket
+# Mide la construcción del vectorstore, la latencia del retriever, el costo
+# del enrutamiento y de las tools, y el rendimiento de chat_ecomarket con
+# concurrencia. Los embeddings y ChatOpenAI se sustituyen por versiones
+# locales deterministas (con latencia simulada opcional), así que no hace
+# falta red ni API key. El resultado es un JSON para comparar ejecuciones.
+# Uso:
+#   python bench_ecomarket.py --salida bench.json
+#   python bench_ecomarket.py --corpus sintetico --fragmentos 100000 --salida bench_100k.json
+#   python bench_ecomarket.py --comparar bench_anterior.json bench.json
+# ============================================================
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from bench_enrutador import CASOS
+from enrutador import RAG, analizar_consulta
+from indice_lexico import tokenizar
+
+CARPETA_REPO = os.path.dirname(os.path.abspath(__file__))
+VERSION_FORMATO = 1
+
+# Los 8 primeros casos del benchmark del enrutador son los ejemplos de la interfaz de Gradio
+EJEMPLOS_GRADIO = [mensaje for mensaje, *_ in CASOS[:8]]
+PREGUNTAS_RAG = [
+    "¿Qué productos ecológicos venden?",
+    "¿Cuál es la política de devoluciones?",
+    "¿Cuánto tarda un envío nacional?",
+    "¿Qué garantía tiene el Cargador Solar Portátil?",
+    "¿Cómo cuido una botella reutilizable de acero?",
+    "¿Qué métodos de pago aceptan?",
+    "¿Cuál es el estado del pedido ECO-1001?",
+    "¿Qué productos de la categoría hogar tienen descuento?",
+]
+
+
+# --- Sustitutos deterministas de OpenAI ----------------------------------
+
+class EmbeddingsFalsos(Embeddings):
+    """Embeddings deterministas por hashing de términos (bolsa de palabras normalizada).
+       Textos con términos en común quedan cerca, así que la recuperación sigue teniendo sentido.
+    """
+
+    def __init__(self, dimension=256, latencia=0.0):
+        self.dimension = dimension
+        self.latencia = latencia
+
+    def _vector(self, texto):
+        posiciones = [zlib.crc32(t.encode("utf-8")) % self.dimension for t in tokenizar(texto)]
+        vector = np.bincount(posiciones, minlength=self.dimension).astype(np.float32) if posiciones \
+            else np.ones(self.dimension, dtype=np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        if self.latencia:
+            time.sleep(self.latencia)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class ChatFalso(BaseChatModel):
+    """Modelo de chat local: espera `latencia` segundos y responde un texto fijo, palabra a palabra
+       en streaming (con `latencia_token` segundos entre palabras)."""
+
+    latencia: float = 0.05
+    latencia_token: float = 0.0
+    respuesta: str = "Según los documentos de EcoMarket, esta es una respuesta simulada para el benchmark."
+
+    @property
+    def _llm_type(self):
+        return "chat-falso"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latencia)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.respuesta))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latencia)
+        for palabra in self.respuesta.split(" "):
+            time.sleep(self.latencia_token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=palabra + " "))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latencia)
+        for palabra in self.respuesta.split(" "):
+            await asyncio.sleep(self.latencia_token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=palabra + " "))
+
+
+# --- Corpus sintético -----------------------------------------------------
+
+_PRODUCTOS = ["Shampoo Ecológico", "Jabón Artesanal", "Crema Facial", "Cargador Solar Portátil",
+              "Botella Reutilizable", "Cepillo de Bambú", "Detergente Líquido", "Camiseta de Algodón Orgánico",
+              "Cuaderno Reciclado", "Bolsa de Tela", "Vela de Soja", "Lámpara LED"]
+_CATEGORIAS = ["Cuidado Personal", "Hogar", "Tecnología Sostenible", "Ropa", "Papelería", "Alimentos"]
+_ESTADOS = ["Entregado", "En tránsito", "Devuelto", "Procesando", "Cancelado"]
+_MESES = ["enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto",
+          "septiembre", "octubre", "noviembre", "diciembre"]
+_RELLENO = [
+    "El cliente fue notificado por correo electrónico.",
+    "La política de devoluciones permite 14 días desde la entrega.",
+    "Los productos defectuosos se reemplazan sin costo adicional.",
+    "El envío se realizó con embalaje compostable.",
+    "Se aplicó el descuento de temporada sobre el precio unitario.",
+    "El reembolso se procesa en un plazo de 5 a 10 días hábiles.",
+    "El equipo de soporte revisó la solicitud y la aprobó.",
+    "La garantía cubre defectos de fabricación durante un año.",
+]
+
+# El divisor de texto junta párrafos hasta CHUNK_SIZE (1000): con párrafos de ~300 caracteres
+# salen unos 3 párrafos por fragmento, sin solapamiento (cada párrafo supera CHUNK_OVERLAP)
+PARRAFOS_POR_FRAGMENTO = 3
+FRAGMENTOS_POR_ARCHIVO = 200
+
+
+def _parrafo(rng):
+    producto = rng.choice(_PRODUCTOS)
+    texto = (f"Pedido ECO-{rng.randint(1000, 999999)}: {rng.randint(1, 5)} unidades de {producto} "
+             f"(PROD-{rng.randint(1, 999):03d}, {rng.choice(_CATEGORIAS)}) compradas el {rng.randint(1, 28)} "
+             f"de {rng.choice(_MESES)} de {rng.randint(2022, 2025)} a ${rng.randint(3, 120)}.{rng.randint(0, 99):02d}. "
+             f"Estado: {rng.choice(_ESTADOS)}.")
+    while len(texto) < 280:
+        texto += " " + rng.choice(_RELLENO)
+    return texto
+
+
+def generar_corpus(carpeta, num_fragmentos, semilla=0):
+    """Escribe en `carpeta` archivos .txt que suman aproximadamente `num_fragmentos` fragmentos."""
+    os.makedirs(carpeta, exist_ok=True)
+    rng = random.Random(semilla)
+    restantes = num_fragmentos
+    numero = 0
+    while restantes > 0:
+        fragmentos = min(FRAGMENTOS_POR_ARCHIVO, restantes)
+        parrafos = (_parrafo(rng) for _ in range(fragmentos * PARRAFOS_POR_FRAGMENTO))
+        with open(os.path.join(carpeta, f"sintetico_{numero:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(parrafos))
+        restantes -= fragmentos
+        numero += 1
+    return numero
+
+
+def preguntas_sinteticas(cantidad, semilla=0):
+    """Preguntas variadas sobre el corpus sintético (algunas con identificadores)."""
+    rng = random.Random(semilla + 1)
+    plantillas = [
+        lambda: f"¿Cuál es la garantía de {rng.choice(_PRODUCTOS)}?",
+        lambda: f"¿Qué pedidos de {rng.choice(_CATEGORIAS)} están {rng.choice(_ESTADOS).lower()}?",
+        lambda: f"¿En qué estado está el pedido ECO-{rng.randint(1000, 999999)}?",
+        lambda: f"¿Cuánto cuesta {rng.choice(_PRODUCTOS)} en {rng.choice(_MESES)}?",
+    ]
+    return [rng.choice(plantillas)() for _ in range(cantidad)]
+
+
+# --- Medición ---------------------------------------------------------------
+
+def percentiles(muestras_segundos):
+    """Resumen de latencias en milisegundos."""
+    if not muestras_segundos:
+        return {"n": 0}
+    ms = np.asarray(muestras_segundos) * 1000
+    return {
+        "n": len(ms),
+        "media_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def _cronometrar(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return resultado, time.perf_counter() - inicio
+
+
+def medir_construccion(app):
+    """Construcción completa en frío (caché de embeddings vacía), en caliente y carga del índice."""
+    db, frio = _cronometrar(app.crear_vectorstore)
+    if db is None:
+        raise RuntimeError("No se pudo construir el vectorstore")
+    informe_frio = json.loads(json.dumps(app.informe_construccion, default=str))
+    _, caliente = _cronometrar(app.crear_vectorstore)
+    _, carga = _cronometrar(app.cargar_o_crear_vectorstore)
+    fragmentos = db.index.ntotal
+    return {
+        "fragmentos": fragmentos,
+        "segundos_frio": frio,
+        "fragmentos_por_segundo_frio": fragmentos / frio if frio else 0.0,
+        "segundos_caliente": caliente,
+        "segundos_carga": carga,
+        "informe": informe_frio,
+    }
+
+
+def medir_recuperacion(app, consultas, repeticiones):
+    """Latencia del retriever híbrido (con el empaquetado de contexto, si está activo) y de la
+       búsqueda solo vectorial, tras un calentamiento."""
+    for consulta in consultas[:5]:
+        app.retriever.invoke(consulta)
+    hibrido, vectorial = [], []
+    for _ in range(repeticiones):
+        for consulta in consultas:
+            hibrido.append(_cronometrar(app.retriever.invoke, consulta)[1])
+            vectorial.append(_cronometrar(app.vectorstore.similarity_search, consulta, 3)[1])
+    resultado = {"hibrido": percentiles(hibrido), "vectorial": percentiles(vectorial)}
+    if hasattr(app.retriever, "recuperar_con_informe"):
+        # Tokens de contexto empaquetado frente a los 3 primeros fragmentos de la cadena "stuff"
+        informes = [app.retriever.recuperar_con_informe(consulta)[1] for consulta in consultas]
+        base = sum(i["tokens_base"] for i in informes)
+        enviados = sum(i["tokens_enviados"] for i in informes)
+        resultado["contexto"] = {
+            "tokens_base_media": base / len(informes),
+            "tokens_enviados_media": enviados / len(informes),
+            "ahorro_pct": 100 * (base - enviados) / base if base else 0.0,
+            # El ahorro por fusión de solapados, separado de lo que el presupuesto dejó fuera
+            "duplicados_media": sum(i["tokens_duplicados"] for i in informes) / len(informes),
+            "recortados_media": sum(i["tokens_recortados"] for i in informes) / len(informes),
+            "fragmentos_recortados_media": sum(i["fragmentos_recortados"] for i in informes) / len(informes),
+            "fusionados_media": sum(i["fusionados"] for i in informes) / len(informes),
+        }
+    return resultado
+
+
+def medir_enrutamiento(app, repeticiones):
+    """Costo del enrutador por mensaje, precisión sobre los casos etiquetados y latencia de las tools."""
+    aciertos = sum(analizar_consulta(m).intencion == esperada for m, esperada, *_ in CASOS)
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for mensaje, *_ in CASOS:
+            analizar_consulta(mensaje)
+    por_mensaje = (time.perf_counter() - inicio) / (repeticiones * len(CASOS))
+
+    tools = []
+    for mensaje, esperada, *_ in CASOS:
+        if esperada != RAG:
+            tools.append(_cronometrar(app._responder_con_tools, mensaje)[1])
+    return {"precision": aciertos / len(CASOS), "us_por_mensaje": por_mensaje * 1e6, "tools": percentiles(tools)}
+
+
+def _preguntas_chat(peticiones, semilla):
+    pool = EJEMPLOS_GRADIO + PREGUNTAS_RAG
+    rng = random.Random(semilla + 2)
+    return [rng.choice(pool) for _ in range(peticiones)]
+
+
+def medir_chat_sincrono(app, concurrencia, preguntas):
+    """chat_ecomarket desde `concurrencia` hilos (como varias sesiones atendidas a la vez)."""
+    app.cache_respuestas.invalidar()
+    latencias = []
+
+    def atender(pregunta):
+        latencias.append(_cronometrar(app.chat_ecomarket, pregunta)[1])
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(atender, preguntas))
+    segundos = time.perf_counter() - inicio
+    return {
+        "modo": "sincrono",
+        "concurrencia": concurrencia,
+        "peticiones": len(preguntas),
+        "segundos": segundos,
+        "peticiones_por_segundo": len(preguntas) / segundos,
+        "latencia": percentiles(latencias),
+        "cache_respuestas": app.cache_respuestas.estadisticas(),
+    }
+
+
+async def _medir_chat_streaming(app, niveles, preguntas):
+    resultados = []
+    for concurrencia in niveles:
+        app.cache_respuestas.invalidar()
+        limite = asyncio.Semaphore(concurrencia)
+        latencias, primeros = [], []
+
+        async def atender(pregunta):
+            async with limite:
+                inicio = time.perf_counter()
+                primero = None
+                async for _ in app.chat_ecomarket_stream(pregunta):
+                    if primero is None:
+                        primero = time.perf_counter() - inicio
+                latencias.append(time.perf_counter() - inicio)
+                primeros.append(primero)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(atender(p) for p in preguntas))
+        segundos = time.perf_counter() - inicio
+        resultados.append({
+            "modo": "streaming",
+            "concurrencia": concurrencia,
+            "peticiones": len(preguntas),
+            "segundos": segundos,
+            "peticiones_por_segundo": len(preguntas) / segundos,
+            "latencia": percentiles(latencias),
+            "primer_fragmento": percentiles(primeros),
+            "cache_respuestas": app.cache_respuestas.estadisticas(),
+        })
+    return resultados
+
+
+# --- Comparación de resultados ---------------------------------------------
+
+def _valores(datos, prefijo=""):
+    """Aplana un resultado en {ruta: número}. Las listas de chat se indexan por modo y concurrencia."""
+    if isinstance(datos, dict):
+        for clave, valor in datos.items():
+            yield from _valores(valor, f"{prefijo}{clave}.")
+    elif isinstance(datos, list):
+        for i, valor in enumerate(datos):
+            nombre = f"{valor.get('modo')}@{valor.get('concurrencia')}" if isinstance(valor, dict) and "modo" in valor else str(i)
+            yield from _valores(valor, f"{prefijo}{nombre}.")
+    elif isinstance(datos, (int, float)) and not isinstance(datos, bool):
+        yield prefijo[:-1], float(datos)
+
+
+def comparar(ruta_base, ruta_nueva, umbral=0.10):
+    """Muestra las métricas de tiempo y rendimiento que cambian más de `umbral` entre dos ejecuciones."""
+    with open(ruta_base, encoding="utf-8") as f:
+        base = dict(_valores(json.load(f)))
+    with open(ruta_nueva, encoding="utf-8") as f:
+        nueva = dict(_valores(json.load(f)))
+    metricas = [k for k in base if k in nueva and k.split(".")[-1].endswith(("_ms", "segundos", "por_segundo", "us_por_mensaje"))
+                and not k.startswith("construccion.informe.")]
+    cambios = 0
+    for clave in sorted(metricas):
+        anterior, actual = base[clave], nueva[clave]
+        if not anterior:
+            continue
+        variacion = (actual - anterior) / anterior
+        if abs(variacion) >= umbral:
+            # En las métricas "por segundo" más es mejor; en las de tiempo, menos
+            mejora = variacion > 0 if clave.endswith("por_segundo") else variacion < 0
+            print(f"{'🟢' if mejora else '🔴'} {clave}: {anterior:.3f} -> {actual:.3f} ({variacion:+.0%})")
+            cambios += 1
+    print(f"\n{cambios} de {len(metricas)} métricas cambiaron más de un {umbral:.0%}.")
+
+
+# --- Programa principal -----------------------------------------------------
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description="Benchmarks sin conexión de EcoMarket (salida JSON).")
+    parser.add_argument("--corpus", choices=("content", "sintetico"), default="content",
+                        help="Documentos de content/ o un corpus sintético generado")
+    parser.add_argument("--fragmentos", type=int, default=2000, help="Fragmentos del corpus sintético")
+    parser.add_argument("--dimension", type=int, default=256, help="Dimensión de los embeddings simulados")
+    parser.add_argument("--latencia-embeddings", type=float, default=0.0, help="Segundos simulados por llamada de embeddings")
+    parser.add_argument("--latencia-llm", type=float, default=0.05, help="Segundos simulados por respuesta del LLM")
+    parser.add_argument("--latencia-token", type=float, default=0.0, help="Segundos simulados entre palabras en streaming")
+    parser.add_argument("--repeticiones", type=int, default=5, help="Pasadas sobre las consultas del retriever")
+    parser.add_argument("--consultas", type=int, default=50, help="Consultas sintéticas adicionales para el retriever")
+    parser.add_argument("--concurrencia", default="1,4,8", help="Niveles de concurrencia del chat, separados por comas")
+    parser.add_argument("--peticiones", type=int, default=64, help="Peticiones de chat por nivel de concurrencia")
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--conservar", action="store_true", help="No borrar la carpeta temporal de trabajo")
+    parser.add_argument("--comparar", nargs=2, metavar=("BASE", "NUEVO"), help="Compara dos resultados y termina")
+    return parser.parse_args()
+
+
+def ejecutar(args, carpeta):
+    """Prepara la carpeta de trabajo, importa app con los sustitutos y ejecuta todas las mediciones."""
+    contenido = os.path.join(carpeta, "content")
+    if args.corpus == "content":
+        shutil.copytree(os.path.join(CARPETA_REPO, "content"), contenido)
+    else:
+        print(f"🧪 Generando corpus sintético de ~{args.fragmentos} fragmentos...", file=sys.stderr)
+        generar_corpus(contenido, args.fragmentos, args.semilla)
+
+    # app usa rutas relativas (content/, vectorstore/, cache/, data/): todo queda en la carpeta temporal
+    os.chdir(carpeta)
+    sys.path.insert(0, CARPETA_REPO)
+    os.environ["ECOMARKET_EMBEDDINGS_BACKEND"] = "openai"
+    import app
+
+    app.OpenAIEmbeddings = lambda **_: EmbeddingsFalsos(args.dimension, args.latencia_embeddings)
+    app.ChatOpenAI = lambda **_: ChatFalso(latencia=args.latencia_llm, latencia_token=args.latencia_token)
+    # La dimensión esperada para el modelo pasa a ser la de los embeddings simulados
+    app.DIMENSIONES_OPENAI[app.EMBEDDING_MODEL] = args.dimension
+
+    resultados = {"construccion": medir_construccion(app)}
+    _, segundos_rag = _cronometrar(app.obtener_rag_chain)
+    resultados["inicializacion_rag_segundos"] = segundos_rag
+    if app.retriever is None:
+        raise RuntimeError("El RAG no se inicializó")
+
+    consultas = PREGUNTAS_RAG + preguntas_sinteticas(args.consultas, args.semilla)
+    resultados["recuperacion"] = medir_recuperacion(app, consultas, args.repeticiones)
+    resultados["enrutamiento"] = medir_enrutamiento(app, repeticiones=2000)
+
+    niveles = [int(n) for n in args.concurrencia.split(",") if n.strip()]
+    preguntas = _preguntas_chat(args.peticiones, args.semilla)
+    resultados["chat"] = [medir_chat_sincrono(app, c, preguntas) for c in niveles]
+    resultados["chat"] += asyncio.run(_medir_chat_streaming(app, niveles, preguntas))
+    resultados["parametros_app"] = {
+        "tipo_indice": app.INDICE_TIPO,
+        "chunk_size": app.CHUNK_SIZE,
+        "chunk_overlap": app.CHUNK_OVERLAP,
+        "max_concurrencia_chat": app.MAX_CONCURRENCIA,
+        "procesos_carga": app.PROCESOS_CARGA,
+    }
+    return resultados
+
+
+def main():
+    args = _argumentos()
+    if args.comparar:
+        comparar(*args.comparar)
+        return
+
+    import faiss
+    carpeta = tempfile.mkdtemp(prefix="bench_ecomarket_")
+    directorio_inicial = os.getcwd()
+    try:
+        # Los mensajes de app van a stderr para que la salida estándar sea solo el JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            resultados = ejecutar(args, carpeta)
+    finally:
+        os.chdir(directorio_inicial)
+        if args.conservar:
+            print(f"📁 Carpeta de trabajo conservada en {carpeta}", file=sys.stderr)
+        else:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+    informe = {
+        "version": VERSION_FORMATO,
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "entorno": {
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "faiss": faiss.__version__,
+        },
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar", "conservar")},
+        **resultados,
+    }
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+        print(f"✅ Resultados guardados en {args.salida}", file=sys.stderr)
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
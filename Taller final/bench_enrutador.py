@@ -0,0 +1,62 @@
+# ============================================================
+# bench_enrutador.py — Microbenchmark del enrutador de intenciones
+# Mide el costo por mensaje de analizar_consulta() y su precisión sobre
+# los ejemplos de la interfaz de Gradio y otros casos etiquetados.
+# Uso: python bench_enrutador.py [repeticiones]
+# ============================================================
+
+import sys
+import time
+
+from enrutador import analizar_consulta, ELEGIBILIDAD, ESTADO, REEMBOLSO, REGISTRO, RAG
+
+# (mensaje, intención esperada[, entidades esperadas]). Los 8 primeros son los ejemplos de gr.ChatInterface en app.py.
+# Los dos REGISTRO de esos ejemplos nombran productos fuera del catálogo: la tool los registra con un aviso.
+CASOS = [
+    ("¿Qué productos ecológicos venden?", RAG),
+    ("¿Cuál es la política de devoluciones?", RAG),
+    ("Quiero devolver el Shampoo Ecológico del pedido 123 porque llegó dañado.", ELEGIBILIDAD),
+    ("¿Cuánto me devuelven por 2 unidades del Jabón Artesanal que compré a $5.50 cada uno?", REEMBOLSO),
+    ("Registrar solicitud para pedido 456, producto Crema Facial, motivo no corresponde.", REGISTRO),
+    ("12345; Camiseta de algodón orgánico; 2023-11-01; dañado", ELEGIBILIDAD),
+    ("Jabon; 3; 15.75", REEMBOLSO),
+    ("pedido_789; Detergente líquido; envase roto", REGISTRO),
+    ("Quiero hacer una solicitud de reembolso para el pedido ECO-1002", REGISTRO),
+    ("¿Cuánto me dan de reembolso por el pedido ECO-1001?", REEMBOLSO),
+    ("Mi producto defectuoso, ¿puedo devolverlo?", ELEGIBILIDAD),
+    ("Anotar devolución del pedido ECO-1004, cuaderno, no corresponde", REGISTRO),
+    ("¿Cuál es la política de devolución para productos en promoción?", RAG),
+    ("¿Qué garantía tiene el Cargador Solar Portátil?", RAG),
+    ("Quiero un reembolso por la botella reutilizable", REEMBOLSO),
+    ("quiero reembolso por el jabon a 12.50", REEMBOLSO, {"producto": "jabon", "precio": 12.5}),
+    ("¿Cuál es el estado de mi solicitud 1003?", ESTADO),
+    ("¿Cómo va mi devolución del pedido ECO-1002?", ESTADO),
+]
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    aciertos = 0
+    for mensaje, esperada, *entidades in CASOS:
+        consulta = analizar_consulta(mensaje)
+        fallidas = {k: getattr(consulta, k) for k, v in (entidades[0] if entidades else {}).items()
+                    if getattr(consulta, k) != v}
+        ok = consulta.intencion == esperada and not fallidas
+        aciertos += ok
+        detalle = f" (entidades distintas: {fallidas})" if fallidas else ""
+        print(f"{'✅' if ok else '❌'} {consulta.intencion:<12} (esperada {esperada:<12}) {mensaje}{detalle}")
+
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for mensaje, *_ in CASOS:
+            analizar_consulta(mensaje)
+    segundos = time.perf_counter() - inicio
+    llamadas = repeticiones * len(CASOS)
+
+    print(f"\n🎯 Precisión: {aciertos}/{len(CASOS)} ({aciertos / len(CASOS):.0%})")
+    print(f"⏱️ {segundos / llamadas * 1e6:.2f} µs por mensaje ({llamadas} llamadas en {segundos:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# ============================================================
+# cache_embeddings.py — Caché persistente de embeddings
+# Envuelve un objeto Embeddings de LangChain y guarda en disco (SQLite)
+# los vectores ya calculados como float32, con desalojo LRU.
+# La clave es el nombre del modelo + el hash del texto.
+# ============================================================
+
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+# SQLite limita el número de parámetros por consulta; se consulta en bloques
+_TAM_BLOQUE_SQL = 500
+# Los últimos usos de los aciertos se acumulan en memoria y se escriben juntos al llegar a
+# este número o a esta antigüedad (o con la siguiente escritura). Perder algunos en un cierre
+# abrupto solo afecta al orden de desalojo
+_MAX_USOS_PENDIENTES = 256
+_SEGUNDOS_USOS_PENDIENTES = 30.0
+
+
+def _a_bytes(vector):
+    """Serializa un vector como float32 contiguo."""
+    return array("f", vector).tobytes()
+
+
+def _desde_bytes(blob):
+    """Reconstruye una lista de floats a partir de un blob float32."""
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CacheEmbeddings(Embeddings):
+    """Embeddings con caché en disco compartida por la construcción del índice y las consultas.
+
+       Solo los textos que no están en la caché se envían al modelo subyacente.
+       Cuando se superan `max_entradas`, se desalojan las entradas usadas hace más tiempo
+       (`desalojadas` las cuenta). El número de entradas se lleva en memoria y solo se recuenta
+       en disco al desalojar.
+    """
+
+    def __init__(self, embeddings, modelo, ruta, max_entradas=50000):
+        self.embeddings = embeddings
+        self.modelo = modelo
+        self.ruta = ruta
+        self.max_entradas = max_entradas
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojadas = 0
+        self._lock = threading.Lock()
+
+        carpeta = os.path.dirname(ruta)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        self._conn = sqlite3.connect(ruta, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "clave BLOB PRIMARY KEY, vector BLOB NOT NULL, ultimo_uso REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_uso ON embeddings(ultimo_uso)")
+        self._conn.commit()
+        self._entradas = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._usos = {} # clave -> último uso aún sin escribir
+        self._ultima_escritura_usos = time.monotonic()
+
+    def _clave(self, texto):
+        """Clave de caché: SHA-256 de modelo + texto."""
+        return hashlib.sha256(f"{self.modelo}\0{texto}".encode("utf-8")).digest()
+
+    def _escribir_usos(self):
+        """Escribe los últimos usos pendientes (sin commit; llamar con el lock tomado)."""
+        if self._usos:
+            self._conn.executemany(
+                "UPDATE embeddings SET ultimo_uso = ? WHERE clave = ?",
+                [(ahora, clave) for clave, ahora in self._usos.items()],
+            )
+            self._usos.clear()
+        self._ultima_escritura_usos = time.monotonic()
+
+    def _buscar(self, claves):
+        """Devuelve {clave: vector} para las claves presentes y anota su último uso."""
+        encontrados = {}
+        ahora = time.time()
+        with self._lock:
+            for i in range(0, len(claves), _TAM_BLOQUE_SQL):
+                bloque = claves[i:i + _TAM_BLOQUE_SQL]
+                marcadores = ",".join("?" * len(bloque))
+                filas = self._conn.execute(
+                    f"SELECT clave, vector FROM embeddings WHERE clave IN ({marcadores})", bloque
+                ).fetchall()
+                for clave, blob in filas:
+                    encontrados[clave] = _desde_bytes(blob)
+            self._usos.update(dict.fromkeys(encontrados, ahora))
+            if self._usos and (len(self._usos) >= _MAX_USOS_PENDIENTES or
+                               time.monotonic() - self._ultima_escritura_usos >= _SEGUNDOS_USOS_PENDIENTES):
+                self._escribir_usos()
+                self._conn.commit()
+        return encontrados
+
+    def _guardar(self, pares):
+        """Guarda pares (clave, vector) y desaloja las entradas más antiguas si sobra espacio.
+           Los últimos usos pendientes se escriben en la misma transacción.
+        """
+        ahora = time.time()
+        with self._lock:
+            # La misma clave siempre da el mismo vector: si otro hilo ya la guardó, se deja
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (clave, vector, ultimo_uso) VALUES (?, ?, ?)",
+                [(clave, _a_bytes(vector), ahora) for clave, vector in pares],
+            )
+            self._entradas += max(cursor.rowcount, 0)
+            self._escribir_usos()
+            if self._entradas > self.max_entradas:
+                # Se recuenta antes de desalojar por si otro proceso comparte el archivo
+                self._entradas = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                sobrantes = self._entradas - self.max_entradas
+                if sobrantes > 0:
+                    cursor = self._conn.execute(
+                        "DELETE FROM embeddings WHERE clave IN "
+                        "(SELECT clave FROM embeddings ORDER BY ultimo_uso LIMIT ?)",
+                        (sobrantes,),
+                    )
+                    self._entradas -= cursor.rowcount
+                    self.desalojadas += cursor.rowcount
+            self._conn.commit()
+
+    def _contar(self, aciertos, fallos):
+        with self._lock:
+            self.aciertos += aciertos
+            self.fallos += fallos
+
+    def embed_documents(self, texts):
+        """Embebe una lista de textos consultando primero la caché."""
+        return self.embeber_documentos(texts)[0]
+
+    def embeber_documentos(self, texts):
+        """Como embed_documents, pero devuelve (vectores, aciertos) con los aciertos de esta
+           llamada (los contadores `aciertos` y `fallos` son globales de la instancia)."""
+        claves = [self._clave(t) for t in texts]
+        encontrados = self._buscar(list(set(claves)))
+
+        # Textos pendientes, sin repetir los que aparecen varias veces en la misma llamada
+        pendientes = {}
+        for clave, texto in zip(claves, texts):
+            if clave not in encontrados and clave not in pendientes:
+                pendientes[clave] = texto
+
+        if pendientes:
+            vectores = self.embeddings.embed_documents(list(pendientes.values()))
+            nuevos = list(zip(pendientes.keys(), vectores))
+            self._guardar(nuevos)
+            encontrados.update(nuevos)
+
+        aciertos = len(texts) - len(pendientes)
+        self._contar(aciertos, len(pendientes))
+        return [encontrados[clave] for clave in claves], aciertos
+
+    def embed_query(self, text):
+        """Embebe una consulta consultando primero la caché."""
+        clave = self._clave(text)
+        encontrado = self._buscar([clave]).get(clave)
+        if encontrado is not None:
+            self._contar(1, 0)
+            return encontrado
+
+        vector = self.embeddings.embed_query(text)
+        self._guardar([(clave, vector)])
+        self._contar(0, 1)
+        return vector
+
+    def estadisticas(self):
+        """Devuelve aciertos, fallos, tasa de aciertos y número de entradas en disco."""
+        with self._lock:
+            entradas = self._entradas
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": self.aciertos / total if total else 0.0,
+                "entradas": entradas,
+                "max_entradas": self.max_entradas,
+                "desalojadas": self.desalojadas,
+            }
+
+    def asegurar_capacidad(self, entradas):
+        """Amplía `max_entradas` hasta `entradas` si es menor (nunca la reduce)."""
+        with self._lock:
+            self.max_entradas = max(self.max_entradas, entradas)
+            return self.max_entradas
+
+    def cerrar(self):
+        """Escribe los últimos usos pendientes."""
+        with self._lock:
+            self._escribir_usos()
+            self._conn.commit()
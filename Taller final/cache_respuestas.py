@@ -0,0 +1,115 @@
+# ============================================================
+# cache_respuestas.py — Caché de respuestas del RAG
+# Guarda las respuestas de la cadena RetrievalQA por pregunta normalizada
+# (sin mayúsculas, tildes ni puntuación), con TTL y tamaño máximo.
+# Opcionalmente reconoce preguntas casi idénticas por similitud de embeddings.
+# ============================================================
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalizar_pregunta(pregunta):
+    """Normaliza una pregunta: minúsculas, sin tildes, sin puntuación y con espacios simples."""
+    texto = unicodedata.normalize("NFKD", pregunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+class CacheRespuestas:
+    """Caché LRU de respuestas con caducidad.
+
+       - `ttl`: segundos que una respuesta sigue siendo válida.
+       - `max_entradas`: tamaño máximo; se desaloja la entrada usada hace más tiempo.
+       - `embeddings` + `umbral_similitud`: si ambos están definidos (umbral > 0), una pregunta
+         sin coincidencia exacta reutiliza la respuesta de la más parecida por coseno.
+       - `generacion`: aumenta con cada invalidación. Las respuestas calculadas con una
+         generación anterior (antes de reconstruir el índice) se descartan al guardarlas.
+    """
+
+    def __init__(self, ttl=3600, max_entradas=1000, embeddings=None, umbral_similitud=0.0):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.embeddings = embeddings
+        self.umbral_similitud = umbral_similitud
+        self.generacion = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict() # clave -> (respuesta, instante, vector normalizado o None)
+        self._lock = threading.Lock()
+
+    def _usa_similitud(self):
+        return self.embeddings is not None and self.umbral_similitud > 0
+
+    def _vector(self, pregunta):
+        vector = np.asarray(self.embeddings.embed_query(pregunta), dtype=np.float32)
+        norma = np.linalg.norm(vector)
+        return vector / norma if norma else vector
+
+    def _purgar_caducadas(self, ahora):
+        caducadas = [k for k, (_, t, _) in self._entradas.items() if ahora - t > self.ttl]
+        for clave in caducadas:
+            del self._entradas[clave]
+
+    def obtener(self, pregunta):
+        """Devuelve la respuesta en caché para la pregunta, o None si no hay."""
+        clave = normalizar_pregunta(pregunta)
+        ahora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                if ahora - entrada[1] <= self.ttl:
+                    self._entradas.move_to_end(clave)
+                    self.aciertos += 1
+                    return entrada[0]
+                del self._entradas[clave]
+            usar_similitud = self._usa_similitud() and bool(self._entradas)
+
+        if usar_similitud:
+            # El embedding se calcula fuera del lock (puede implicar una llamada de red)
+            vector = self._vector(pregunta)
+            with self._lock:
+                self._purgar_caducadas(ahora)
+                candidatas = [(k, v) for k, (_, _, v) in self._entradas.items() if v is not None]
+                if candidatas:
+                    matriz = np.stack([v for _, v in candidatas])
+                    similitudes = matriz @ vector
+                    mejor = int(np.argmax(similitudes))
+                    if similitudes[mejor] >= self.umbral_similitud:
+                        clave_similar = candidatas[mejor][0]
+                        self._entradas.move_to_end(clave_similar)
+                        self.aciertos += 1
+                        return self._entradas[clave_similar][0]
+
+        with self._lock:
+            self.fallos += 1
+        return None
+
+    def guardar(self, pregunta, respuesta, generacion=None):
+        """Guarda una respuesta. Si `generacion` no coincide con la actual, se ignora."""
+        vector = self._vector(pregunta) if self._usa_similitud() else None
+        with self._lock:
+            if generacion is not None and generacion != self.generacion:
+                return
+            clave = normalizar_pregunta(pregunta)
+            self._entradas[clave] = (respuesta, time.time(), vector)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self):
+        """Vacía la caché (por ejemplo, tras reconstruir el vectorstore)."""
+        with self._lock:
+            self._entradas.clear()
+            self.generacion += 1
+
+    def estadisticas(self):
+        """Devuelve aciertos, fallos y número de entradas."""
+        with self._lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(self._entradas)}
@@ -0,0 +1,65 @@
+# ============================================================
+# carga_archivos.py — Carga y fragmentación de los archivos de datos
+# Módulo mínimo a propósito: es lo único que importan los procesos del
+# pool de carga (con "spawn" cada proceso vuelve a importar su módulo),
+# así que no importa app.py y solo importa LangChain dentro de las
+# funciones, al cargar un archivo. Los .txt y .csv se cargan en serie
+# (cuesta más arrancar un proceso que parsearlos); el pool solo compensa
+# con PDF y XLSX o con archivos grandes.
+# ============================================================
+
+import os
+import time
+
+# Extensiones cuyo parseo es lo bastante costoso como para repartirlo entre procesos
+EXTENSIONES_COSTOSAS = (".xlsx", ".pdf")
+# Los archivos de texto a partir de este tamaño también van al pool
+BYTES_MIN_PROCESO = 5 * 1024 * 1024
+
+
+def crear_loader(filepath):
+    """Devuelve el loader adecuado según la extensión del archivo, o None si no está soportado."""
+    from langchain_community.document_loaders import (
+        TextLoader, CSVLoader, UnstructuredExcelLoader, UnstructuredPDFLoader
+    )
+    if filepath.endswith(".txt"):
+        return TextLoader(filepath)
+    elif filepath.endswith(".csv"):
+        return CSVLoader(filepath)
+    elif filepath.endswith(".xlsx"):
+        return UnstructuredExcelLoader(filepath)
+    elif filepath.endswith(".pdf"):
+        # Asegúrate de que poppler-utils esté instalado en el entorno para PDFs
+        return UnstructuredPDFLoader(filepath)
+    return None
+
+
+def cargar_y_fragmentar(filepath, chunk_size, chunk_overlap):
+    """Carga un archivo y lo divide en fragmentos con el splitter del vectorstore."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    loader = crear_loader(filepath)
+    # start_index permite reconocer al recuperar los fragmentos vecinos que se solapan
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+    return splitter.split_documents(loader.load())
+
+
+def procesar_archivo(filepath, chunk_size, chunk_overlap):
+    """Carga y fragmenta un archivo midiendo el tiempo (en serie o en un proceso del pool).
+       Devuelve (fragmentos, segundos, error); los errores se devuelven en lugar de lanzarse.
+    """
+    inicio = time.perf_counter()
+    try:
+        fragmentos, error = cargar_y_fragmentar(filepath, chunk_size, chunk_overlap), None
+    except Exception as e:
+        fragmentos, error = [], f"{type(e).__name__}: {e}"
+    return fragmentos, time.perf_counter() - inicio, error
+
+
+def es_costoso(filepath):
+    """Indica si conviene cargar el archivo en un proceso aparte (PDF, XLSX o archivo grande)."""
+    if filepath.endswith(EXTENSIONES_COSTOSAS):
+        return True
+    try:
+        return os.path.getsize(filepath) >= BYTES_MIN_PROCESO
+    except OSError:
+        return False
@@ -0,0 +1,73 @@
+# ============================================================
+# embeddings_locales.py — Embeddings locales con sentence-transformers
+# Alternativa a OpenAIEmbeddings que no sale a la red: el modelo se carga
+# una sola vez por proceso, codifica en lotes en CPU con un número de
+# hilos configurable y devuelve vectores normalizados (norma 1), de modo
+# que el producto interno de FAISS equivale a la similitud coseno.
+# ============================================================
+
+import threading
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+# Modelos ya cargados en este proceso, por nombre (cargar uno tarda varios segundos)
+_modelos = {}
+_lock_modelos = threading.Lock()
+
+
+def cargar_modelo(nombre, dispositivo="cpu"):
+    """Carga el modelo de sentence-transformers una sola vez y lo reutiliza."""
+    clave = (nombre, dispositivo)
+    with _lock_modelos:
+        if clave not in _modelos:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError(
+                    "El backend de embeddings 'local' necesita sentence-transformers "
+                    "(pip install sentence-transformers)."
+                ) from e
+            print(f"🧠 Cargando modelo de embeddings local: {nombre}")
+            _modelos[clave] = SentenceTransformer(nombre, device=dispositivo)
+        return _modelos[clave]
+
+
+class EmbeddingsLocales(Embeddings):
+    """Embeddings calculados en local con sentence-transformers.
+
+       - `tam_lote`: textos por lote en cada pasada del modelo.
+       - `hilos`: hilos de CPU para torch (None deja el valor por defecto).
+       Los vectores se devuelven normalizados, listos para un índice FAISS de producto interno.
+    """
+
+    def __init__(self, modelo, tam_lote=32, hilos=None, dispositivo="cpu"):
+        self.modelo = modelo
+        self.tam_lote = tam_lote
+        self.hilos = hilos
+        if hilos:
+            import torch
+            torch.set_num_threads(hilos)
+        self._modelo = cargar_modelo(modelo, dispositivo)
+        self.dimension = self._modelo.get_sentence_embedding_dimension()
+        # El modelo no es seguro para llamadas concurrentes desde varios hilos
+        self._lock = threading.Lock()
+
+    def _codificar(self, textos):
+        with self._lock:
+            vectores = self._modelo.encode(
+                textos,
+                batch_size=self.tam_lote,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+        return vectores.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._codificar(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._codificar([text])[0]
@@ -0,0 +1,104 @@
+# ============================================================
+# embeddings_lotes.py — Embeddings por lotes para construir el índice
+# Reparte los fragmentos en lotes, los embebe en paralelo con un número
+# acotado de hilos y reintenta con espera exponencial ante errores 429.
+# Si el objeto de embeddings es una CacheEmbeddings, cada lote terminado
+# queda guardado en disco: una construcción fallida se reanuda desde ahí.
+# El cliente no debe reintentar por su cuenta (p. ej. OpenAIEmbeddings con
+# max_retries=0): así los 429 llegan aquí y solo se aplica esta política.
+# ============================================================
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+def es_limite_de_tasa(error):
+    """Indica si un error corresponde a un límite de tasa (HTTP 429) del proveedor de embeddings."""
+    if getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError":
+        return True
+    mensaje = str(error).lower()
+    return "429" in mensaje or "rate limit" in mensaje
+
+
+def _espera_sugerida(error):
+    """Segundos indicados por la cabecera Retry-After de la respuesta, si existe."""
+    respuesta = getattr(error, "response", None)
+    cabeceras = getattr(respuesta, "headers", None) or {}
+    try:
+        return float(cabeceras.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def embeber_en_lotes(textos, embeddings, tam_lote=64, trabajadores=4, max_reintentos=6,
+                     espera_inicial=1.0, espera_maxima=60.0):
+    """Embebe `textos` en lotes de `tam_lote` usando hasta `trabajadores` hilos.
+
+       Ante un límite de tasa, el lote se reintenta hasta `max_reintentos` veces con espera
+       exponencial (con jitter, o la indicada por Retry-After). Cualquier otro error, o agotar
+       los reintentos, se propaga después de dejar terminar los lotes en curso.
+       Devuelve (vectores, informe), con los vectores en el mismo orden que `textos`.
+    """
+    inicio = time.perf_counter()
+    vectores = [None] * len(textos)
+    lotes = [(i, textos[i:i + tam_lote]) for i in range(0, len(textos), tam_lote)]
+    reintentos = desde_cache = 0
+    lock = threading.Lock()
+    # Con CacheEmbeddings se cuentan los aciertos de cada lote (no los de consultas simultáneas)
+    embeber_documentos = getattr(embeddings, "embeber_documentos", None)
+
+    def procesar(posicion, lote):
+        nonlocal reintentos, desde_cache
+        intento = 0
+        while True:
+            try:
+                if embeber_documentos is None:
+                    return posicion, embeddings.embed_documents(lote)
+                vectores_lote, aciertos = embeber_documentos(lote)
+                with lock:
+                    desde_cache += aciertos
+                return posicion, vectores_lote
+            except Exception as e:
+                if not es_limite_de_tasa(e) or intento >= max_reintentos:
+                    raise
+                espera = _espera_sugerida(e)
+                if espera is None:
+                    espera = min(espera_maxima, espera_inicial * 2 ** intento) * random.uniform(0.5, 1.0)
+                intento += 1
+                with lock:
+                    reintentos += 1
+                print(f"⏳ Límite de tasa en el lote {posicion // tam_lote}: reintento {intento} en {espera:.1f}s")
+                time.sleep(espera)
+
+    error = None
+    with ThreadPoolExecutor(max_workers=max(1, trabajadores)) as pool:
+        futuros = [pool.submit(procesar, posicion, lote) for posicion, lote in lotes]
+        for futuro in as_completed(futuros):
+            try:
+                posicion, vectores_lote = futuro.result()
+            except Exception as e:
+                if error is None:
+                    error = e
+                    # Los lotes que aún no empezaron se cancelan; los terminados ya están en la caché
+                    for pendiente in futuros:
+                        pendiente.cancel()
+                continue
+            vectores[posicion:posicion + len(vectores_lote)] = vectores_lote
+
+    if error is not None:
+        raise error
+
+    segundos = time.perf_counter() - inicio
+    informe = {
+        "fragmentos": len(textos),
+        "lotes": len(lotes),
+        "tam_lote": tam_lote,
+        "trabajadores": trabajadores,
+        "reintentos": reintentos,
+        "desde_cache": desde_cache,
+        "segundos": segundos,
+        "fragmentos_por_segundo": len(textos) / segundos if segundos > 0 else 0.0,
+    }
+    return vectores, informe
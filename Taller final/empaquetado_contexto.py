@@ -0,0 +1,267 @@
+# ============================================================
+# empaquetado_contexto.py — Contexto del RAG ajustado a un presupuesto de tokens
+# Etapa posterior al retriever híbrido: pide más candidatos de los que caben,
+# fusiona los fragmentos de un mismo documento que se solapan o son contiguos
+# (con chunk_overlap=200 los vecinos repiten texto), diversifica con MMR
+# (Maximal Marginal Relevance) y llena el contexto hasta el presupuesto de
+# tokens. Cada consulta informa de los tokens enviados frente a los que
+# habría enviado la cadena "stuff" con los k primeros fragmentos, separando
+# los duplicados eliminados de lo recortado por el presupuesto.
+# ============================================================
+
+import threading
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from indice_lexico import extraer_identificadores
+from indices_faiss import reconstruir_vectores
+from metricas import metricas, BUCKETS_TOKENS
+
+# Separador con el que la cadena "stuff" une los fragmentos del contexto
+SEPARADOR = "\n\n"
+# Codificación de tiktoken de gpt-4o-mini; sin tiktoken (o sin red para descargarla) se estima
+CODIFICACION_TOKENS = "o200k_base"
+CARACTERES_POR_TOKEN = 4
+
+metricas.definir_contador("ecomarket_contexto_tokens_total",
+                          "Tokens de contexto del RAG: base (k primeros), enviados, duplicados eliminados y recortados por presupuesto")
+metricas.definir_histograma("ecomarket_contexto_tokens", "Tokens de contexto enviados por consulta", BUCKETS_TOKENS)
+
+_codificador = None
+_lock_codificador = threading.Lock()
+
+
+def _obtener_codificador():
+    """Carga el codificador de tiktoken una sola vez. Devuelve False si no está disponible."""
+    global _codificador
+    if _codificador is None:
+        with _lock_codificador:
+            if _codificador is None:
+                try:
+                    import tiktoken
+                    _codificador = tiktoken.get_encoding(CODIFICACION_TOKENS)
+                except Exception as e:
+                    print(f"⚠️ tiktoken no disponible ({type(e).__name__}). Los tokens se estiman como caracteres/{CARACTERES_POR_TOKEN}.")
+                    _codificador = False
+    return _codificador
+
+
+def contar_tokens(texto):
+    """Tokens de un texto con tiktoken, o una estimación por caracteres si no está disponible."""
+    codificador = _obtener_codificador()
+    if codificador:
+        return len(codificador.encode(texto, disallowed_special=()))
+    return -(-len(texto) // CARACTERES_POR_TOKEN)
+
+
+def tokens_contexto(documentos):
+    """Tokens del contexto que forma la cadena "stuff" con estos documentos."""
+    return contar_tokens(SEPARADOR.join(doc.page_content for doc in documentos))
+
+
+def _documento_origen(metadata):
+    """Clave del documento del que sale un fragmento: sus metadatos sin la posición de inicio."""
+    return tuple(sorted((k, str(v)) for k, v in metadata.items() if k != "start_index"))
+
+
+def fusionar_solapados(documentos):
+    """Une los fragmentos de un mismo documento que se solapan o son contiguos según `start_index`.
+
+       Devuelve [(Document, posiciones)] en el orden del primer fragmento de cada grupo, donde
+       `posiciones` son los índices en `documentos` de los fragmentos que se unieron.
+       Los fragmentos sin `start_index` (índices antiguos) se devuelven tal cual.
+    """
+    grupos = {}
+    for posicion, doc in enumerate(documentos):
+        if "start_index" in doc.metadata:
+            grupos.setdefault(_documento_origen(doc.metadata), []).append(posicion)
+
+    grupo_de = {} # posición en `documentos` -> grupo fusionado al que pertenece
+    for posiciones in grupos.values():
+        posiciones.sort(key=lambda p: documentos[p].metadata["start_index"])
+        actual = None
+        for p in posiciones:
+            doc = documentos[p]
+            inicio = doc.metadata["start_index"]
+            solape = actual["fin"] - inicio if actual is not None else -1
+            # Solapado o contiguo (comprobando el texto: tras una actualización incremental los
+            # fragmentos sin cambios conservan su start_index anterior)
+            if solape >= 0 and actual["texto"].endswith(doc.page_content[:solape]):
+                # Se añade solo el texto que va más allá del final actual
+                fin = inicio + len(doc.page_content)
+                if fin > actual["fin"]:
+                    actual["texto"] += doc.page_content[actual["fin"] - inicio:]
+                    actual["fin"] = fin
+            else:
+                actual = {"texto": doc.page_content, "fin": inicio + len(doc.page_content),
+                          "metadata": doc.metadata, "posiciones": []}
+            actual["posiciones"].append(p)
+            grupo_de[p] = actual
+
+    resultado, usados = [], set()
+    for posicion, doc in enumerate(documentos):
+        if posicion in usados:
+            continue
+        grupo = grupo_de.get(posicion)
+        if grupo is None:
+            resultado.append((doc, [posicion]))
+            continue
+        usados.update(grupo["posiciones"])
+        metadata = dict(grupo["metadata"])
+        if len(grupo["posiciones"]) > 1:
+            metadata["fragmentos_fusionados"] = len(grupo["posiciones"])
+        resultado.append((Document(page_content=grupo["texto"], metadata=metadata), sorted(grupo["posiciones"])))
+    return resultado
+
+
+def ordenar_mmr(vector_consulta, vectores, lambda_mmr=0.7):
+    """Orden de los candidatos por Maximal Marginal Relevance (similitud coseno).
+
+       `lambda_mmr` pondera la relevancia frente a la diversidad: 1 ordena solo por relevancia.
+    """
+    if len(vectores) == 0:
+        return []
+    vectores = np.asarray(vectores, dtype=np.float32)
+    vectores = vectores / np.maximum(np.linalg.norm(vectores, axis=1, keepdims=True), 1e-12)
+    consulta = np.asarray(vector_consulta, dtype=np.float32)
+    consulta = consulta / max(float(np.linalg.norm(consulta)), 1e-12)
+
+    relevancia = vectores @ consulta
+    similitud_maxima = np.full(len(vectores), -np.inf, dtype=np.float32)
+    pendientes = list(range(len(vectores)))
+    orden = []
+    while pendientes:
+        redundancia = np.where(np.isinf(similitud_maxima[pendientes]), 0.0, similitud_maxima[pendientes])
+        puntuaciones = lambda_mmr * relevancia[pendientes] - (1 - lambda_mmr) * redundancia
+        elegido = pendientes.pop(int(np.argmax(puntuaciones)))
+        orden.append(elegido)
+        similitud_maxima = np.maximum(similitud_maxima, vectores @ vectores[elegido])
+    return orden
+
+
+def _partes_base(candidatos, posiciones, k_base):
+    """Los fragmentos de un grupo fusionado que están entre los `k_base` primeros, fusionados entre sí."""
+    base = [p for p in posiciones if p < k_base]
+    return [(doc, [base[i] for i in partes]) for doc, partes in fusionar_solapados([candidatos[p] for p in base])]
+
+
+def empaquetar(candidatos, presupuesto_tokens, k_base=3, vector_consulta=None, vectores=None,
+               lambda_mmr=0.7, max_fragmentos=6):
+    """Fusiona, reordena y recorta los candidatos del retriever (en orden de relevancia).
+
+       - `vectores`: embeddings de los candidatos para MMR; sin ellos se conserva el orden recibido.
+         Los `k_base` primeros candidatos se ofrecen antes que el resto.
+       - Se añaden fragmentos mientras quepan en `presupuesto_tokens`; un fusionado que no cabe
+         se prueba por partes, y el primer fragmento sin fusionar se incluye siempre.
+       Devuelve (documentos, informe) con los tokens de los `k_base` primeros candidatos (lo que
+       enviaba la cadena "stuff") y los enviados. El ahorro se separa en los duplicados que quitó
+       la fusión y los recortados: texto de esos `k_base` primeros que no cupo en el presupuesto.
+    """
+    fusionados = fusionar_solapados(candidatos)
+    orden = list(range(len(fusionados)))
+    if vector_consulta is not None and vectores is not None and len(fusionados) > 1:
+        # El vector de un fragmento fusionado es la media de los de sus partes
+        medias = [np.mean([vectores[p] for p in posiciones], axis=0) for _, posiciones in fusionados]
+        orden = ordenar_mmr(vector_consulta, medias, lambda_mmr)
+
+    seleccion, usados = [], 0
+    separador = contar_tokens(SEPARADOR)
+
+    def ofrecer(pendientes):
+        nonlocal usados
+        while pendientes and len(seleccion) < max_fragmentos:
+            doc, posiciones = pendientes.pop(0)
+            tokens = contar_tokens(doc.page_content) + (separador if seleccion else 0)
+            if usados + tokens > presupuesto_tokens and (seleccion or len(posiciones) > 1):
+                if len(posiciones) > 1:
+                    # Un fragmento fusionado que no cabe se vuelve a ofrecer por partes
+                    pendientes[0:0] = [(candidatos[p], [p]) for p in posiciones]
+                continue # No cabe: se prueba con el siguiente, que puede ser más corto
+            seleccion.append((doc, posiciones))
+            usados += tokens
+
+    # Primero lo que enviaba la cadena "stuff": los grupos con alguno de los `k_base` primeros.
+    # Un grupo que además arrastra otros candidatos solo entra entero si deja sitio a los demás
+    # de la base; si no, se envían solo sus partes de la base. Así, si el presupuesto cubre la
+    # base, no se recorta nada de ella y MMR solo decide con qué se completa el contexto.
+    base = [fusionados[i] for i in orden if min(fusionados[i][1]) < k_base]
+    partes_base = [_partes_base(candidatos, posiciones, k_base) for _, posiciones in base]
+    minimos = [sum(contar_tokens(doc.page_content) + separador for doc, _ in partes) for partes in partes_base]
+    for j, (doc, posiciones) in enumerate(base):
+        tokens = contar_tokens(doc.page_content) + (separador if seleccion else 0)
+        entero = usados + tokens + sum(minimos[j + 1:]) <= presupuesto_tokens
+        ofrecer([(doc, posiciones)] if entero else list(partes_base[j]))
+    ofrecer([fusionados[i] for i in orden if min(fusionados[i][1]) >= k_base])
+
+    tokens_base = tokens_contexto(candidatos[:k_base])
+    tokens_enviados = tokens_contexto([doc for doc, _ in seleccion])
+    enviadas = {p for _, posiciones in seleccion for p in posiciones}
+    recortados = [p for p in range(min(k_base, len(candidatos))) if p not in enviadas]
+    informe = {
+        "candidatos": len(candidatos),
+        "fragmentos": len(seleccion),
+        "fusionados": sum(len(posiciones) > 1 for _, posiciones in seleccion),
+        "tokens_base": tokens_base,
+        "tokens_enviados": tokens_enviados,
+        "tokens_duplicados": sum(
+            max(0, sum(contar_tokens(candidatos[p].page_content) for p in posiciones) - contar_tokens(doc.page_content))
+            for doc, posiciones in seleccion if len(posiciones) > 1
+        ),
+        "fragmentos_recortados": len(recortados),
+        "tokens_recortados": sum(contar_tokens(candidatos[p].page_content) for p in recortados),
+        "tokens_ahorrados": tokens_base - tokens_enviados,
+    }
+    return [doc for doc, _ in seleccion], informe
+
+
+class RetrieverEmpaquetado(BaseRetriever):
+    """Retriever que envuelve al híbrido y devuelve el contexto empaquetado.
+
+       `base` debe devolver ya los candidatos ampliados (su `k` es el número de candidatos).
+       Las consultas con identificadores conservan el orden léxico y no calculan embeddings.
+    """
+
+    base: Any
+    presupuesto_tokens: int = 750
+    k_base: int = 3
+    lambda_mmr: float = 0.7
+    max_fragmentos: int = 6
+
+    def _vectores(self, query, candidatos):
+        if extraer_identificadores(query) or len(candidatos) < 2:
+            return None, None
+        vectorstore = self.base.vectorstore
+        posicion = getattr(vectorstore.docstore, "posicion", None)
+        posiciones = [posicion(d.id) if posicion and d.id else None for d in candidatos]
+        with metricas.medir("embeddings_mmr"):
+            vector_consulta = vectorstore.embeddings.embed_query(query) # Ya en la caché: la calculó el retriever
+            if None not in posiciones:
+                # Los vectores de los fragmentos se leen del índice FAISS, sin llamar a la API
+                return vector_consulta, reconstruir_vectores(vectorstore.index, posiciones)
+            # Fragmentos añadidos en memoria y aún sin guardar: se embeben (normalmente desde la caché)
+            return vector_consulta, vectorstore.embeddings.embed_documents([d.page_content for d in candidatos])
+
+    def recuperar_con_informe(self, query, callbacks=None):
+        """Devuelve (documentos, informe) y registra los tokens de contexto de la consulta."""
+        candidatos = self.base.invoke(query, config={"callbacks": callbacks})
+        vector_consulta, vectores = self._vectores(query, candidatos)
+        with metricas.medir("empaquetado_contexto"):
+            documentos, informe = empaquetar(
+                candidatos, self.presupuesto_tokens, k_base=self.k_base, vector_consulta=vector_consulta,
+                vectores=vectores, lambda_mmr=self.lambda_mmr, max_fragmentos=self.max_fragmentos,
+            )
+        for tipo in ("base", "enviados", "duplicados", "recortados"):
+            metricas.contar("ecomarket_contexto_tokens_total", informe[f"tokens_{tipo}"], tipo=tipo)
+        metricas.observar("ecomarket_contexto_tokens", informe["tokens_enviados"])
+        metricas.anotar(tokens_contexto=informe["tokens_enviados"], tokens_ahorrados=informe["tokens_ahorrados"],
+                        tokens_duplicados=informe["tokens_duplicados"], tokens_recortados=informe["tokens_recortados"])
+        return documentos, informe
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.recuperar_con_informe(query, callbacks=run_manager.get_child())[0]
@@ -0,0 +1,159 @@
+# ============================================================
+# enrutador.py — Enrutador de intenciones de chat_ecomarket
+# Una sola expresión regular compilada recorre el mensaje una vez y
+# extrae las palabras clave (con su peso por intención) y las entidades:
+# pedido, código de producto, producto, motivo, cantidad, precio y fecha.
+# El resultado (Consulta) se pasa directamente a las tools.
+# ============================================================
+
+import re
+
+# Intenciones posibles. El orden resuelve empates de puntuación.
+ESTADO = "estado"
+REGISTRO = "registro"
+REEMBOLSO = "reembolso"
+ELEGIBILIDAD = "elegibilidad"
+RAG = "rag"
+PRIORIDAD = (ESTADO, REGISTRO, REEMBOLSO, ELEGIBILIDAD, RAG)
+
+# Tabla de palabras clave: patrón -> (intención, peso).
+# Las frases largas van antes que sus prefijos ("solicitud de reembolso" antes de "solicitud"),
+# porque en cada posición gana la primera alternativa que coincide.
+PALABRAS_CLAVE = (
+    # Consulta del estado de una solicitud ya registrada; el número que la sigue es su ID
+    (r"(?:estado de|c[oó]mo va) (?:mi |la |tu |una )?(?:solicitud|devoluci[oó]n|reembolso)"
+     r"(?:\s+(?:n[uú]mero\s*)?#?(?P<solicitud_num>\d+))?", ESTADO, 4),
+    (r"solicitud de (?:reembolso|devoluci[oó]n)", REGISTRO, 3),
+    (r"registrar", REGISTRO, 2),
+    (r"anotar", REGISTRO, 2),
+    (r"solicitud", REGISTRO, 1),
+    (r"reembolso", REEMBOLSO, 2),
+    (r"me devuelven", REEMBOLSO, 2),
+    (r"cu[aá]nto me dan", REEMBOLSO, 2),
+    (r"producto da[nñ]ado", ELEGIBILIDAD, 2),
+    (r"producto defectuoso", ELEGIBILIDAD, 2),
+    (r"devolver", ELEGIBILIDAD, 1),
+    (r"devoluci[oó]n", ELEGIBILIDAD, 1),
+    (r"pol[ií]tica", RAG, 3),
+)
+
+# Motivos reconocidos y su forma canónica (la que usan las tools para decidir la elegibilidad)
+MOTIVOS = {
+    "dañado": "dañado", "dañada": "dañado", "danado": "dañado", "danada": "dañado",
+    "defectuoso": "defectuoso", "defectuosa": "defectuoso",
+    "no corresponde": "no corresponde",
+}
+
+# Palabras que no pueden iniciar ni continuar el nombre de un producto
+_PALABRAS_NO_PRODUCTO = (
+    r"del?|porque|por|que|lleg[oó]|motivo|a|cada|en|con|y|para|no|pedido|producto|"
+    r"reembolso|solicitud|devoluci[oó]n|pol[ií]tica|estado|mi|mis|su|sus|el|la|los|las"
+)
+
+_entidades = (
+    r"\b(?P<pedido>eco-\d+)\b",
+    r"\bpedido[\s_#:]*(?:n[uú]mero\s*)?(?P<pedido_num>\d+)\b",
+    r"\b(?P<codigo_producto>prod-\d+)\b",
+    r"\b(?P<fecha>\d{4}-\d{2}-\d{2})\b",
+    r"\b(?P<cantidad>\d+)\s+unidad(?:es)?\b",
+    # Precio con "$" o como importe suelto tras "a"/"por" ("a 12.50"), salvo que sea una cantidad
+    r"(?:\$\s*|\b(?:a|por)\s+\$?\s*)(?P<precio>\d+(?:[.,]\d{1,2})?)(?!\d|[.,]\d|\s*unidad)",
+    r"\b(?P<motivo>" + "|".join(sorted(MOTIVOS, key=len, reverse=True)) + r")\b",
+)
+_claves = tuple(rf"\b(?P<k{i}>{patron})\b" for i, (patron, _, _) in enumerate(PALABRAS_CLAVE))
+# El producto se detecta con una búsqueda anticipada (no consume texto) tras un determinante,
+# y va al final para que palabras clave y entidades en la misma posición tengan prioridad.
+_producto = (
+    r"\b(?:el|la|los|las|del|producto)\s+(?=(?P<producto>"
+    rf"(?!(?:{_PALABRAS_NO_PRODUCTO})\b)[a-záéíóúñü]+"
+    rf"(?:\s+(?!(?:{_PALABRAS_NO_PRODUCTO})\b)[a-záéíóúñü]+)*))"
+)
+PATRON = re.compile("|".join(_claves + _entidades + (_producto,)))
+
+_PATRON_NUMERO = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+class Consulta:
+    """Resultado del análisis de un mensaje: intención, entidades y campos separados por ';'."""
+    __slots__ = ("texto", "intencion", "puntuaciones", "campos", "pedido", "codigo_producto",
+                 "producto", "motivo", "cantidad", "precio", "fecha", "solicitud")
+
+    def __init__(self, texto):
+        self.texto = texto
+        self.intencion = RAG
+        self.puntuaciones = {}
+        self.campos = None # Lista de campos si el mensaje usa el formato con ';'
+        self.pedido = None
+        self.codigo_producto = None
+        self.producto = None
+        self.motivo = None
+        self.cantidad = None
+        self.precio = None
+        self.fecha = None
+        self.solicitud = None # ID de solicitud ("estado de mi solicitud 1003")
+
+    def __repr__(self):
+        entidades = {s: getattr(self, s) for s in self.__slots__[4:] if getattr(self, s) is not None}
+        return f"Consulta({self.intencion!r}, campos={self.campos!r}, {entidades})"
+
+
+def _es_numero(texto):
+    return bool(_PATRON_NUMERO.fullmatch(texto.strip()))
+
+
+def _intencion_por_campos(campos, puntuaciones):
+    """Formato con ';': decide la tool por la forma de los campos, salvo palabra clave explícita."""
+    if puntuaciones.get(REEMBOLSO):
+        return REEMBOLSO
+    if puntuaciones.get(REGISTRO):
+        return REGISTRO
+    if len(campos) == 3 and _es_numero(campos[1]) and (not campos[2] or _es_numero(campos[2])):
+        return REEMBOLSO # producto; cantidad; precio
+    if len(campos) == 3:
+        return REGISTRO # pedido; producto; motivo
+    return ELEGIBILIDAD # pedido; producto; fecha; motivo (y formatos incompletos)
+
+
+def analizar_consulta(texto):
+    """Recorre el mensaje una sola vez y devuelve una Consulta con intención y entidades."""
+    consulta = Consulta(texto)
+    texto_lower = texto.lower()
+    puntuaciones = {}
+
+    for coincidencia in PATRON.finditer(texto_lower):
+        grupo = coincidencia.lastgroup
+        valor = coincidencia.group(grupo)
+        if grupo[0] == "k" and grupo[1:].isdigit():
+            _, intencion, peso = PALABRAS_CLAVE[int(grupo[1:])]
+            puntuaciones[intencion] = puntuaciones.get(intencion, 0) + peso
+            # "producto dañado" / "producto defectuoso" también indican el motivo
+            ultima = valor.rsplit(" ", 1)[-1]
+            if ultima in MOTIVOS:
+                consulta.motivo = consulta.motivo or MOTIVOS[ultima]
+            if intencion == ESTADO and coincidencia.group("solicitud_num"):
+                consulta.solicitud = consulta.solicitud or coincidencia.group("solicitud_num")
+        elif grupo == "pedido":
+            consulta.pedido = consulta.pedido or valor.upper()
+        elif grupo == "pedido_num":
+            consulta.pedido = consulta.pedido or valor
+        elif grupo == "codigo_producto":
+            consulta.codigo_producto = consulta.codigo_producto or valor.upper()
+        elif grupo == "fecha":
+            consulta.fecha = consulta.fecha or valor
+        elif grupo == "cantidad":
+            consulta.cantidad = consulta.cantidad or int(valor)
+        elif grupo == "precio":
+            consulta.precio = consulta.precio or float(valor.replace(",", "."))
+        elif grupo == "motivo":
+            consulta.motivo = consulta.motivo or MOTIVOS[valor]
+        elif grupo == "producto":
+            consulta.producto = consulta.producto or valor.strip()
+
+    consulta.puntuaciones = puntuaciones
+    if ";" in texto:
+        consulta.campos = [x.strip() for x in texto.split(";")]
+        consulta.intencion = _intencion_por_campos(consulta.campos, puntuaciones)
+    elif puntuaciones:
+        mejor = max(puntuaciones.values())
+        consulta.intencion = next(i for i in PRIORIDAD if puntuaciones.get(i) == mejor)
+    return consulta
@@ -0,0 +1,328 @@
+# ============================================================
+# indice_comercial.py — Índice en memoria de pedidos y catálogo
+# Convierte pedidos_detallados.txt y catalogo_productos.txt en registros
+# tipados, indexados por número de pedido, código de producto y nombre
+# normalizado. Las tools de devolución y reembolso consultan aquí el precio
+# real, la fecha de compra y el plazo de devolución en O(1). También indexa
+# las solicitudes de solicitudes_detalladas.txt por ID y por pedido.
+# Cada archivo se vuelve a leer solo cuando cambia en disco.
+# ============================================================
+
+import os
+import re
+import threading
+import unicodedata
+from datetime import date, timedelta
+
+MESES = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6, "julio": 7,
+    "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10, "noviembre": 11, "diciembre": 12,
+}
+
+# Plazos de devolución (política, Artículo 5), contados desde la entrega.
+# Como los pedidos solo registran la fecha de compra, la entrega se estima con DIAS_ENTREGA_ESTIMADOS.
+PLAZO_DEFECTUOSO_DIAS = 7
+PLAZO_VOLUNTARIO_DIAS = 14
+DIAS_ENTREGA_ESTIMADOS = 3
+
+_PALABRAS_VACIAS = frozenset("de del la el los las para con y en por".split())
+
+
+def normalizar_nombre(texto):
+    """Normaliza un nombre de producto: minúsculas, sin tildes, sin paréntesis ni puntuación."""
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"\(.*?\)", " ", texto)
+    texto = re.sub(r"[^a-z0-9\s]", " ", texto)
+    return " ".join(texto.split())
+
+
+def _palabras_clave(nombre_normalizado):
+    return {p for p in nombre_normalizado.split() if p not in _PALABRAS_VACIAS and len(p) > 2}
+
+
+def _precio(texto):
+    """'$25.00' -> 25.0"""
+    coincidencia = re.search(r"\d+(?:[.,]\d+)?", texto)
+    return float(coincidencia.group(0).replace(",", ".")) if coincidencia else None
+
+
+def _entero(texto):
+    """'2 unidades' -> 2"""
+    coincidencia = re.search(r"\d+", texto)
+    return int(coincidencia.group(0)) if coincidencia else None
+
+
+def _fecha(texto):
+    """'20 de septiembre de 2025' -> date(2025, 9, 20)"""
+    coincidencia = re.search(r"(\d{1,2})\s+de\s+([a-záéíóú]+)\s+de\s+(\d{4})", texto.lower())
+    if not coincidencia or coincidencia.group(2) not in MESES:
+        return None
+    dia, mes, anio = coincidencia.groups()
+    return date(int(anio), MESES[mes], int(dia))
+
+
+class Producto:
+    """Producto del catálogo."""
+    __slots__ = ("codigo", "nombre", "precio", "categoria")
+
+    def __init__(self, codigo, nombre, precio, categoria):
+        self.codigo = codigo
+        self.nombre = nombre
+        self.precio = precio
+        self.categoria = categoria
+
+    def __repr__(self):
+        return f"Producto({self.codigo!r}, {self.nombre!r}, {self.precio!r})"
+
+
+class Pedido:
+    """Pedido registrado en pedidos_detallados.txt."""
+    __slots__ = ("numero", "cliente", "producto", "codigo_producto", "fecha_compra",
+                 "cantidad", "precio_unitario", "total", "estado", "motivo")
+
+    def __init__(self, numero, cliente=None, producto=None, codigo_producto=None, fecha_compra=None,
+                 cantidad=None, precio_unitario=None, total=None, estado=None, motivo=None):
+        self.numero = numero
+        self.cliente = cliente
+        self.producto = producto
+        self.codigo_producto = codigo_producto
+        self.fecha_compra = fecha_compra
+        self.cantidad = cantidad
+        self.precio_unitario = precio_unitario
+        self.total = total
+        self.estado = estado
+        self.motivo = motivo
+
+    def __repr__(self):
+        return f"Pedido({self.numero!r}, {self.producto!r}, {self.fecha_compra!r})"
+
+    def fecha_limite_devolucion(self, defectuoso=True):
+        """Último día para devolver: entrega estimada + plazo según el tipo de devolución."""
+        if self.fecha_compra is None:
+            return None
+        plazo = PLAZO_DEFECTUOSO_DIAS if defectuoso else PLAZO_VOLUNTARIO_DIAS
+        return self.fecha_compra + timedelta(days=DIAS_ENTREGA_ESTIMADOS + plazo)
+
+
+class Solicitud:
+    """Solicitud de devolución registrada en solicitudes_detalladas.txt."""
+    __slots__ = ("numero", "pedido", "cliente", "producto", "motivo", "estado", "accion")
+
+    def __init__(self, numero, pedido=None, cliente=None, producto=None, motivo=None, estado=None, accion=None):
+        self.numero = numero
+        self.pedido = pedido
+        self.cliente = cliente
+        self.producto = producto
+        self.motivo = motivo
+        self.estado = estado
+        self.accion = accion
+
+    def __repr__(self):
+        return f"Solicitud({self.numero!r}, {self.pedido!r}, {self.estado!r})"
+
+
+def parsear_catalogo(texto):
+    """Convierte el texto de catalogo_productos.txt en una lista de Producto."""
+    productos = []
+    categoria, nombre = None, None
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if linea.startswith("CATEGORÍA:"):
+            categoria = linea.split(":", 1)[1].strip()
+        elif linea.startswith("🔹"):
+            nombre = linea.lstrip("🔹").strip()
+            productos.append(Producto(None, nombre, None, categoria))
+        elif nombre and linea.startswith("Código:"):
+            productos[-1].codigo = linea.split(":", 1)[1].strip().upper()
+        elif nombre and linea.startswith("Precio:"):
+            productos[-1].precio = _precio(linea.split(":", 1)[1])
+        elif linea.startswith("---") or linea.startswith("==="):
+            nombre = None
+    return [p for p in productos if p.codigo]
+
+
+def parsear_pedidos(texto):
+    """Convierte el texto de pedidos_detallados.txt en una lista de Pedido."""
+    pedidos = []
+    actual = None
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if linea.startswith("PEDIDO:"):
+            actual = Pedido(linea.split(":", 1)[1].strip().upper())
+            pedidos.append(actual)
+            continue
+        if actual is None or ":" not in linea:
+            if linea.startswith("---") or linea.startswith("==="):
+                actual = None
+            continue
+        campo, valor = (x.strip() for x in linea.split(":", 1))
+        if campo == "Cliente":
+            actual.cliente = valor
+        elif campo == "Producto":
+            actual.producto = valor
+        elif campo == "Fecha de Compra":
+            actual.fecha_compra = _fecha(valor)
+        elif campo == "Cantidad":
+            actual.cantidad = _entero(valor)
+        elif campo == "Precio Unitario":
+            actual.precio_unitario = _precio(valor)
+        elif campo == "Total":
+            actual.total = _precio(valor)
+        elif campo == "Estado":
+            actual.estado = valor
+        elif campo == "Motivo de devolución":
+            actual.motivo = valor
+    return pedidos
+
+
+def parsear_solicitudes(texto):
+    """Convierte el texto de solicitudes_detalladas.txt en una lista de Solicitud."""
+    solicitudes = []
+    actual = None
+    for linea in texto.splitlines():
+        linea = linea.strip()
+        if linea.startswith("SOLICITUD ID:"):
+            actual = Solicitud(linea.split(":", 1)[1].strip())
+            solicitudes.append(actual)
+            continue
+        if actual is None or ":" not in linea:
+            if linea.startswith("---") or linea.startswith("==="):
+                actual = None
+            continue
+        campo, valor = (x.strip() for x in linea.split(":", 1))
+        if campo == "Pedido Relacionado":
+            # 'NO ENCONTRADO' cuando la solicitud no se pudo asociar a un pedido
+            actual.pedido = valor.upper() if valor.upper().startswith("ECO-") else None
+        elif campo == "Cliente":
+            actual.cliente = valor
+        elif campo == "Producto":
+            actual.producto = valor
+        elif campo == "Motivo":
+            actual.motivo = valor
+        elif campo == "Estado de elegibilidad":
+            actual.estado = valor
+        elif campo == "Acción recomendada":
+            actual.accion = valor
+    return solicitudes
+
+
+class IndiceComercial:
+    """Pedidos y productos indexados en diccionarios.
+
+       Los archivos se leen en el primer uso y se vuelven a leer, por separado, solo cuando
+       cambia su fecha de modificación o su tamaño.
+    """
+
+    def __init__(self, ruta_pedidos, ruta_catalogo, ruta_solicitudes=None):
+        self.ruta_pedidos = ruta_pedidos
+        self.ruta_catalogo = ruta_catalogo
+        self.ruta_solicitudes = ruta_solicitudes
+        self._firmas = {"catalogo": None, "pedidos": None, "solicitudes": None}
+        self._lock = threading.Lock()
+        self.pedidos = {}            # número de pedido -> Pedido
+        self.productos = {}          # código -> Producto
+        self.productos_por_nombre = {}   # nombre normalizado -> Producto
+        self._productos_por_palabra = {} # palabra clave -> [Producto]
+        self.solicitudes = {}        # ID de solicitud -> Solicitud
+        self._solicitudes_por_pedido = {} # número de pedido -> [Solicitud]
+
+    def _firma(self, ruta):
+        if ruta is None:
+            return None
+        try:
+            estado = os.stat(ruta)
+            return (estado.st_mtime_ns, estado.st_size)
+        except OSError:
+            return None
+
+    def _leer(self, ruta):
+        if ruta is None or not os.path.exists(ruta):
+            return ""
+        with open(ruta, encoding="utf-8") as f:
+            return f.read()
+
+    def refrescar(self):
+        """Vuelve a leer los archivos que hayan cambiado desde la última lectura."""
+        firmas = {"catalogo": self._firma(self.ruta_catalogo), "pedidos": self._firma(self.ruta_pedidos),
+                  "solicitudes": self._firma(self.ruta_solicitudes)}
+        if firmas == self._firmas:
+            return
+
+        with self._lock:
+            catalogo_cambio = firmas["catalogo"] != self._firmas.get("catalogo")
+            if catalogo_cambio:
+                productos = parsear_catalogo(self._leer(self.ruta_catalogo))
+                por_nombre, por_palabra = {}, {}
+                for producto in productos:
+                    nombre = normalizar_nombre(producto.nombre)
+                    por_nombre[nombre] = producto
+                    for palabra in _palabras_clave(nombre):
+                        por_palabra.setdefault(palabra, []).append(producto)
+                self.productos = {p.codigo: p for p in productos}
+                self.productos_por_nombre = por_nombre
+                self._productos_por_palabra = por_palabra
+
+            # Los pedidos enlazan con el catálogo, así que se releen también si cambió el catálogo
+            if catalogo_cambio or firmas["pedidos"] != self._firmas.get("pedidos"):
+                pedidos = parsear_pedidos(self._leer(self.ruta_pedidos))
+                for pedido in pedidos:
+                    producto = self.productos_por_nombre.get(normalizar_nombre(pedido.producto or ""))
+                    pedido.codigo_producto = producto.codigo if producto else None
+                self.pedidos = {p.numero: p for p in pedidos}
+
+            if firmas["solicitudes"] != self._firmas.get("solicitudes"):
+                solicitudes = parsear_solicitudes(self._leer(self.ruta_solicitudes))
+                por_pedido = {}
+                for solicitud in solicitudes:
+                    if solicitud.pedido:
+                        por_pedido.setdefault(solicitud.pedido, []).append(solicitud)
+                self.solicitudes = {s.numero: s for s in solicitudes}
+                self._solicitudes_por_pedido = por_pedido
+            self._firmas = firmas
+
+    def pedido(self, numero):
+        """Busca un pedido por número ('ECO-1001', 'eco-1001' o '1001'). None si no existe."""
+        self.refrescar()
+        numero = str(numero).strip().upper()
+        if numero.isdigit():
+            numero = f"ECO-{numero}"
+        return self.pedidos.get(numero)
+
+    def solicitud(self, numero):
+        """Busca una solicitud por su ID ('1003'). None si no existe."""
+        self.refrescar()
+        return self.solicitudes.get(str(numero).strip())
+
+    def solicitudes_de_pedido(self, numero):
+        """Solicitudes documentadas de un pedido ('ECO-1002', 'eco-1002' o '1002')."""
+        self.refrescar()
+        numero = str(numero).strip().upper()
+        if numero.isdigit():
+            numero = f"ECO-{numero}"
+        return list(self._solicitudes_por_pedido.get(numero, ()))
+
+    def producto(self, referencia):
+        """Busca un producto por código o por nombre. Si no hay coincidencia exacta del nombre,
+           elige el producto que comparte más palabras clave con él. None si no hay ninguno o si
+           varios empatan (la referencia es ambigua).
+        """
+        self.refrescar()
+        if not referencia:
+            return None
+        codigo = str(referencia).strip().upper()
+        if codigo in self.productos:
+            return self.productos[codigo]
+        nombre = normalizar_nombre(referencia)
+        if nombre in self.productos_por_nombre:
+            return self.productos_por_nombre[nombre]
+
+        votos = {}
+        for palabra in _palabras_clave(nombre):
+            for producto in self._productos_por_palabra.get(palabra, ()):
+                votos[producto.codigo] = votos.get(producto.codigo, 0) + 1
+        if not votos:
+            return None
+        maximo = max(votos.values())
+        mejores = [codigo for codigo, n in votos.items() if n == maximo]
+        return self.productos[mejores[0]] if len(mejores) == 1 else None
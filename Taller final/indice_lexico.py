@@ -0,0 +1,201 @@
+# ============================================================
+# indice_lexico.py — Índice invertido BM25 y retriever híbrido
+# El índice léxico se construye sobre los mismos fragmentos que FAISS y se
+# guarda junto a él. Las consultas con identificadores (ECO-1001, PROD-001,
+# "solicitud 1003") se resuelven solo con el índice léxico, sin embeddings;
+# el resto combina BM25 y búsqueda vectorial por fusión de rankings (RRF).
+# ============================================================
+
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metricas import metricas
+
+_PATRON_TOKEN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+# Números de pedido (ECO-1001), códigos de producto (PROD-001) e IDs de solicitud (solicitud 1003)
+_PATRON_IDENTIFICADOR = re.compile(
+    r"\b((?:eco|prod)-\d+)\b|\bsolicitud(?:\s+id)?\s*:?\s*#?\s*(\d{3,})\b"
+)
+_STOPWORDS = frozenset(
+    "a al con de del el en es la las lo los me mi o para por que se su sus un una y "
+    "cual cuales como cuando donde esta este hay mis tu yo".split()
+)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def _sin_tildes(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+
+def tokenizar(texto):
+    """Divide un texto en términos normalizados (minúsculas, sin tildes, sin palabras vacías).
+       Los identificadores con guion como 'eco-1001' se conservan como un único término.
+    """
+    return [t for t in _PATRON_TOKEN.findall(_sin_tildes(texto)) if t not in _STOPWORDS]
+
+
+def extraer_identificadores(consulta):
+    """Devuelve los identificadores de la consulta como términos del índice ('eco-1001', '1003')."""
+    return [a or b for a, b in _PATRON_IDENTIFICADOR.findall(_sin_tildes(consulta))]
+
+
+class IndiceLexico:
+    """Índice invertido con puntuación BM25.
+
+       `postings` guarda {término: {id_fragmento: frecuencia}} y `longitudes` {id_fragmento: nº de términos}.
+    """
+
+    def __init__(self, postings=None, longitudes=None):
+        self.postings = postings or {}
+        self.longitudes = longitudes or {}
+        self._recalcular()
+
+    def _recalcular(self):
+        self.num_documentos = len(self.longitudes)
+        self.longitud_media = (sum(self.longitudes.values()) / self.num_documentos) if self.num_documentos else 0.0
+
+    @classmethod
+    def construir(cls, fragmentos):
+        """Construye el índice a partir de pares (id_fragmento, texto)."""
+        postings, longitudes = {}, {}
+        for id_fragmento, texto in fragmentos:
+            terminos = Counter(tokenizar(texto))
+            longitudes[id_fragmento] = sum(terminos.values())
+            for termino, frecuencia in terminos.items():
+                postings.setdefault(termino, {})[id_fragmento] = frecuencia
+        return cls(postings, longitudes)
+
+    def _idf(self, termino):
+        df = len(self.postings.get(termino, ()))
+        return math.log(1 + (self.num_documentos - df + 0.5) / (df + 0.5))
+
+    def _puntuar(self, terminos, candidatos=None):
+        puntuaciones = {}
+        for termino in set(terminos):
+            documentos = self.postings.get(termino)
+            if not documentos:
+                continue
+            idf = self._idf(termino)
+            for id_fragmento, frecuencia in documentos.items():
+                if candidatos is not None and id_fragmento not in candidatos:
+                    continue
+                norma = BM25_K1 * (1 - BM25_B + BM25_B * self.longitudes[id_fragmento] / (self.longitud_media or 1))
+                puntuaciones[id_fragmento] = puntuaciones.get(id_fragmento, 0.0) + idf * frecuencia * (BM25_K1 + 1) / (frecuencia + norma)
+        return puntuaciones
+
+    def buscar(self, consulta, k=10, candidatos=None):
+        """Devuelve los k fragmentos con mejor puntuación BM25 como [(id_fragmento, puntuación)].
+           Con `candidatos`, solo se puntúan esos ids (p. ej. los de las particiones elegidas).
+        """
+        puntuaciones = self._puntuar(tokenizar(consulta), candidatos)
+        return sorted(puntuaciones.items(), key=lambda par: par[1], reverse=True)[:k]
+
+    def buscar_identificadores(self, identificadores, consulta, k=3):
+        """Fragmentos que contienen alguno de los identificadores, ordenados por cuántos contienen
+           y después por BM25 de la consulta completa. Lista vacía si ninguno aparece en el índice.
+        """
+        coincidencias = Counter()
+        for identificador in identificadores:
+            for id_fragmento in self.postings.get(identificador, ()):
+                coincidencias[id_fragmento] += 1
+        if not coincidencias:
+            return []
+        bm25 = self._puntuar(tokenizar(consulta), candidatos=coincidencias)
+        ordenados = sorted(coincidencias, key=lambda i: (coincidencias[i], bm25.get(i, 0.0)), reverse=True)
+        return [(i, bm25.get(i, 0.0)) for i in ordenados[:k]]
+
+    def guardar(self, ruta):
+        """Guarda el índice como JSON (archivo temporal + os.replace)."""
+        tmp_path = ruta + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"postings": self.postings, "longitudes": self.longitudes}, f, ensure_ascii=False)
+        os.replace(tmp_path, ruta)
+
+    @classmethod
+    def cargar(cls, ruta):
+        """Carga un índice guardado con guardar()."""
+        with open(ruta, encoding="utf-8") as f:
+            datos = json.load(f)
+        return cls(datos["postings"], datos["longitudes"])
+
+
+class RetrieverHibrido(BaseRetriever):
+    """Retriever que combina el índice léxico BM25 con la búsqueda vectorial de FAISS.
+
+       - Consultas con identificadores: se responden solo con el índice léxico (sin embeddings).
+       - Resto: se fusionan los rankings BM25 y vectorial con Reciprocal Rank Fusion.
+       Con `particiones`, ambos rankings se limitan a las particiones que elige su enrutador.
+    """
+
+    vectorstore: Any
+    indice: Any
+    k: int = 3
+    k_candidatos: int = 10
+    rrf_k: int = 60
+    particiones: Any = None
+
+    def _documentos(self, ids):
+        documentos = []
+        for id_fragmento in ids:
+            doc = self.vectorstore.docstore.search(id_fragmento)
+            if isinstance(doc, Document):
+                doc.id = id_fragmento # Para leer su vector del índice sin volver a embeberlo
+                documentos.append(doc)
+        return documentos
+
+    def _buscar_vectorial(self, consulta, particiones=None):
+        with metricas.medir("embedding_consulta"):
+            vector = np.asarray([self.vectorstore.embeddings.embed_query(consulta)], dtype=np.float32)
+        if particiones:
+            with metricas.medir("busqueda_faiss", particiones=len(particiones)):
+                return self.particiones.buscar(vector, self.k_candidatos, particiones)
+        with metricas.medir("busqueda_faiss"):
+            _, posiciones = self.vectorstore.index.search(vector, self.k_candidatos)
+        return [self.vectorstore.index_to_docstore_id[int(p)] for p in posiciones[0] if p != -1]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with metricas.medir("recuperacion"):
+            return self._recuperar(query)
+
+    def _recuperar(self, query):
+        identificadores = extraer_identificadores(query)
+        if identificadores:
+            with metricas.medir("busqueda_identificadores"):
+                resultados = self.indice.buscar_identificadores(identificadores, query, self.k)
+            if resultados:
+                metricas.anotar(ruta_recuperacion="identificadores")
+                return self._documentos([i for i, _ in resultados])
+
+        metricas.anotar(ruta_recuperacion="hibrida")
+        particiones = None
+        if self.particiones is not None:
+            with metricas.medir("enrutamiento_particiones"):
+                particiones = self.particiones.enrutar(query)
+            metricas.anotar(particiones=",".join(particiones) if particiones else "todas")
+            for nombre in particiones or ("todas",):
+                metricas.contar("ecomarket_particiones_total", particion=nombre)
+        with metricas.medir("bm25"):
+            candidatos = self.particiones.ids_de(particiones) if particiones else None
+            lexico = [i for i, _ in self.indice.buscar(query, self.k_candidatos, candidatos)]
+        rankings = [lexico, self._buscar_vectorial(query, particiones)]
+        fusion = {}
+        for ranking in rankings:
+            for posicion, id_fragmento in enumerate(ranking):
+                fusion[id_fragmento] = fusion.get(id_fragmento, 0.0) + 1.0 / (self.rrf_k + posicion + 1)
+        mejores = sorted(fusion, key=fusion.get, reverse=True)[:self.k]
+        return self._documentos(mejores)
@@ -0,0 +1,215 @@
+# ============================================================
+# indices_faiss.py — Tipos de índice FAISS configurables
+# El vectorstore se construye primero como índice plano (exacto) y, si se
+# configura otro tipo, se convierte a HNSW, IVF o IVF-PQ entrenando sobre
+# una muestra de los vectores. La conversión mide el recall frente al
+# índice plano. Los índices se leen con memory-mapping para que varios
+# procesos compartan una sola copia de los vectores en la caché del SO.
+# ============================================================
+
+import math
+import os
+import threading
+import time
+
+import faiss
+import numpy as np
+
+TIPOS_INDICE = ("flat", "hnsw", "ivf", "ivfpq")
+
+# FAISS pide al menos 39 puntos de entrenamiento por centroide
+PUNTOS_POR_CENTROIDE = 39
+# Por debajo de este número de vectores, el índice plano es exacto y igual de rápido que IVF
+MIN_VECTORES_IVF = 1000
+# Bits mínimos por subcuantizador para que PQ conserve algo de precisión
+MIN_BITS_PQ = 4
+
+
+def _metrica(producto_interno):
+    return faiss.METRIC_INNER_PRODUCT if producto_interno else faiss.METRIC_L2
+
+
+def _plano(dimension, producto_interno):
+    return faiss.IndexFlatIP(dimension) if producto_interno else faiss.IndexFlatL2(dimension)
+
+
+def nlist_automatico(num_vectores):
+    """Número de listas IVF: ~4·√n, limitado para tener puntos de entrenamiento suficientes."""
+    return max(1, min(int(4 * math.sqrt(num_vectores)), num_vectores // PUNTOS_POR_CENTROIDE))
+
+
+def _subcuantizadores(dimension, pq_m):
+    """Subcuantizadores de PQ: el pedido o el mayor divisor de la dimensión con subvectores de ~16 valores."""
+    if pq_m:
+        return pq_m if dimension % pq_m == 0 else None
+    objetivo = max(1, dimension // 16)
+    return next(m for m in range(objetivo, 0, -1) if dimension % m == 0)
+
+
+def tipo_de_indice(index):
+    """Devuelve el tipo ('flat', 'hnsw', 'ivf' o 'ivfpq') de un índice FAISS."""
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+
+def crear_indice(tipo, dimension, num_vectores, producto_interno=False, nlist=0,
+                 hnsw_m=32, ef_construccion=200, pq_m=0, pq_bits=8):
+    """Crea un índice vacío del tipo pedido. Devuelve (índice, tipo_efectivo).
+
+       Si no hay vectores suficientes para entrenar IVF o PQ, se usa el tipo más cercano
+       que sí puede entrenarse (IVF-PQ -> IVF -> plano) y se indica en `tipo_efectivo`.
+    """
+    if tipo not in TIPOS_INDICE:
+        raise ValueError(f"Tipo de índice desconocido: {tipo!r} (usa {', '.join(TIPOS_INDICE)})")
+    metrica = _metrica(producto_interno)
+
+    if tipo == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, metrica)
+        index.hnsw.efConstruction = ef_construccion
+        return index, "hnsw"
+
+    if tipo in ("ivf", "ivfpq") and num_vectores >= MIN_VECTORES_IVF:
+        nlist = nlist or nlist_automatico(num_vectores)
+        if tipo == "ivfpq":
+            m = _subcuantizadores(dimension, pq_m)
+            bits = min(pq_bits, int(math.log2(num_vectores / PUNTOS_POR_CENTROIDE)))
+            if m and bits >= MIN_BITS_PQ:
+                cuantizador = _plano(dimension, producto_interno)
+                return faiss.IndexIVFPQ(cuantizador, dimension, nlist, m, bits, metrica), "ivfpq"
+            print(f"⚠️ IVF-PQ no puede entrenarse con {num_vectores} vectores de dimensión {dimension}. Se usa IVF.")
+        cuantizador = _plano(dimension, producto_interno)
+        return faiss.IndexIVFFlat(cuantizador, dimension, nlist, metrica), "ivf"
+
+    if tipo != "flat":
+        print(f"⚠️ {num_vectores} vectores son pocos para un índice {tipo}. Se usa un índice plano (exacto).")
+    return _plano(dimension, producto_interno), "flat"
+
+
+def configurar_busqueda(index, nprobe=8, ef_busqueda=64):
+    """Ajusta los parámetros de búsqueda: listas visitadas (IVF) o candidatos explorados (HNSW)."""
+    tipo = tipo_de_indice(index)
+    if tipo in ("ivf", "ivfpq"):
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    elif tipo == "hnsw":
+        index.hnsw.efSearch = ef_busqueda
+    return index
+
+
+def medir_recall(index, referencia, consultas, k=10):
+    """Recall@k de `index` frente al índice exacto `referencia` para las consultas dadas."""
+    k = min(k, referencia.ntotal)
+    if k == 0 or len(consultas) == 0:
+        return 1.0
+    _, exactos = referencia.search(consultas, k)
+    _, aproximados = index.search(consultas, k)
+    aciertos = sum(len(set(e) & set(a)) for e, a in zip(exactos.tolist(), aproximados.tolist()))
+    return aciertos / (len(consultas) * k)
+
+
+def convertir_indice(plano, tipo, producto_interno=False, muestra=50000, consultas_recall=200,
+                     nprobe=8, ef_busqueda=64, semilla=0, **parametros):
+    """Convierte un índice plano al tipo pedido conservando el orden de los vectores.
+
+       El entrenamiento usa una muestra aleatoria de hasta `muestra` vectores. Devuelve
+       (índice, informe) con el tipo efectivo, los tiempos y el recall@10 frente al índice plano.
+    """
+    inicio = time.perf_counter()
+    vectores = plano.reconstruct_n(0, plano.ntotal)
+    index, tipo_efectivo = crear_indice(tipo, plano.d, plano.ntotal, producto_interno, **parametros)
+    informe = {"tipo": tipo, "tipo_efectivo": tipo_efectivo, "vectores": int(plano.ntotal)}
+    if tipo_efectivo == "flat":
+        informe.update({"segundos": time.perf_counter() - inicio, "recall_a_10": 1.0})
+        return plano, informe
+
+    generador = np.random.default_rng(semilla)
+    if not index.is_trained:
+        entrenamiento = vectores
+        if len(vectores) > muestra:
+            entrenamiento = vectores[generador.choice(len(vectores), muestra, replace=False)]
+        inicio_entrenamiento = time.perf_counter()
+        index.train(entrenamiento)
+        informe["segundos_entrenamiento"] = time.perf_counter() - inicio_entrenamiento
+        informe["muestra_entrenamiento"] = len(entrenamiento)
+    index.add(vectores)
+    configurar_busqueda(index, nprobe, ef_busqueda)
+
+    consultas = vectores[generador.choice(len(vectores), min(consultas_recall, len(vectores)), replace=False)]
+    informe["recall_a_10"] = medir_recall(index, plano, consultas)
+    if tipo_efectivo in ("ivf", "ivfpq"):
+        informe["nlist"] = int(faiss.extract_index_ivf(index).nlist)
+        informe["nprobe"] = nprobe
+    else:
+        informe["ef_busqueda"] = ef_busqueda
+    informe["segundos"] = time.perf_counter() - inicio
+    return index, informe
+
+
+_lock_mapa_directo = threading.Lock()
+
+
+def reconstruir_vectores(index, posiciones):
+    """Vectores guardados en las posiciones dadas (IVF necesita su mapa directo, que se crea
+       una sola vez; en IVF-PQ son la aproximación codificada)."""
+    if tipo_de_indice(index) in ("ivf", "ivfpq"):
+        ivf = faiss.extract_index_ivf(index)
+        with _lock_mapa_directo:
+            if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                ivf.make_direct_map()
+    return index.reconstruct_batch(np.asarray(posiciones, dtype=np.int64))
+
+
+def borrar_posiciones(index, posiciones):
+    """Borra los vectores de las posiciones dadas y renumera los restantes de 0 a n-1 en su orden,
+       como renumera FAISS.delete de LangChain su index_to_docstore_id. El índice plano ya se
+       compacta al borrar; IVF conserva los ids, así que se reescriben en sus listas invertidas.
+       HNSW no admite borrados (ValueError).
+    """
+    tipo = tipo_de_indice(index)
+    if tipo == "hnsw":
+        raise ValueError("El índice HNSW no admite borrados: hay que reconstruirlo.")
+    borrar = np.unique(np.asarray(list(posiciones), dtype=np.int64))
+    if tipo == "flat":
+        index.remove_ids(borrar)
+        return
+
+    ivf = faiss.extract_index_ivf(index)
+    with _lock_mapa_directo:
+        # El mapa directo en forma de array no admite borrados; reconstruir_vectores lo rehace
+        ivf.make_direct_map(False)
+        ivf.remove_ids(borrar)
+        listas = ivf.invlists
+        for lista in range(ivf.nlist):
+            n = listas.list_size(lista)
+            if n == 0:
+                continue
+            ids = faiss.rev_swig_ptr(listas.get_ids(lista), n).copy()
+            # Cada id baja tantos puestos como posiciones borradas tiene por delante
+            nuevos = ids - np.searchsorted(borrar, ids)
+            if np.array_equal(nuevos, ids):
+                continue
+            codigos = faiss.rev_swig_ptr(listas.get_codes(lista), n * listas.code_size).copy()
+            listas.update_entries(lista, 0, n, faiss.swig_ptr(nuevos), faiss.swig_ptr(codigos))
+
+
+def leer_indice(ruta, mmap=True):
+    """Lee un índice guardado. Con `mmap`, los vectores se mapean en memoria en modo solo lectura
+       (las versiones de FAISS sin IO_FLAG_MMAP_IFC solo mapean las listas de IVF).
+       Un índice mapeado no admite add ni remove: hay que volver a leerlo con mmap=False.
+    """
+    if not mmap:
+        return faiss.read_index(ruta)
+    bandera = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    return faiss.read_index(ruta, bandera | faiss.IO_FLAG_READ_ONLY)
+
+
+def escribir_indice(index, ruta):
+    """Guarda el índice en un archivo temporal y lo reemplaza con os.replace
+       (los procesos que tengan mapeado el anterior siguen leyendo su copia)."""
+    tmp_path = ruta + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, ruta)
@@ -0,0 +1,234 @@
+# ============================================================
+# lote_preguntas.py — Preguntas por lotes sin la interfaz de Gradio
+# Lee un archivo JSONL (una pregunta por línea, p. ej. con el formato de
+# requests.jsonl), agrupa las preguntas idénticas y las responde con el
+# mismo flujo que chat_ecomarket (enrutador, tools, caché y RAG) desde
+# varios hilos a la vez. Cada respuesta se escribe en cuanto termina como
+# una línea JSONL con sus tiempos por etapa. El propio archivo de salida
+# es el punto de control: al relanzar el comando se saltan las preguntas
+# ya respondidas.
+# Uso:
+#   python lote_preguntas.py preguntas.jsonl --salida respuestas.jsonl
+#   python lote_preguntas.py ../requests.jsonl --campo body --concurrencia 8 --salida respuestas.jsonl
+# ============================================================
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from metricas import metricas
+
+# Campos que se prueban, en orden, si no se indica --campo / --campo-id
+CAMPOS_PREGUNTA = ("pregunta", "question", "body", "texto", "title")
+CAMPOS_ID = ("id", "request_id")
+# Cada cuántas respuestas se informa del progreso
+INTERVALO_PROGRESO = 50
+# Inicio de los avisos con que chat_ecomarket responde a un fallo: en salidas de versiones
+# anteriores (que no marcaban esos fallos como error) esas preguntas se vuelven a responder
+PREFIJO_RESPUESTA_ERROR = "⚠️ Ocurrió un error"
+
+
+def clave_pregunta(pregunta):
+    """Clave de deduplicación: la pregunta sin espacios sobrantes (las tools distinguen
+       mayúsculas, guiones y separadores, así que solo se agrupan las idénticas)."""
+    return " ".join(pregunta.split())
+
+
+def _campo(registro, campo, candidatos):
+    if campo:
+        return registro.get(campo)
+    return next((registro[c] for c in candidatos if registro.get(c) not in (None, "")), None)
+
+
+def leer_preguntas(ruta, campo=None, campo_id=None):
+    """Lee el JSONL de entrada y agrupa las preguntas idénticas.
+
+       Devuelve (OrderedDict clave -> {"pregunta", "ids", "linea"}, líneas leídas). Cada línea
+       puede ser un objeto JSON o una cadena; las ilegibles o sin pregunta se avisan y se saltan.
+    """
+    preguntas = OrderedDict()
+    lineas = 0
+    with open(ruta, encoding="utf-8") as f:
+        for numero, linea in enumerate(f, start=1):
+            if not linea.strip():
+                continue
+            lineas += 1
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError as e:
+                print(f"⚠️ Línea {numero} ilegible ({e}). Se salta.", file=sys.stderr)
+                continue
+            if isinstance(registro, str):
+                registro = {"pregunta": registro}
+            pregunta = _campo(registro, campo, CAMPOS_PREGUNTA) if isinstance(registro, dict) else None
+            if not isinstance(pregunta, str) or not pregunta.strip():
+                print(f"⚠️ Línea {numero} sin pregunta. Se salta.", file=sys.stderr)
+                continue
+            identificador = _campo(registro, campo_id, CAMPOS_ID)
+            clave = clave_pregunta(pregunta)
+            entrada = preguntas.setdefault(clave, {"pregunta": pregunta.strip(), "ids": [], "linea": numero})
+            entrada["ids"].append(identificador if identificador is not None else numero)
+    return preguntas, lineas
+
+
+def leer_punto_control(ruta):
+    """Claves ya respondidas (sin error ni aviso de error) en un archivo de salida anterior.
+
+       Si la última línea quedó a medias por una interrupción, se recorta el archivo
+       para que las nuevas respuestas empiecen en una línea limpia.
+    """
+    hechas = set()
+    if not os.path.exists(ruta):
+        return hechas
+    valido = 0
+    with open(ruta, "rb") as f:
+        for linea in f:
+            try:
+                resultado = json.loads(linea)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                break
+            if not linea.endswith(b"\n"):
+                break
+            valido += len(linea)
+            if not resultado.get("error") and not str(resultado.get("respuesta")).startswith(PREFIJO_RESPUESTA_ERROR):
+                hechas.add(resultado["clave"])
+    if valido < os.path.getsize(ruta):
+        print(f"⚠️ {ruta} terminaba con una línea incompleta. Se recorta.", file=sys.stderr)
+        with open(ruta, "r+b") as f:
+            f.truncate(valido)
+    return hechas
+
+
+def responder(app, clave, entrada):
+    """Responde una pregunta con el flujo de chat_ecomarket y devuelve la línea de resultado.
+       Los fallos de las tools o del RAG, y el RAG no disponible, se registran en `error` para
+       que la pregunta se repita al relanzar el comando."""
+    inicio = time.perf_counter()
+    error = None
+    respuesta = None
+    with metricas.traza("lote") as traza:
+        try:
+            respuesta = app._chat_ecomarket(entrada["pregunta"], lanzar_errores=True)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    if respuesta == app.MENSAJE_RAG_NO_DISPONIBLE:
+        error = "RAG no disponible"
+    etapas = {}
+    for etapa, _, duracion, _ in traza.etapas:
+        etapas[etapa] = etapas.get(etapa, 0.0) + duracion * 1000
+    return {
+        "clave": clave,
+        "ids": entrada["ids"],
+        "linea": entrada["linea"],
+        "pregunta": entrada["pregunta"],
+        "respuesta": respuesta,
+        "error": error,
+        "segundos": time.perf_counter() - inicio,
+        "etapas_ms": {etapa: round(ms, 3) for etapa, ms in etapas.items()},
+        **traza.atributos, # intención, ruta de recuperación, caché, tokens...
+    }
+
+
+def _registro_omitido(entrada, consulta=None):
+    return "⏭️ Solicitud no registrada (modo por lotes con --sin-registro)."
+
+
+def procesar(app, pendientes, salida, concurrencia):
+    """Responde las preguntas pendientes con `concurrencia` hilos y escribe cada resultado al terminar.
+       Como mucho hay 2·concurrencia preguntas en curso o en cola. Devuelve las latencias y los errores.
+    """
+    latencias, errores = [], 0
+    inicio = time.perf_counter()
+    pendientes = iter(pendientes.items())
+    en_curso = set()
+    with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="lote") as pool:
+        try:
+            while True:
+                for clave, entrada in pendientes:
+                    en_curso.add(pool.submit(responder, app, clave, entrada))
+                    if len(en_curso) >= 2 * concurrencia:
+                        break
+                if not en_curso:
+                    break
+                terminadas, en_curso = wait(en_curso, return_when=FIRST_COMPLETED)
+                for futuro in terminadas:
+                    resultado = futuro.result()
+                    salida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+                    salida.flush()
+                    latencias.append(resultado["segundos"])
+                    errores += bool(resultado["error"])
+                    if len(latencias) % INTERVALO_PROGRESO == 0:
+                        ritmo = len(latencias) / (time.perf_counter() - inicio)
+                        print(f"⏱️ {len(latencias)} respuestas ({ritmo:.1f}/s, {errores} errores).", file=sys.stderr)
+        except KeyboardInterrupt:
+            print("\n🛑 Interrumpido: se terminan las preguntas en curso. Relanza el comando para continuar.",
+                  file=sys.stderr)
+            pool.shutdown(wait=True, cancel_futures=True)
+            for futuro in en_curso:
+                if futuro.done() and not futuro.cancelled():
+                    salida.write(json.dumps(futuro.result(), ensure_ascii=False) + "\n")
+                    latencias.append(futuro.result()["segundos"])
+            salida.flush()
+            raise
+    return latencias, errores, time.perf_counter() - inicio
+
+
+def _argumentos():
+    parser = argparse.ArgumentParser(description="Responde por lotes las preguntas de un archivo JSONL.")
+    parser.add_argument("entrada", help="Archivo JSONL con una pregunta por línea")
+    parser.add_argument("--salida", help="Archivo JSONL de respuestas y punto de control (por defecto, salida estándar)")
+    parser.add_argument("--campo", help=f"Campo con la pregunta (por defecto, el primero de: {', '.join(CAMPOS_PREGUNTA)})")
+    parser.add_argument("--campo-id", help=f"Campo identificador (por defecto, {' o '.join(CAMPOS_ID)}; si no, el nº de línea)")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Preguntas atendidas a la vez")
+    parser.add_argument("--desde-cero", action="store_true", help="Ignora las respuestas ya guardadas en --salida")
+    parser.add_argument("--sin-registro", action="store_true",
+                        help="No registra solicitudes de devolución (la tool responde sin escribir en el registro)")
+    return parser.parse_args()
+
+
+def main():
+    args = _argumentos()
+    preguntas, lineas = leer_preguntas(args.entrada, args.campo, args.campo_id)
+    print(f"📥 {lineas} líneas, {len(preguntas)} preguntas distintas "
+          f"({lineas - len(preguntas)} repetidas o descartadas).", file=sys.stderr)
+
+    hechas = set()
+    if args.salida and not args.desde_cero:
+        hechas = leer_punto_control(args.salida)
+        if hechas:
+            print(f"⏩ {len(hechas)} preguntas ya respondidas en {args.salida}. Se continúa desde ahí.", file=sys.stderr)
+    pendientes = OrderedDict((k, v) for k, v in preguntas.items() if k not in hechas)
+    if not pendientes:
+        print("✅ No quedan preguntas por responder.", file=sys.stderr)
+        return
+
+    salida = open(args.salida, "w" if args.desde_cero else "a", encoding="utf-8") if args.salida else sys.stdout
+    try:
+        # Los mensajes de app van a stderr: la salida estándar puede ser el propio JSONL
+        with contextlib.redirect_stdout(sys.stderr):
+            import app
+            if args.sin_registro:
+                app.HERRAMIENTAS[app.REGISTRO] = _registro_omitido
+            if app.obtener_rag_chain() is None:
+                print("⚠️ El RAG no está disponible: solo responderán las tools.")
+            latencias, errores, segundos = procesar(app, pendientes, salida, max(1, args.concurrencia))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        if salida is not sys.stdout:
+            salida.close()
+
+    p50, p95 = np.percentile(latencias, [50, 95]) if latencias else (0.0, 0.0)
+    print(f"✅ {len(latencias)} preguntas respondidas en {segundos:.1f}s ({len(latencias) / segundos:.1f}/s, "
+          f"p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, {errores} errores).", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
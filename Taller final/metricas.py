@@ -0,0 +1,295 @@
+# ============================================================
+# metricas.py — Tiempos por etapa, contadores y trazas lentas
+# Registro en memoria de bajo costo: cada etapa medida con `medir()` suma su
+# duración a un histograma (con etiquetas) y, si hay una traza en curso, se
+# anota en ella. Las trazas que superan un umbral se guardan (muestreadas)
+# para revisarlas después. Todo se exporta en formato de texto de
+# Prometheus desde un servidor HTTP local.
+# ============================================================
+
+import bisect
+import contextvars
+import functools
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites superiores de los buckets (segundos) del histograma de etapas
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_TOKENS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+METRICA_ETAPAS = "ecomarket_etapa_segundos"
+
+
+def _etiquetas(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def _formato_etiquetas(etiquetas, extra=()):
+    pares = tuple(etiquetas) + tuple(extra)
+    if not pares:
+        return ""
+    escapar = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in pares) + "}"
+
+
+def _numero(valor):
+    return repr(float(valor)) if valor != int(valor) else str(int(valor))
+
+
+class Histograma:
+    """Histograma acumulativo con buckets fijos (como los de Prometheus)."""
+    __slots__ = ("buckets", "cuentas", "suma", "total")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.cuentas = [0] * (len(buckets) + 1) # el último es +Inf
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.cuentas[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+
+class Traza:
+    """Etapas de una petición: (nombre, inicio relativo, duración, etiquetas) y atributos sueltos."""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.inicio = time.perf_counter()
+        self.fecha = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.etapas = []
+        self.atributos = {}
+        self.duracion = None
+
+    def como_dict(self):
+        return {
+            "nombre": self.nombre,
+            "fecha": self.fecha,
+            "duracion_ms": round(self.duracion * 1000, 3) if self.duracion is not None else None,
+            "atributos": self.atributos,
+            "etapas": [
+                {"etapa": n, "inicio_ms": round(i * 1000, 3), "duracion_ms": round(d * 1000, 3), **dict(e)}
+                for n, i, d, e in self.etapas
+            ],
+        }
+
+
+_traza_actual = contextvars.ContextVar("traza_actual", default=None)
+
+
+class RegistroMetricas:
+    """Contadores, histogramas e indicadores calculados al exportar, protegidos por un lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._definiciones = {} # nombre -> (tipo, ayuda, buckets)
+        self._contadores = {}   # nombre -> {etiquetas: valor}
+        self._histogramas = {}  # nombre -> {etiquetas: Histograma}
+        self._indicadores = {}  # nombre -> (ayuda, función sin argumentos)
+        self.umbral_traza = 2.0
+        self.muestreo_trazas = 1.0
+        self.archivo_trazas = None
+        self.trazas_lentas = deque(maxlen=100)
+        self.definir_histograma(METRICA_ETAPAS, "Duración de cada etapa en segundos", BUCKETS_SEGUNDOS)
+
+    # --- Definición ------------------------------------------------------
+
+    def definir_contador(self, nombre, ayuda):
+        self._definiciones[nombre] = ("counter", ayuda, None)
+
+    def definir_histograma(self, nombre, ayuda, buckets):
+        self._definiciones[nombre] = ("histogram", ayuda, tuple(buckets))
+
+    def definir_indicador(self, nombre, ayuda, funcion):
+        """Indicador (gauge) cuyo valor se calcula al exportar."""
+        self._indicadores[nombre] = (ayuda, funcion)
+
+    def configurar_trazas(self, umbral_segundos=2.0, muestreo=1.0, archivo=None, max_trazas=100):
+        """Guarda las trazas que duren más de `umbral_segundos`, una de cada 1/`muestreo`,
+           en memoria (las `max_trazas` últimas) y, si se indica, en un archivo JSONL."""
+        self.umbral_traza = umbral_segundos
+        self.muestreo_trazas = muestreo
+        self.archivo_trazas = archivo
+        self.trazas_lentas = deque(self.trazas_lentas, maxlen=max_trazas)
+
+    # --- Registro --------------------------------------------------------
+
+    def contar(self, nombre, valor=1, **etiquetas):
+        clave = _etiquetas(etiquetas)
+        with self._lock:
+            serie = self._contadores.setdefault(nombre, {})
+            serie[clave] = serie.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = _etiquetas(etiquetas)
+        with self._lock:
+            serie = self._histogramas.setdefault(nombre, {})
+            histograma = serie.get(clave)
+            if histograma is None:
+                definicion = self._definiciones.get(nombre)
+                histograma = serie[clave] = Histograma(definicion[2] if definicion else BUCKETS_SEGUNDOS)
+            histograma.observar(valor)
+
+    def registrar_etapa(self, etapa, inicio, duracion, error=None, **etiquetas):
+        """Registra una etapa ya medida (inicio según time.perf_counter) en el histograma y la traza."""
+        self.observar(METRICA_ETAPAS, duracion, etapa=etapa, **etiquetas)
+        traza = _traza_actual.get()
+        if traza is not None:
+            claves = _etiquetas(etiquetas) + ((("error", error),) if error else ())
+            traza.etapas.append((etapa, inicio - traza.inicio, duracion, claves))
+
+    def medir(self, etapa, **etiquetas):
+        """Context manager que mide una etapa: `with metricas.medir("recuperacion"): ...`"""
+        return _Medicion(self, etapa, etiquetas)
+
+    def medido(self, etapa, **etiquetas):
+        """Decorador que mide cada llamada a la función como la etapa `etapa`."""
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with self.medir(etapa, **etiquetas):
+                    return funcion(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    def anotar(self, **atributos):
+        """Añade atributos (ruta elegida, tokens...) a la traza en curso, si la hay."""
+        traza = _traza_actual.get()
+        if traza is not None:
+            traza.atributos.update(atributos)
+
+    def traza(self, nombre):
+        """Context manager que agrupa las etapas de una petición en una traza."""
+        return _Trazado(self, nombre)
+
+    def _cerrar_traza(self, traza):
+        if traza.duracion < self.umbral_traza or random.random() >= self.muestreo_trazas:
+            return
+        datos = traza.como_dict()
+        self.trazas_lentas.append(datos)
+        if self.archivo_trazas:
+            try:
+                with self._lock, open(self.archivo_trazas, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(datos, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"⚠️ No se pudo guardar la traza lenta en {self.archivo_trazas}: {e}")
+
+    # --- Exportación -----------------------------------------------------
+
+    def exportar_prometheus(self):
+        """Devuelve todas las métricas en el formato de texto de Prometheus."""
+        lineas = []
+        with self._lock:
+            contadores = {n: dict(s) for n, s in self._contadores.items()}
+            histogramas = {
+                n: {k: (h.buckets, list(h.cuentas), h.suma, h.total) for k, h in s.items()}
+                for n, s in self._histogramas.items()
+            }
+        for nombre in sorted(contadores):
+            lineas.append(f"# HELP {nombre} {self._definiciones.get(nombre, ('', nombre))[1]}")
+            lineas.append(f"# TYPE {nombre} counter")
+            for etiquetas, valor in sorted(contadores[nombre].items()):
+                lineas.append(f"{nombre}{_formato_etiquetas(etiquetas)} {_numero(valor)}")
+        for nombre in sorted(histogramas):
+            lineas.append(f"# HELP {nombre} {self._definiciones.get(nombre, ('', nombre))[1]}")
+            lineas.append(f"# TYPE {nombre} histogram")
+            for etiquetas, (buckets, cuentas, suma, total) in sorted(histogramas[nombre].items()):
+                acumulado = 0
+                for limite, cuenta in zip(buckets + (float("inf"),), cuentas):
+                    acumulado += cuenta
+                    le = "+Inf" if limite == float("inf") else _numero(limite)
+                    lineas.append(f"{nombre}_bucket{_formato_etiquetas(etiquetas, (('le', le),))} {acumulado}")
+                lineas.append(f"{nombre}_sum{_formato_etiquetas(etiquetas)} {_numero(suma)}")
+                lineas.append(f"{nombre}_count{_formato_etiquetas(etiquetas)} {total}")
+        for nombre, (ayuda, funcion) in sorted(self._indicadores.items()):
+            try:
+                valor = funcion()
+            except Exception:
+                continue
+            if valor is None:
+                continue
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} gauge")
+            lineas.append(f"{nombre} {_numero(valor)}")
+        return "\n".join(lineas) + "\n"
+
+    def iniciar_servidor(self, puerto, host="127.0.0.1"):
+        """Sirve /metrics (Prometheus) y /trazas (JSON de trazas lentas) en un hilo de fondo."""
+        registro = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] == "/metrics":
+                    cuerpo = registro.exportar_prometheus().encode("utf-8")
+                    tipo = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path.split("?")[0] == "/trazas":
+                    cuerpo = json.dumps(list(registro.trazas_lentas), ensure_ascii=False).encode("utf-8")
+                    tipo = "application/json; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass # Sin una línea de log por cada consulta de Prometheus
+
+        servidor = ThreadingHTTPServer((host, puerto), Manejador)
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, name="servidor-metricas", daemon=True).start()
+        return servidor
+
+
+class _Medicion:
+    __slots__ = ("registro", "etapa", "etiquetas", "inicio")
+
+    def __init__(self, registro, etapa, etiquetas):
+        self.registro = registro
+        self.etapa = etapa
+        self.etiquetas = etiquetas
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, valor, traceback):
+        duracion = time.perf_counter() - self.inicio
+        error = tipo.__name__ if tipo is not None else None
+        self.registro.registrar_etapa(self.etapa, self.inicio, duracion, error=error, **self.etiquetas)
+        return False
+
+
+class _Trazado:
+    __slots__ = ("registro", "traza", "token")
+
+    def __init__(self, registro, nombre):
+        self.registro = registro
+        self.traza = Traza(nombre)
+
+    def __enter__(self):
+        self.token = _traza_actual.set(self.traza)
+        return self.traza
+
+    def __exit__(self, tipo, valor, traceback):
+        try:
+            _traza_actual.reset(self.token)
+        except ValueError:
+            # Un generador asíncrono puede terminar en otro contexto distinto del que lo empezó
+            _traza_actual.set(None)
+        self.traza.duracion = time.perf_counter() - self.traza.inicio
+        self.registro.observar(METRICA_ETAPAS, self.traza.duracion, etapa=self.traza.nombre)
+        self.registro._cerrar_traza(self.traza)
+        return False
+
+
+# Registro global del proceso
+metricas = RegistroMetricas()
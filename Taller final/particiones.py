@@ -0,0 +1,307 @@
+# ============================================================
+# particiones.py — Índices FAISS por fuente y enrutado de consultas
+# Además del índice global, los fragmentos de cada fuente (pedidos,
+# catálogo, solicitudes, políticas...) tienen su propio índice FAISS.
+# Un enrutador ligero elige las particiones relevantes para cada consulta
+# a partir del nombre de los archivos, los títulos de sus secciones y las
+# referencias cruzadas de indice_maestro.txt, y solo se buscan esas (en
+# paralelo si son varias). Cada partición se reconstruye por separado
+# cuando cambian sus archivos: crecer el historial de pedidos no encarece
+# las consultas sobre políticas.
+# ============================================================
+
+import hashlib
+import json
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+from indice_lexico import extraer_identificadores, tokenizar
+from indices_faiss import configurar_busqueda, convertir_indice, escribir_indice, leer_indice, reconstruir_vectores
+
+VERSION_PARTICIONES = 1
+ARCHIVO_ESTADO = "particiones.json"
+
+# Peso de un término según de dónde sale en el perfil de una partición
+PESO_NOMBRE_ARCHIVO = 2.0
+PESO_TITULO = 1.0
+# Se buscan las particiones con al menos esta fracción de la puntuación de la mejor
+# (un término que solo aparece en títulos no basta si otra partición lo lleva en el nombre)
+UMBRAL_RELATIVO = 0.6
+# Tipo de entidad de cada identificador ('eco-1001' es un pedido, '1003' una solicitud)
+TIPOS_IDENTIFICADOR = (("eco-", "pedido"), ("prod-", "producto"))
+TIPO_IDENTIFICADOR_NUMERICO = "solicitud"
+
+_PATRON_SEPARADOR = re.compile(r"[^a-z0-9]+")
+
+
+def nombre_particion(filename):
+    """Partición de un archivo: la primera palabra de su nombre ('pedidos_detallados.txt' -> 'pedidos')."""
+    terminos = tokenizar(os.path.splitext(os.path.basename(filename))[0].replace("_", " "))
+    nombre = _PATRON_SEPARADOR.sub("", terminos[0]) if terminos else ""
+    return nombre or "general"
+
+
+def raiz(termino):
+    """Raíz aproximada de un término: sin la 's' final y recortada a 6 caracteres
+       ('pedidos' y 'pedido' -> 'pedido', 'devoluciones' y 'devolución' -> 'devolu')."""
+    if len(termino) > 4 and termino.endswith("s"):
+        termino = termino[:-1]
+    return termino[:6]
+
+
+def tipo_identificador(identificador):
+    for prefijo, tipo in TIPOS_IDENTIFICADOR:
+        if identificador.startswith(prefijo):
+            return tipo
+    return TIPO_IDENTIFICADOR_NUMERICO
+
+
+def titulos(texto):
+    """Líneas de título de un texto: las que tienen letras y todas están en mayúsculas."""
+    resultado = []
+    for linea in texto.splitlines():
+        letras = [c for c in linea if c.isalpha()]
+        if len(letras) >= 4 and all(c.isupper() for c in letras):
+            resultado.append(linea.strip())
+    return resultado
+
+
+def relaciones_mapa_temas(texto):
+    """Referencias cruzadas del índice maestro: {identificador: tipos de entidad relacionados}.
+
+       Cada bloque (separado por líneas en blanco) relaciona un pedido con su solicitud, su
+       producto y la política aplicable; una consulta por cualquiera de ellos debe llegar
+       también a las particiones de los demás.
+    """
+    relaciones = {}
+    for bloque in re.split(r"\n\s*\n", texto):
+        identificadores = extraer_identificadores(bloque)
+        if not identificadores:
+            continue
+        tipos = {tipo_identificador(i) for i in identificadores}
+        if "politica" in tokenizar(bloque):
+            tipos.add("politica")
+        for identificador in identificadores:
+            relaciones.setdefault(identificador, set()).update(tipos)
+    return {i: sorted(tipos) for i, tipos in relaciones.items()}
+
+
+def perfil_particion(filenames, textos):
+    """Términos (por su raíz) que describen una partición, con su peso: los del nombre
+       de sus archivos y los de los títulos de sus secciones."""
+    perfil = {}
+    for texto in textos:
+        for titulo in titulos(texto):
+            for termino in tokenizar(titulo):
+                perfil[raiz(termino)] = PESO_TITULO
+    for filename in filenames:
+        for termino in tokenizar(os.path.splitext(filename)[0].replace("_", " ")):
+            perfil[raiz(termino)] = PESO_NOMBRE_ARCHIVO
+    return perfil
+
+
+class EnrutadorParticiones:
+    """Elige las particiones a consultar puntuando los términos de la consulta contra el perfil
+       de cada una (ponderado por IDF entre particiones). Los identificadores aportan el tipo de
+       entidad y, con el índice maestro, los tipos relacionados.
+    """
+
+    def __init__(self, perfiles, relaciones=None):
+        self.perfiles = perfiles
+        self.relaciones = relaciones or {}
+        apariciones = {}
+        for perfil in perfiles.values():
+            for termino in perfil:
+                apariciones[termino] = apariciones.get(termino, 0) + 1
+        total = len(perfiles)
+        # Un término presente en todas las particiones no ayuda a elegir (IDF 0)
+        self._idf = {t: math.log(total / n) for t, n in apariciones.items()}
+
+    def _terminos(self, consulta):
+        terminos = {raiz(t) for t in tokenizar(consulta)}
+        for identificador in extraer_identificadores(consulta):
+            terminos.add(raiz(tipo_identificador(identificador)))
+            terminos.update(raiz(tipo) for tipo in self.relaciones.get(identificador, ()))
+        return terminos
+
+    def puntuar(self, consulta):
+        terminos = self._terminos(consulta)
+        return {
+            nombre: sum(peso * self._idf[t] for t, peso in perfil.items() if t in terminos)
+            for nombre, perfil in self.perfiles.items()
+        }
+
+    def enrutar(self, consulta):
+        """Particiones a consultar, o None si la consulta no permite descartar ninguna."""
+        puntuaciones = self.puntuar(consulta)
+        mejor = max(puntuaciones.values(), default=0.0)
+        if mejor <= 0:
+            return None
+        elegidas = sorted(n for n, p in puntuaciones.items() if p >= UMBRAL_RELATIVO * mejor)
+        return elegidas if len(elegidas) < len(puntuaciones) else None
+
+
+def _firma(ids):
+    return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()
+
+
+def construir_particiones(carpeta, index, almacen, archivos, configuracion, mapa_temas=None,
+                          tipo="flat", producto_interno=False, firma_vectorstore=None, **parametros):
+    """Crea o actualiza los índices por partición de un vectorstore ya guardado.
+
+       `archivos` es el de su manifest ({archivo: {"hash", "fragmentos": [ids]}}). Solo se
+       reconstruyen las particiones cuyos fragmentos cambiaron; si cambia `configuracion`
+       (modelo, dimensión, tipo de índice...) se reconstruyen todas. Los vectores se copian
+       del índice global, sin volver a embeber. `firma_vectorstore` identifica el vectorstore del
+       que salen, para descartarlas si este cambió sin llegar a actualizarlas. Devuelve un informe
+       por partición.
+    """
+    os.makedirs(carpeta, exist_ok=True)
+    anterior = _leer_estado(carpeta)
+    previas = anterior["particiones"] if anterior and anterior["configuracion"] == configuracion else {}
+
+    grupos = {}
+    for filename in sorted(archivos):
+        grupos.setdefault(nombre_particion(filename), []).append(filename)
+
+    particiones, perfiles, informe = {}, {}, {}
+    for nombre, filenames in grupos.items():
+        ids = [i for filename in filenames for i in archivos[filename]["fragmentos"]]
+        if not ids:
+            continue
+        firma = _firma(ids)
+        previa = previas.get(nombre)
+        ruta_indice = os.path.join(carpeta, f"{nombre}.faiss")
+        if (previa and previa["firma"] == firma and os.path.exists(ruta_indice)
+                and os.path.exists(os.path.join(carpeta, f"{nombre}_ids.npy"))):
+            particiones[nombre] = previa
+            perfiles[nombre] = anterior["perfiles"][nombre]
+            continue
+
+        posiciones = [almacen.posicion(i) for i in ids]
+        if any(p is None for p in posiciones):
+            raise ValueError(f"La partición '{nombre}' tiene fragmentos que no están en el vectorstore.")
+        plano = faiss.IndexFlatIP(index.d) if producto_interno else faiss.IndexFlatL2(index.d)
+        plano.add(reconstruir_vectores(index, posiciones))
+        indice_particion, informe_indice = convertir_indice(plano, tipo, producto_interno=producto_interno, **parametros)
+        escribir_indice(indice_particion, ruta_indice)
+        _escribir_ids(os.path.join(carpeta, f"{nombre}_ids.npy"), ids)
+
+        textos = (almacen.documento(p).page_content for p in posiciones)
+        perfiles[nombre] = perfil_particion(filenames, textos)
+        particiones[nombre] = {"archivos": filenames, "firma": firma, "vectores": len(ids),
+                               "tipo_efectivo": informe_indice["tipo_efectivo"]}
+        informe[nombre] = informe_indice
+
+    # Particiones que ya no tienen archivos
+    for nombre in set(anterior["particiones"] if anterior else ()) - set(particiones):
+        for archivo in (f"{nombre}.faiss", f"{nombre}_ids.npy"):
+            try:
+                os.remove(os.path.join(carpeta, archivo))
+            except FileNotFoundError:
+                pass
+
+    relaciones = {}
+    if mapa_temas and os.path.exists(mapa_temas):
+        with open(mapa_temas, encoding="utf-8") as f:
+            relaciones = relaciones_mapa_temas(f.read())
+
+    estado = {
+        "version": VERSION_PARTICIONES,
+        "configuracion": configuracion,
+        "producto_interno": producto_interno,
+        "firma_vectorstore": firma_vectorstore,
+        "particiones": particiones,
+        "perfiles": perfiles,
+        "relaciones": relaciones,
+    }
+    tmp_path = os.path.join(carpeta, ARCHIVO_ESTADO + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(carpeta, ARCHIVO_ESTADO))
+    return informe
+
+
+def _escribir_ids(ruta, ids):
+    tmp_path = ruta + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.array(ids))
+    os.replace(tmp_path, ruta)
+
+
+def _leer_estado(carpeta):
+    try:
+        with open(os.path.join(carpeta, ARCHIVO_ESTADO), encoding="utf-8") as f:
+            estado = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return estado if estado.get("version") == VERSION_PARTICIONES else None
+
+
+class Particiones:
+    """Índices por partición cargados (con memory-mapping) y su enrutador."""
+
+    def __init__(self, indices, ids, enrutador, producto_interno=False, hilos=4):
+        self.indices = indices
+        self.ids = ids
+        self.enrutador = enrutador
+        self.producto_interno = producto_interno
+        # Ids de cada partición y, por cada combinación de particiones ya pedida, su unión
+        # (hay pocas particiones, así que cada unión se construye una sola vez)
+        self._conjuntos = {nombre: frozenset(lista.tolist()) for nombre, lista in ids.items()}
+        self._uniones = {}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, hilos), thread_name_prefix="particiones")
+
+    @classmethod
+    def cargar(cls, carpeta, configuracion, num_vectores, mmap=True, hilos=4, nprobe=8, ef_busqueda=64,
+               firma_vectorstore=None):
+        """Carga las particiones guardadas. Devuelve None si no existen, fueron creadas con otra
+           configuración o para otro vectorstore, o no cubren todos los vectores del índice global."""
+        estado = _leer_estado(carpeta)
+        if (estado is None or estado["configuracion"] != configuracion
+                or estado.get("firma_vectorstore") != firma_vectorstore
+                or sum(p["vectores"] for p in estado["particiones"].values()) != num_vectores):
+            return None
+        indices, ids = {}, {}
+        for nombre in estado["particiones"]:
+            indice = leer_indice(os.path.join(carpeta, f"{nombre}.faiss"), mmap=mmap)
+            indices[nombre] = configurar_busqueda(indice, nprobe, ef_busqueda)
+            ids[nombre] = np.load(os.path.join(carpeta, f"{nombre}_ids.npy"), mmap_mode="r")
+        enrutador = EnrutadorParticiones(estado["perfiles"], estado["relaciones"])
+        return cls(indices, ids, enrutador, estado["producto_interno"], hilos)
+
+    def enrutar(self, consulta):
+        """Particiones relevantes para la consulta, o None para buscar en todo el índice."""
+        if len(self.indices) < 2:
+            return None
+        return self.enrutador.enrutar(consulta)
+
+    def ids_de(self, nombres):
+        """Conjunto de ids de fragmento de las particiones indicadas (para filtrar BM25)."""
+        clave = frozenset(nombres)
+        conjunto = self._uniones.get(clave)
+        if conjunto is None:
+            conjunto = self._uniones[clave] = frozenset().union(*(self._conjuntos[n] for n in clave))
+        return conjunto
+
+    def _buscar_en(self, nombre, vector, k):
+        index = self.indices[nombre]
+        distancias, posiciones = index.search(vector, min(k, index.ntotal))
+        ids = self.ids[nombre]
+        return [(float(d), str(ids[p])) for d, p in zip(distancias[0], posiciones[0]) if p != -1]
+
+    def buscar(self, vector, k, nombres):
+        """Los k ids más cercanos al vector entre las particiones indicadas, buscadas en paralelo."""
+        if len(nombres) == 1:
+            resultados = [self._buscar_en(nombres[0], vector, k)]
+        else:
+            resultados = list(self._pool.map(lambda nombre: self._buscar_en(nombre, vector, k), nombres))
+        # Producto interno: mayor es mejor; distancia L2: menor es mejor
+        combinados = sorted((par for r in resultados for par in r), key=lambda par: par[0],
+                            reverse=self.producto_interno)
+        return [id_fragmento for _, id_fragmento in combinados[:k]]
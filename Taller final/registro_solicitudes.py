@@ -0,0 +1,226 @@
+# ============================================================
+# registro_solicitudes.py — Registro de solicitudes de devolución
+# Almacén con escritura diferida: las tools encolan la solicitud y vuelven
+# de inmediato; un único hilo escritor agrupa las altas en lotes y las
+# guarda en SQLite (modo WAL, indexado por pedido) y, opcionalmente, en el
+# CSV histórico. Permite detectar duplicados y consultar el estado.
+# El pedido se guarda tal como se escribió; solo la clave de búsqueda
+# (columna pedido_clave) se normaliza a mayúsculas.
+# ============================================================
+
+import csv
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# Política de sincronización con disco: PRAGMA synchronous de SQLite y fsync del CSV
+POLITICAS_FSYNC = {
+    "siempre": "FULL",  # fsync en cada lote (más durable)
+    "lote": "NORMAL",   # WAL sincroniza en los checkpoints; el CSV se sincroniza por lote
+    "nunca": "OFF",     # el sistema operativo decide cuándo escribir
+}
+
+_FIN = object()
+# Intentos de escritura de un lote antes de descartarlo (con el registro cerrándose, solo uno más)
+MAX_INTENTOS_LOTE = 5
+
+
+def _clave_pedido(pedido):
+    return pedido.strip().upper()
+
+
+def _clave(pedido, producto, motivo):
+    return (_clave_pedido(pedido), producto.strip().lower(), motivo.strip().lower())
+
+
+class RegistroSolicitudes:
+    """Registro de solicitudes con un hilo escritor y lotes.
+
+       - `intervalo_flush`: segundos máximos que una solicitud espera en memoria antes de escribirse.
+       - `max_lote`: número máximo de solicitudes por transacción.
+       - `fsync`: 'siempre', 'lote' o 'nunca' (ver POLITICAS_FSYNC).
+    """
+
+    def __init__(self, ruta_db, ruta_csv=None, intervalo_flush=0.2, max_lote=100, fsync="lote"):
+        if fsync not in POLITICAS_FSYNC:
+            raise ValueError(f"Política de fsync desconocida: {fsync!r} (usa {', '.join(POLITICAS_FSYNC)})")
+        self.ruta_db = ruta_db
+        self.ruta_csv = ruta_csv
+        self.intervalo_flush = intervalo_flush
+        self.max_lote = max_lote
+        self.fsync = fsync
+
+        carpeta = os.path.dirname(ruta_db)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        self._lectura = self._conectar()
+        self._lectura.execute(
+            "CREATE TABLE IF NOT EXISTS solicitudes ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, pedido TEXT NOT NULL, producto TEXT NOT NULL, "
+            "motivo TEXT NOT NULL, estado TEXT NOT NULL, fecha TEXT NOT NULL, pedido_clave TEXT)"
+        )
+        columnas = {fila[1] for fila in self._lectura.execute("PRAGMA table_info(solicitudes)")}
+        if "pedido_clave" not in columnas:
+            # Registros de versiones anteriores: su pedido ya estaba en mayúsculas
+            self._lectura.execute("ALTER TABLE solicitudes ADD COLUMN pedido_clave TEXT")
+            self._lectura.execute("UPDATE solicitudes SET pedido_clave = UPPER(TRIM(pedido))")
+            self._lectura.execute("DROP INDEX IF EXISTS idx_solicitudes_pedido")
+        self._lectura.execute("CREATE INDEX IF NOT EXISTS idx_solicitudes_pedido_clave ON solicitudes(pedido_clave)")
+        self._lectura.commit()
+        self._lock = threading.Lock()
+
+        # Solicitudes encoladas que aún no están en disco (para duplicados y consultas)
+        self._pendientes = {}
+        self._cola = queue.Queue()
+        self._cerrando = threading.Event()
+        self._escritor = threading.Thread(target=self._bucle_escritor, name="registro-solicitudes", daemon=True)
+        self._escritor.start()
+
+    def _conectar(self):
+        conexion = sqlite3.connect(self.ruta_db, check_same_thread=False)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.execute(f"PRAGMA synchronous={POLITICAS_FSYNC[self.fsync]}")
+        return conexion
+
+    # --- Lectura -------------------------------------------------------
+
+    def _buscar_en_disco(self, pedido):
+        filas = self._lectura.execute(
+            "SELECT id, pedido, producto, motivo, estado, fecha FROM solicitudes WHERE pedido_clave = ? ORDER BY id",
+            (_clave_pedido(pedido),),
+        ).fetchall()
+        columnas = ("id", "pedido", "producto", "motivo", "estado", "fecha")
+        return [dict(zip(columnas, fila)) for fila in filas]
+
+    def buscar(self, pedido):
+        """Solicitudes de un pedido (guardadas y pendientes de escribir), por orden de alta."""
+        with self._lock:
+            guardadas = self._buscar_en_disco(pedido)
+            # Un lote recién confirmado sigue en _pendientes hasta que el escritor lo retira:
+            # las que ya tienen su fila en disco (mismo id) no se repiten
+            ids = {s["id"] for s in guardadas}
+            pendientes = [dict(s) for c, s in self._pendientes.items()
+                          if c[0] == _clave_pedido(pedido) and s["id"] not in ids]
+        return guardadas + pendientes
+
+    def estado(self, pedido):
+        """Estado de la última solicitud del pedido, o None si no tiene ninguna."""
+        solicitudes = self.buscar(pedido)
+        return solicitudes[-1]["estado"] if solicitudes else None
+
+    # --- Escritura -----------------------------------------------------
+
+    def registrar(self, pedido, producto, motivo, detectar_duplicados=True):
+        """Encola una solicitud y vuelve sin esperar a que se escriba.
+           Si `detectar_duplicados` y ya existe la misma (pedido, producto, motivo), no la encola
+           y devuelve la existente; si no, devuelve None.
+        """
+        clave = _clave(pedido, producto, motivo)
+        with self._lock:
+            if detectar_duplicados:
+                if clave in self._pendientes:
+                    return dict(self._pendientes[clave])
+                for solicitud in self._buscar_en_disco(pedido):
+                    if _clave(solicitud["pedido"], solicitud["producto"], solicitud["motivo"]) == clave:
+                        return solicitud
+            solicitud = {
+                "id": None,
+                "pedido": pedido.strip(),
+                "producto": producto.strip(),
+                "motivo": motivo.strip(),
+                "estado": "registrada",
+                "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+            self._pendientes[clave] = solicitud
+        self._cola.put((clave, solicitud))
+        return None
+
+    def _bucle_escritor(self):
+        conexion = self._conectar()
+        lote, fin, intentos = [], False, 0
+        while not fin:
+            if not lote:
+                elemento = self._cola.get()
+                if elemento is _FIN:
+                    break
+                lote.append(elemento)
+            # Juntar las solicitudes que lleguen durante intervalo_flush, hasta max_lote
+            limite = time.monotonic() + self.intervalo_flush
+            while len(lote) < self.max_lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    elemento = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if elemento is _FIN:
+                    fin = True
+                    break
+                lote.append(elemento)
+
+            try:
+                self._escribir_lote(conexion, lote)
+                lote, intentos = [], 0
+            except Exception as e:
+                intentos += 1
+                if fin or self._cerrando.is_set() or intentos >= MAX_INTENTOS_LOTE:
+                    print(f"❌ Se perdieron {len(lote)} solicitudes tras {intentos} intentos: {e}")
+                    self._retirar_pendientes(lote)
+                    lote, intentos = [], 0
+                else:
+                    # El lote se conserva y se reintenta en la siguiente vuelta; si mientras tanto
+                    # se llama a cerrar(), se reintenta enseguida una última vez
+                    print(f"❌ Error al guardar {len(lote)} solicitudes: {e}. Reintento {intentos}...")
+                    self._cerrando.wait(max(0.1, self.intervalo_flush))
+        conexion.close()
+
+    def _retirar_pendientes(self, lote):
+        """Quita de _pendientes las solicitudes del lote (ya guardadas o descartadas)."""
+        with self._lock:
+            for clave, solicitud in lote:
+                if self._pendientes.get(clave) is solicitud:
+                    del self._pendientes[clave]
+
+    def _escribir_lote(self, conexion, lote):
+        with conexion:
+            for _, solicitud in lote:
+                cursor = conexion.execute(
+                    "INSERT INTO solicitudes (pedido, producto, motivo, estado, fecha, pedido_clave) VALUES (?, ?, ?, ?, ?, ?)",
+                    (solicitud["pedido"], solicitud["producto"], solicitud["motivo"], solicitud["estado"],
+                     solicitud["fecha"], _clave_pedido(solicitud["pedido"])),
+                )
+                solicitud["id"] = cursor.lastrowid
+        self._retirar_pendientes(lote)
+
+        # El CSV es una copia para compatibilidad: si falla, el lote ya está en SQLite y no se reintenta
+        if self.ruta_csv:
+            try:
+                with open(self.ruta_csv, "a", newline="", encoding="utf-8") as f:
+                    escritor = csv.writer(f)
+                    for _, solicitud in lote:
+                        escritor.writerow([solicitud["pedido"], solicitud["producto"], solicitud["motivo"]])
+                    if self.fsync != "nunca":
+                        f.flush()
+                        os.fsync(f.fileno())
+            except OSError as e:
+                print(f"⚠️ No se pudo copiar el lote a {self.ruta_csv}: {e}")
+
+    def vaciar(self, timeout=10.0):
+        """Espera a que todas las solicitudes encoladas estén en disco. Devuelve False si vence el timeout."""
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            with self._lock:
+                if not self._pendientes:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def cerrar(self):
+        """Escribe lo pendiente y detiene el hilo escritor (un lote que falla ya no se reintenta)."""
+        self._cerrando.set()
+        self._cola.put(_FIN)
+        self._escritor.join()
+        self._lectura.close()
@@ -0,0 +1,141 @@
+# ============================================================
+# servidor_embeddings_falso.py — Servidor local que imita la API de embeddings
+# Responde POST /embeddings con el formato de OpenAI y vectores deterministas
+# (derivados del hash del texto), sin red ni clave. Se le pueden encolar
+# respuestas de error (p. ej. 429 con Retry-After) para probar los
+# reintentos y la reanudación de embeddings_lotes.py.
+# Uso:
+#   python servidor_embeddings_falso.py --puerto 8765 --dimension 1536
+#   ECOMARKET_EMBEDDINGS_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=falsa python app.py
+# ============================================================
+
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIMENSION_POR_DEFECTO = 16
+
+
+def vector_falso(texto, dimension=DIMENSION_POR_DEFECTO):
+    """Vector determinista en [-1, 1) derivado del SHA-256 del texto."""
+    semilla = hashlib.sha256(texto.encode("utf-8")).digest()
+    while len(semilla) < dimension:
+        semilla += hashlib.sha256(semilla).digest()
+    return [b / 128.0 - 1.0 for b in semilla[:dimension]]
+
+
+class ServidorEmbeddingsFalso:
+    """Servidor HTTP en un hilo aparte que imita POST /embeddings de OpenAI.
+
+       `fallar(estado, retry_after=None, veces=1)` encola respuestas de error que se sirven
+       antes que las correctas. `peticiones` guarda (instante, textos, estado) de cada llamada.
+       Se usa como context manager o con iniciar()/detener().
+    """
+
+    def __init__(self, dimension=DIMENSION_POR_DEFECTO, host="127.0.0.1", puerto=0):
+        self.dimension = dimension
+        self.peticiones = []
+        self._fallos = []
+        self._lock = threading.Lock()
+        self._servidor = ThreadingHTTPServer((host, puerto), self._manejador())
+        self._hilo = None
+
+    @property
+    def url(self):
+        host, puerto = self._servidor.server_address[:2]
+        return f"http://{host}:{puerto}/v1"
+
+    def fallar(self, estado, retry_after=None, veces=1):
+        """Encola `veces` respuestas con el código `estado` (y la cabecera Retry-After si se indica).
+           Un 200 encolado responde con normalidad: sirve para que el error llegue más tarde."""
+        with self._lock:
+            self._fallos.extend([(estado, retry_after)] * veces)
+
+    def textos_embebidos(self):
+        """Textos que recibieron vector (las peticiones respondidas con 200)."""
+        with self._lock:
+            return [texto for _, textos, estado in self.peticiones if estado == 200 for texto in textos]
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    def _responder(self, cuerpo):
+        """Devuelve (estado, cabeceras, respuesta JSON) para el cuerpo de una petición."""
+        entrada = cuerpo.get("input", [])
+        textos = [entrada] if isinstance(entrada, str) else list(entrada)
+        # Con check_embedding_ctx_length el cliente envía tokens en lugar de texto
+        textos = [t if isinstance(t, str) else json.dumps(t) for t in textos]
+        with self._lock:
+            estado, retry_after = self._fallos.pop(0) if self._fallos else (200, None)
+            self.peticiones.append((time.monotonic(), textos, estado))
+        if estado != 200:
+            cabeceras = {"retry-after": str(retry_after)} if retry_after is not None else {}
+            error = {"error": {"message": f"Error simulado {estado}", "type": "simulado", "code": estado}}
+            return estado, cabeceras, error
+
+        datos = []
+        for i, texto in enumerate(textos):
+            vector = vector_falso(texto, self.dimension)
+            if cuerpo.get("encoding_format") == "base64":
+                vector = base64.b64encode(array("f", vector).tobytes()).decode("ascii")
+            datos.append({"object": "embedding", "index": i, "embedding": vector})
+        uso = {"prompt_tokens": 0, "total_tokens": 0}
+        return 200, {}, {"object": "list", "data": datos, "model": cuerpo.get("model"), "usage": uso}
+
+    def _manejador(self):
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/embeddings"):
+                    self.send_error(404)
+                    return
+                longitud = int(self.headers.get("Content-Length", 0))
+                estado, cabeceras, respuesta = servidor._responder(json.loads(self.rfile.read(longitud) or b"{}"))
+                datos = json.dumps(respuesta).encode("utf-8")
+                self.send_response(estado)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                for nombre, valor in cabeceras.items():
+                    self.send_header(nombre, valor)
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, *args):
+                pass
+
+        return Manejador
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de embeddings de OpenAI.")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--dimension", type=int, default=DIMENSION_POR_DEFECTO)
+    args = parser.parse_args()
+    servidor = ServidorEmbeddingsFalso(dimension=args.dimension, puerto=args.puerto)
+    print(f"🧪 Servidor de embeddings falso en {servidor.url} (ECOMARKET_EMBEDDINGS_URL={servidor.url})")
+    try:
+        servidor._servidor.serve_forever()
+    except KeyboardInterrupt:
+        servidor._servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# ============================================================
+# test_almacen_fragmentos.py — Pruebas del almacén de fragmentos con
+# memory-mapping: escritura y lectura por posición e id, escritura con
+# sufijo, almacén vacío, y el docstore con altas y bajas en memoria.
+# Uso:
+#   python -m pytest test_almacen_fragmentos.py
+# ============================================================
+
+import os
+import tempfile
+import unittest
+
+from langchain_core.documents import Document
+
+from almacen_fragmentos import AlmacenFragmentos, DocstoreFragmentos, IdsPorPosicion
+
+FRAGMENTOS = [
+    (f"id-{i}", Document(page_content=f"Fragmento {i} con tildes: envío ecológico", metadata={"source": f"doc{i % 2}.txt", "n": i}))
+    for i in range(5)
+]
+
+
+class PruebaAlmacenFragmentos(unittest.TestCase):
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.carpeta = carpeta.name
+        AlmacenFragmentos.escribir(self.carpeta, FRAGMENTOS)
+        self.almacen = AlmacenFragmentos(self.carpeta)
+
+    def test_lectura_por_posicion_e_id(self):
+        self.assertTrue(AlmacenFragmentos.existe(self.carpeta))
+        self.assertEqual(len(self.almacen), len(FRAGMENTOS))
+        for posicion, (id_fragmento, documento) in enumerate(FRAGMENTOS):
+            self.assertEqual(self.almacen.id_en(posicion), id_fragmento)
+            self.assertEqual(self.almacen.posicion(id_fragmento), posicion)
+            leido = self.almacen.documento(posicion)
+            self.assertEqual(leido.page_content, documento.page_content)
+            self.assertEqual(leido.metadata, documento.metadata)
+        self.assertIsNone(self.almacen.posicion("id-99"))
+
+    def test_escribir_con_sufijo_no_toca_los_actuales(self):
+        AlmacenFragmentos.escribir(self.carpeta, FRAGMENTOS[:2], sufijo=".tmp")
+        self.assertEqual(len(AlmacenFragmentos(self.carpeta)), len(FRAGMENTOS))
+        for ruta_tmp, ruta in zip(AlmacenFragmentos.archivos(self.carpeta, ".tmp"), AlmacenFragmentos.archivos(self.carpeta)):
+            self.assertTrue(os.path.exists(ruta_tmp))
+            os.replace(ruta_tmp, ruta)
+        self.assertEqual(len(AlmacenFragmentos(self.carpeta)), 2)
+
+    def test_almacen_vacio(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            AlmacenFragmentos.escribir(carpeta, [])
+            almacen = AlmacenFragmentos(carpeta)
+            self.assertEqual(len(almacen), 0)
+            self.assertIsNone(almacen.posicion("id-0"))
+
+
+class PruebaDocstoreFragmentos(unittest.TestCase):
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        AlmacenFragmentos.escribir(carpeta.name, FRAGMENTOS)
+        self.docstore = DocstoreFragmentos(AlmacenFragmentos(carpeta.name))
+
+    def test_buscar(self):
+        self.assertEqual(self.docstore.search("id-3").metadata["n"], 3)
+        self.assertEqual(self.docstore.search("id-99"), "ID id-99 not found.")
+        self.assertEqual(self.docstore.posicion("id-3"), 3)
+
+    def test_no_sobrescribe_ids_existentes(self):
+        with self.assertRaises(ValueError):
+            self.docstore.add({"id-1": Document(page_content="otro")})
+        self.docstore.add({"nuevo": Document(page_content="nuevo")})
+        with self.assertRaises(ValueError):
+            self.docstore.add({"nuevo": Document(page_content="otra vez")})
+        self.assertEqual(self.docstore.search("nuevo").page_content, "nuevo")
+        self.assertIsNone(self.docstore.posicion("nuevo")) # Aún no está en el almacén
+
+    def test_borrar_y_volver_a_anadir(self):
+        self.docstore.delete(["id-2"])
+        self.assertEqual(self.docstore.search("id-2"), "ID id-2 not found.")
+        self.assertIsNone(self.docstore.posicion("id-2"))
+        self.docstore.add({"id-2": Document(page_content="modificado")})
+        self.assertEqual(self.docstore.search("id-2").page_content, "modificado")
+
+    def test_sin_almacen(self):
+        docstore = DocstoreFragmentos()
+        self.assertEqual(docstore.search("id-0"), "ID id-0 not found.")
+        docstore.add({"id-0": Document(page_content="solo en memoria")})
+        self.assertEqual(docstore.search("id-0").page_content, "solo en memoria")
+
+
+class PruebaIdsPorPosicion(unittest.TestCase):
+
+    def test_posiciones_del_almacen_y_en_memoria(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            AlmacenFragmentos.escribir(carpeta, FRAGMENTOS)
+            ids = IdsPorPosicion(AlmacenFragmentos(carpeta))
+            ids[len(FRAGMENTOS)] = "nuevo"
+            self.assertEqual(len(ids), len(FRAGMENTOS) + 1)
+            self.assertEqual(list(ids.values()), [i for i, _ in FRAGMENTOS] + ["nuevo"])
+            with self.assertRaises(KeyError):
+                ids[len(FRAGMENTOS) + 1]
+            with self.assertRaises(TypeError):
+                del ids[0]
+
+
+if __name__ == "__main__":
+    unittest.main()
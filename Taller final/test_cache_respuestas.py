@@ -0,0 +1,89 @@
+# ============================================================
+# test_cache_respuestas.py — Pruebas de la caché de respuestas del RAG:
+# normalización de preguntas, desalojo LRU, caducidad (TTL), invalidación
+# por generación y coincidencia por similitud de embeddings.
+# Uso:
+#   python -m pytest test_cache_respuestas.py
+# ============================================================
+
+import unittest
+from unittest import mock
+
+from langchain_core.embeddings import Embeddings
+
+from cache_respuestas import CacheRespuestas, normalizar_pregunta
+
+
+class EmbeddingsPorPalabras(Embeddings):
+    """Un eje por palabra conocida: preguntas con las mismas palabras dan el mismo vector."""
+    PALABRAS = ("politica", "devoluciones", "envio", "productos", "cual", "es", "la", "de")
+
+    def __init__(self):
+        self.consultas = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text):
+        self.consultas += 1
+        palabras = normalizar_pregunta(text).split()
+        return [float(p in palabras) for p in self.PALABRAS]
+
+
+class PruebaCacheRespuestas(unittest.TestCase):
+
+    def test_normaliza_mayusculas_tildes_y_puntuacion(self):
+        cache = CacheRespuestas()
+        cache.guardar("¿Cuál es la política de devoluciones?", "30 días")
+        self.assertEqual(cache.obtener("cual es la POLITICA de devoluciones"), "30 días")
+        self.assertIsNone(cache.obtener("¿Cuál es la política de envío?"))
+        self.assertEqual(cache.estadisticas(), {"aciertos": 1, "fallos": 1, "entradas": 1})
+
+    def test_desaloja_la_usada_hace_mas_tiempo(self):
+        cache = CacheRespuestas(max_entradas=2)
+        cache.guardar("uno", "1")
+        cache.guardar("dos", "2")
+        self.assertEqual(cache.obtener("uno"), "1") # "uno" pasa a ser la más reciente
+        cache.guardar("tres", "3")
+        self.assertIsNone(cache.obtener("dos"))
+        self.assertEqual(cache.obtener("uno"), "1")
+        self.assertEqual(cache.obtener("tres"), "3")
+
+    def test_caduca_tras_el_ttl(self):
+        cache = CacheRespuestas(ttl=10)
+        with mock.patch("cache_respuestas.time.time", return_value=1000.0):
+            cache.guardar("pregunta", "respuesta")
+        with mock.patch("cache_respuestas.time.time", return_value=1010.0):
+            self.assertEqual(cache.obtener("pregunta"), "respuesta")
+        with mock.patch("cache_respuestas.time.time", return_value=1010.5):
+            self.assertIsNone(cache.obtener("pregunta"))
+        self.assertEqual(cache.estadisticas()["entradas"], 0)
+
+    def test_invalidar_descarta_respuestas_de_la_generacion_anterior(self):
+        cache = CacheRespuestas()
+        cache.guardar("pregunta", "antigua")
+        generacion = cache.generacion # una respuesta que empezó a calcularse antes de reconstruir
+        cache.invalidar()
+        self.assertIsNone(cache.obtener("pregunta"))
+        cache.guardar("pregunta", "calculada con el índice anterior", generacion=generacion)
+        self.assertIsNone(cache.obtener("pregunta"))
+        cache.guardar("pregunta", "nueva", generacion=cache.generacion)
+        self.assertEqual(cache.obtener("pregunta"), "nueva")
+
+    def test_similitud_reutiliza_preguntas_parecidas(self):
+        embeddings = EmbeddingsPorPalabras()
+        cache = CacheRespuestas(embeddings=embeddings, umbral_similitud=0.9)
+        cache.guardar("¿Cuál es la política de devoluciones?", "30 días")
+        self.assertEqual(cache.obtener("la politica de devoluciones cual es"), "30 días")
+        self.assertIsNone(cache.obtener("¿Cuál es la política de envío?"))
+
+    def test_sin_umbral_no_calcula_embeddings(self):
+        embeddings = EmbeddingsPorPalabras()
+        cache = CacheRespuestas(embeddings=embeddings, umbral_similitud=0.0)
+        cache.guardar("pregunta", "respuesta")
+        self.assertIsNone(cache.obtener("otra pregunta"))
+        self.assertEqual(embeddings.consultas, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+# ============================================================
+# test_embeddings_lotes.py — Pruebas de embeddings_lotes.py contra el
+# servidor de embeddings falso: 429 con Retry-After, espera exponencial,
+# reanudación desde la caché tras una construcción fallida y aciertos de
+# caché contados solo para los lotes de la construcción.
+# Uso:
+#   python -m unittest test_embeddings_lotes
+# ============================================================
+
+import os
+import tempfile
+import unittest
+
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from cache_embeddings import CacheEmbeddings
+from embeddings_lotes import embeber_en_lotes
+from servidor_embeddings_falso import ServidorEmbeddingsFalso, vector_falso
+
+TEXTOS = [f"fragmento {i} del catálogo de EcoMarket" for i in range(6)]
+
+
+class ClienteConConsultas(Embeddings):
+    """Cliente que, mientras atiende cada lote, responde una consulta desde la caché
+       (como una pregunta de un usuario durante la construcción del índice)."""
+
+    def __init__(self, cliente, consulta):
+        self.cliente = cliente
+        self.consulta = consulta
+        self.cache = None
+
+    def embed_documents(self, texts):
+        self.cache.embed_query(self.consulta)
+        return self.cliente.embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.cliente.embed_query(text)
+
+
+class PruebaEmbeddingsLotes(unittest.TestCase):
+
+    def setUp(self):
+        self.servidor = ServidorEmbeddingsFalso().iniciar()
+        self.addCleanup(self.servidor.detener)
+        # Sin reintentos propios del cliente: los 429 llegan a embeber_en_lotes. Con texto
+        # en lugar de tokens no hace falta descargar el tokenizador de tiktoken (pero el cliente
+        # envía entonces una petición por texto)
+        self.cliente = OpenAIEmbeddings(model="text-embedding-3-small", api_key="falsa", base_url=self.servidor.url,
+                                        max_retries=0, check_embedding_ctx_length=False)
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.ruta_cache = os.path.join(carpeta.name, "embeddings.sqlite")
+
+    def _cache(self):
+        cache = CacheEmbeddings(self.cliente, "falso", self.ruta_cache)
+        self.addCleanup(cache.cerrar)
+        return cache
+
+    def _esperas_tras_fallos(self):
+        """Segundos entre cada petición rechazada y la siguiente."""
+        peticiones = self.servidor.peticiones
+        return [siguiente[0] - actual[0] for actual, siguiente in zip(peticiones, peticiones[1:]) if actual[2] != 200]
+
+    def _comprobar_vectores(self, vectores):
+        self.assertEqual(len(vectores), len(TEXTOS))
+        for texto, vector in zip(TEXTOS, vectores):
+            for obtenido, esperado in zip(vector, vector_falso(texto)):
+                self.assertAlmostEqual(obtenido, esperado, places=6)
+
+    def test_429_respeta_retry_after(self):
+        self.servidor.fallar(429, retry_after=0.3)
+        # Con espera_inicial tan grande, solo se terminaría a tiempo usando Retry-After
+        vectores, informe = embeber_en_lotes(TEXTOS, self.cliente, tam_lote=len(TEXTOS), trabajadores=1,
+                                             espera_inicial=30.0)
+        self._comprobar_vectores(vectores)
+        self.assertEqual(informe["reintentos"], 1)
+        (espera,) = self._esperas_tras_fallos()
+        self.assertGreaterEqual(espera, 0.3)
+        self.assertLess(espera, 5.0)
+
+    def test_429_espera_exponencial(self):
+        self.servidor.fallar(429, veces=3)
+        vectores, informe = embeber_en_lotes(TEXTOS, self.cliente, tam_lote=len(TEXTOS), trabajadores=1,
+                                             espera_inicial=0.1)
+        self._comprobar_vectores(vectores)
+        self.assertEqual(informe["reintentos"], 3)
+        # Esperas de 0.1·2^intento con jitter entre el 50 % y el 100 %
+        for intento, espera in enumerate(self._esperas_tras_fallos()):
+            self.assertGreaterEqual(espera, 0.1 * 2 ** intento * 0.5)
+
+    def test_429_agota_reintentos(self):
+        self.servidor.fallar(429, veces=3)
+        with self.assertRaises(Exception):
+            embeber_en_lotes(TEXTOS, self.cliente, tam_lote=len(TEXTOS), trabajadores=1,
+                             max_reintentos=2, espera_inicial=0.01)
+        self.assertEqual(len(self.servidor.peticiones), 3)
+
+    def test_reanuda_desde_la_cache(self):
+        # Primer intento: el primer lote se embebe y el segundo falla sin reintento posible
+        self.servidor.fallar(200, veces=2)
+        self.servidor.fallar(500)
+        with self.assertRaises(Exception):
+            embeber_en_lotes(TEXTOS, self._cache(), tam_lote=2, trabajadores=1)
+        embebidos = self.servidor.textos_embebidos()
+        self.assertEqual(embebidos[:2], TEXTOS[:2])
+
+        # Segundo intento con una caché nueva sobre el mismo archivo: solo se piden los que faltan
+        self.servidor.peticiones.clear()
+        vectores, informe = embeber_en_lotes(TEXTOS, self._cache(), tam_lote=2, trabajadores=1)
+        self._comprobar_vectores(vectores)
+        self.assertEqual(informe["desde_cache"], len(embebidos))
+        self.assertEqual(sorted(self.servidor.textos_embebidos()), sorted(set(TEXTOS) - set(embebidos)))
+
+    def test_desde_cache_no_cuenta_consultas_simultaneas(self):
+        cliente = ClienteConConsultas(self.cliente, "¿Qué productos venden?")
+        cache = CacheEmbeddings(cliente, "falso", self.ruta_cache)
+        self.addCleanup(cache.cerrar)
+        cliente.cache = cache
+        cache.embed_query(cliente.consulta)
+        vectores, informe = embeber_en_lotes(TEXTOS, cache, tam_lote=2, trabajadores=1)
+        self._comprobar_vectores(vectores)
+        # Las 3 consultas acertaron en la caché, pero ningún fragmento salió de ella
+        self.assertEqual(cache.aciertos, 3)
+        self.assertEqual(informe["desde_cache"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
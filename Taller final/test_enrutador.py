@@ -0,0 +1,84 @@
+# ============================================================
+# test_enrutador.py — Pruebas del enrutador de intenciones: la intención
+# de los casos etiquetados de bench_enrutador y la extracción de entidades
+# (pedido, código de producto, producto, cantidad, precio, fecha, motivo,
+# ID de solicitud) y de los campos separados por ';'.
+# Uso:
+#   python -m pytest test_enrutador.py
+# ============================================================
+
+import unittest
+
+from bench_enrutador import CASOS
+from enrutador import ELEGIBILIDAD, ESTADO, RAG, REEMBOLSO, REGISTRO, analizar_consulta
+
+
+class PruebaIntenciones(unittest.TestCase):
+
+    def test_casos_etiquetados(self):
+        for mensaje, esperada, *entidades in CASOS:
+            with self.subTest(mensaje=mensaje):
+                consulta = analizar_consulta(mensaje)
+                self.assertEqual(consulta.intencion, esperada)
+                for nombre, valor in (entidades[0] if entidades else {}).items():
+                    self.assertEqual(getattr(consulta, nombre), valor)
+
+    def test_sin_palabras_clave_va_al_rag(self):
+        consulta = analizar_consulta("¿Tienen tiendas físicas?")
+        self.assertEqual(consulta.intencion, RAG)
+        self.assertEqual(consulta.puntuaciones, {})
+
+    def test_estado_gana_a_registro(self):
+        consulta = analizar_consulta("Quiero saber el estado de mi solicitud #1003 de reembolso")
+        self.assertEqual(consulta.intencion, ESTADO)
+        self.assertEqual(consulta.solicitud, "1003")
+
+
+class PruebaEntidades(unittest.TestCase):
+
+    def test_pedido_y_codigo_de_producto(self):
+        consulta = analizar_consulta("Quiero devolver PROD-003 del pedido eco-1002, llegó dañada")
+        self.assertEqual(consulta.pedido, "ECO-1002")
+        self.assertEqual(consulta.codigo_producto, "PROD-003")
+        self.assertEqual(consulta.motivo, "dañado")
+
+    def test_pedido_numerico(self):
+        self.assertEqual(analizar_consulta("Registrar solicitud para pedido #456").pedido, "456")
+        self.assertEqual(analizar_consulta("el pedido número 789 llegó tarde").pedido, "789")
+
+    def test_producto_cantidad_y_precio(self):
+        consulta = analizar_consulta("¿Cuánto me devuelven por 2 unidades del Jabón Artesanal que compré a $5.50 cada uno?")
+        self.assertEqual(consulta.intencion, REEMBOLSO)
+        self.assertEqual(consulta.producto, "jabón artesanal")
+        self.assertEqual(consulta.cantidad, 2)
+        self.assertEqual(consulta.precio, 5.5)
+
+    def test_precio_suelto(self):
+        self.assertEqual(analizar_consulta("quiero reembolso por el jabon a 12,50.").precio, 12.5)
+        self.assertEqual(analizar_consulta("reembolso del jabon, lo compré por 8").precio, 8.0)
+        # "a 3 unidades" es una cantidad, no un precio
+        consulta = analizar_consulta("reembolso del jabon a 3 unidades")
+        self.assertIsNone(consulta.precio)
+        self.assertEqual(consulta.cantidad, 3)
+
+    def test_motivo_desde_palabra_clave(self):
+        consulta = analizar_consulta("Mi producto defectuoso, ¿puedo devolverlo?")
+        self.assertEqual(consulta.intencion, ELEGIBILIDAD)
+        self.assertEqual(consulta.motivo, "defectuoso")
+
+    def test_fecha_y_campos(self):
+        consulta = analizar_consulta("12345; Camiseta de algodón orgánico; 2023-11-01; dañado")
+        self.assertEqual(consulta.intencion, ELEGIBILIDAD)
+        self.assertEqual(consulta.campos, ["12345", "Camiseta de algodón orgánico", "2023-11-01", "dañado"])
+        self.assertEqual(consulta.fecha, "2023-11-01")
+
+    def test_campos_por_forma(self):
+        self.assertEqual(analizar_consulta("Jabon; 3; 15.75").intencion, REEMBOLSO)
+        self.assertEqual(analizar_consulta("Jabon; 3; ").intencion, REEMBOLSO)
+        self.assertEqual(analizar_consulta("pedido_789; Detergente líquido; envase roto").intencion, REGISTRO)
+        # Una palabra clave explícita manda sobre la forma de los campos
+        self.assertEqual(analizar_consulta("registrar; Jabon; 3").intencion, REGISTRO)
+
+
+if __name__ == "__main__":
+    unittest.main()
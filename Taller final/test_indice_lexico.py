@@ -0,0 +1,101 @@
+# ============================================================
+# test_indice_lexico.py — Pruebas del índice léxico BM25 y del retriever
+# híbrido: tokenización, ranking BM25, guardado y carga, la ruta rápida
+# de identificadores (sin embeddings) y la fusión de rankings (RRF).
+# Usa los embeddings deterministas de bench_ecomarket (sin red).
+# Uso:
+#   python -m pytest test_indice_lexico.py
+# ============================================================
+
+import os
+import tempfile
+import unittest
+
+from langchain_community.vectorstores import FAISS
+
+from bench_ecomarket import EmbeddingsFalsos
+from indice_lexico import IndiceLexico, RetrieverHibrido, extraer_identificadores, tokenizar
+
+FRAGMENTOS = {
+    "pedidos": "Pedido ECO-1001: 2 unidades de PROD-001, estado enviado.",
+    "pedidos2": "Pedido ECO-1002: 1 unidad de PROD-003, estado entregado.",
+    "solicitudes": "SOLICITUD ID: 1003 - Pedido ECO-1002 - Estado: APROBADA.",
+    "devoluciones": "La política de devoluciones permite devolver productos en 30 días.",
+    "envios": "Los envíos nacionales tardan de 3 a 5 días hábiles.",
+    "reciclaje": "Los envases reciclables se recogen en la tienda.",
+}
+
+
+class EmbeddingsContados(EmbeddingsFalsos):
+    def __init__(self):
+        super().__init__(dimension=64)
+        self.consultas = []
+
+    def embed_query(self, text):
+        self.consultas.append(text)
+        return super().embed_query(text)
+
+
+class PruebaIndiceLexico(unittest.TestCase):
+
+    def setUp(self):
+        self.indice = IndiceLexico.construir(FRAGMENTOS.items())
+
+    def test_tokenizar_normaliza_y_conserva_identificadores(self):
+        self.assertEqual(tokenizar("¿Dónde está mi PEDIDO ECO-1001? Envío rápido"), ["pedido", "eco-1001", "envio", "rapido"])
+
+    def test_extraer_identificadores(self):
+        self.assertEqual(extraer_identificadores("Estado de ECO-1001 y prod-003"), ["eco-1001", "prod-003"])
+        self.assertEqual(extraer_identificadores("¿Cómo va la solicitud #1003?"), ["1003"])
+        self.assertEqual(extraer_identificadores("¿Cuánto tarda un envío?"), [])
+
+    def test_bm25_ordena_por_relevancia(self):
+        resultados = self.indice.buscar("política de devoluciones", k=2)
+        self.assertEqual(resultados[0][0], "devoluciones")
+        self.assertEqual(len(resultados), 1) # Ningún otro fragmento comparte términos
+        self.assertEqual(self.indice.buscar("envíos nacionales", k=5, candidatos={"pedidos"}), [])
+
+    def test_buscar_identificadores_prioriza_los_que_contienen_mas(self):
+        resultados = self.indice.buscar_identificadores(["eco-1002", "1003"], "solicitud 1003 ECO-1002")
+        self.assertEqual(resultados[0][0], "solicitudes")
+        self.assertIn("pedidos2", [i for i, _ in resultados])
+        self.assertEqual(self.indice.buscar_identificadores(["eco-9999"], "ECO-9999"), [])
+
+    def test_guardar_y_cargar(self):
+        with tempfile.TemporaryDirectory() as carpeta:
+            ruta = os.path.join(carpeta, "indice_lexico.json")
+            self.indice.guardar(ruta)
+            cargado = IndiceLexico.cargar(ruta)
+        self.assertEqual(cargado.num_documentos, self.indice.num_documentos)
+        self.assertEqual(cargado.buscar("envíos nacionales"), self.indice.buscar("envíos nacionales"))
+
+
+class PruebaRetrieverHibrido(unittest.TestCase):
+
+    def setUp(self):
+        self.embeddings = EmbeddingsContados()
+        vectorstore = FAISS.from_texts(list(FRAGMENTOS.values()), self.embeddings, ids=list(FRAGMENTOS))
+        self.embeddings.consultas.clear()
+        self.retriever = RetrieverHibrido(vectorstore=vectorstore, indice=IndiceLexico.construir(FRAGMENTOS.items()), k=2)
+
+    def _ids(self, consulta):
+        return [doc.id for doc in self.retriever.invoke(consulta)]
+
+    def test_identificador_no_usa_embeddings(self):
+        self.assertEqual(self._ids("¿Dónde está mi pedido ECO-1001?")[0], "pedidos")
+        self.assertEqual(self._ids("estado del producto PROD-003"), ["pedidos2"])
+        self.assertEqual(self.embeddings.consultas, [])
+
+    def test_identificador_desconocido_usa_la_busqueda_hibrida(self):
+        self._ids("¿Dónde está mi pedido ECO-9999?")
+        self.assertEqual(self.embeddings.consultas, ["¿Dónde está mi pedido ECO-9999?"])
+
+    def test_fusion_rrf(self):
+        ids = self._ids("¿Cuál es la política de devoluciones?")
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(ids[0], "devoluciones") # Primero en ambos rankings
+        self.assertEqual(len(self.embeddings.consultas), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
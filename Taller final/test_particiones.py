@@ -0,0 +1,142 @@
+# ============================================================
+# test_particiones.py — Pruebas de los índices por partición: nombre y
+# perfil de cada partición, enrutado de consultas por términos e
+# identificadores (con el índice maestro), reconstrucción solo de las
+# particiones que cambian, carga ligada a la firma del vectorstore,
+# búsqueda en las particiones elegidas y caché de uniones de ids.
+# Usa los embeddings deterministas de bench_ecomarket (sin red).
+# Uso:
+#   python -m pytest test_particiones.py
+# ============================================================
+
+import os
+import tempfile
+import unittest
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from almacen_fragmentos import AlmacenFragmentos
+from bench_ecomarket import EmbeddingsFalsos
+from particiones import Particiones, construir_particiones, nombre_particion, relaciones_mapa_temas
+
+TEXTOS = {
+    "pedidos_detallados.txt": [
+        "HISTORIAL DE PEDIDOS\nPedido ECO-1001: 2 unidades de PROD-001, estado enviado.",
+        "Pedido ECO-1002: 1 unidad de PROD-003, estado entregado.",
+    ],
+    "catalogo_productos.txt": [
+        "CATÁLOGO ECOLÓGICO\nPROD-001 Jabón Artesanal de lavanda.",
+        "PROD-003 Cuaderno de papel reciclado.",
+    ],
+    "politica_devoluciones.txt": [
+        "PLAZOS DE DEVOLUCIÓN\nSe aceptan devoluciones en 30 días.",
+        "REEMBOLSOS\nEl reembolso se abona en 5 días hábiles.",
+    ],
+}
+MAPA_TEMAS = "Pedido ECO-1002 -> producto PROD-003 -> politica de devoluciones\n"
+CONFIGURACION = {"modelo_embeddings": "falso", "dimension": 32}
+
+
+class PruebaParticiones(unittest.TestCase):
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.carpeta = carpeta.name
+        self.carpeta_particiones = os.path.join(self.carpeta, "particiones")
+        self.mapa_temas = os.path.join(self.carpeta, "indice_maestro.txt")
+        with open(self.mapa_temas, "w", encoding="utf-8") as f:
+            f.write(MAPA_TEMAS)
+        self.embeddings = EmbeddingsFalsos(dimension=32)
+        self._guardar_vectorstore(TEXTOS)
+
+    def _guardar_vectorstore(self, textos):
+        """Índice global y almacén de fragmentos como los guarda app.py, y su manifest de archivos."""
+        fragmentos, self.archivos = [], {}
+        for filename, parrafos in textos.items():
+            ids = [f"{filename}#{i}" for i in range(len(parrafos))]
+            self.archivos[filename] = {"hash": str(hash(tuple(parrafos))), "fragmentos": ids}
+            fragmentos += [(i, Document(page_content=p, metadata={"source": filename})) for i, p in zip(ids, parrafos)]
+        self.index = faiss.IndexFlatL2(32)
+        self.index.add(np.asarray(self.embeddings.embed_documents([d.page_content for _, d in fragmentos]), dtype=np.float32))
+        AlmacenFragmentos.escribir(self.carpeta, fragmentos)
+        self.almacen = AlmacenFragmentos(self.carpeta)
+
+    def _construir(self, firma="v1"):
+        return construir_particiones(self.carpeta_particiones, self.index, self.almacen, self.archivos, CONFIGURACION,
+                                     mapa_temas=self.mapa_temas, firma_vectorstore=firma)
+
+    def _cargar(self, firma="v1", configuracion=CONFIGURACION):
+        particiones = Particiones.cargar(self.carpeta_particiones, configuracion, self.index.ntotal,
+                                         firma_vectorstore=firma, hilos=2)
+        if particiones is not None:
+            self.addCleanup(particiones._pool.shutdown)
+        return particiones
+
+    def test_nombre_y_relaciones(self):
+        self.assertEqual(nombre_particion("content/pedidos_detallados.txt"), "pedidos")
+        self.assertEqual(nombre_particion("Política_Devoluciones.txt"), "politica")
+        self.assertEqual(relaciones_mapa_temas(MAPA_TEMAS)["eco-1002"], ["pedido", "politica", "producto"])
+
+    def test_construir_y_cargar(self):
+        informe = self._construir()
+        self.assertEqual(sorted(informe), ["catalogo", "pedidos", "politica"])
+        particiones = self._cargar()
+        self.assertEqual(sorted(particiones.indices), ["catalogo", "pedidos", "politica"])
+        self.assertEqual(sum(i.ntotal for i in particiones.indices.values()), self.index.ntotal)
+
+    def test_solo_reconstruye_lo_que_cambia(self):
+        self._construir()
+        self.assertEqual(self._construir(), {})
+        textos = dict(TEXTOS, **{"pedidos_detallados.txt": TEXTOS["pedidos_detallados.txt"] + ["Pedido ECO-1004."]})
+        self._guardar_vectorstore(textos)
+        self.assertEqual(sorted(self._construir()), ["pedidos"])
+        self.assertEqual(self._cargar().indices["pedidos"].ntotal, 3)
+
+    def test_particion_sin_archivos_se_borra(self):
+        self._construir()
+        self._guardar_vectorstore({k: v for k, v in TEXTOS.items() if k != "catalogo_productos.txt"})
+        self._construir()
+        self.assertFalse(os.path.exists(os.path.join(self.carpeta_particiones, "catalogo.faiss")))
+        self.assertEqual(sorted(self._cargar().indices), ["pedidos", "politica"])
+
+    def test_no_carga_particiones_de_otro_vectorstore(self):
+        self._construir(firma="v1")
+        self.assertIsNone(self._cargar(firma="v2"))
+        self.assertIsNone(self._cargar(configuracion=dict(CONFIGURACION, dimension=64)))
+        self.assertIsNone(Particiones.cargar(self.carpeta_particiones, CONFIGURACION, self.index.ntotal + 1,
+                                             firma_vectorstore="v1"))
+
+    def test_enrutar(self):
+        self._construir()
+        particiones = self._cargar()
+        self.assertEqual(particiones.enrutar("¿Cuál es el plazo de devolución?"), ["politica"])
+        self.assertEqual(particiones.enrutar("¿Qué hay en el catálogo?"), ["catalogo"])
+        self.assertIn("pedidos", particiones.enrutar("¿Dónde está ECO-1001?"))
+        # El índice maestro relaciona ECO-1002 con su producto y su política
+        self.assertIsNone(particiones.enrutar("¿Puedo devolver ECO-1002?"))
+        self.assertIsNone(particiones.enrutar("hola"))
+
+    def test_buscar_en_las_particiones_elegidas(self):
+        self._construir()
+        particiones = self._cargar()
+        texto = TEXTOS["catalogo_productos.txt"][1]
+        vector = np.asarray([self.embeddings.embed_query(texto)], dtype=np.float32)
+        self.assertEqual(particiones.buscar(vector, 1, ["catalogo"]), ["catalogo_productos.txt#1"])
+        encontrados = particiones.buscar(vector, 3, ["pedidos", "politica"])
+        self.assertEqual(len(encontrados), 3)
+        self.assertFalse(any(i.startswith("catalogo") for i in encontrados))
+
+    def test_ids_de_reutiliza_las_uniones(self):
+        self._construir()
+        particiones = self._cargar()
+        union = particiones.ids_de(["pedidos", "politica"])
+        self.assertEqual(union, set(self.archivos["pedidos_detallados.txt"]["fragmentos"]
+                                    + self.archivos["politica_devoluciones.txt"]["fragmentos"]))
+        self.assertIs(particiones.ids_de(["politica", "pedidos"]), union)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+# ============================================================
+# test_registro_solicitudes.py — Pruebas del registro de solicitudes con
+# escritura diferida: alta y búsqueda, duplicados, pedido guardado tal como
+# se escribió, CSV histórico, reintentos acotados de un lote que falla,
+# cerrar() sin colgarse y búsquedas sin duplicados mientras se escribe.
+# Uso:
+#   python -m pytest test_registro_solicitudes.py
+# ============================================================
+
+import csv
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import registro_solicitudes
+from registro_solicitudes import RegistroSolicitudes
+
+
+def _disco_lleno(conexion, lote):
+    raise OSError("disco lleno")
+
+
+class PruebaRegistroSolicitudes(unittest.TestCase):
+
+    def setUp(self):
+        carpeta = tempfile.TemporaryDirectory()
+        self.addCleanup(carpeta.cleanup)
+        self.ruta_db = os.path.join(carpeta.name, "data", "solicitudes.db")
+        self.ruta_csv = os.path.join(carpeta.name, "solicitudes.csv")
+
+    def _registro(self, **opciones):
+        registro = RegistroSolicitudes(self.ruta_db, intervalo_flush=0.01, **opciones)
+        self.addCleanup(lambda: registro._escritor.is_alive() and registro.cerrar())
+        return registro
+
+    def test_registrar_y_buscar(self):
+        registro = self._registro(ruta_csv=self.ruta_csv)
+        self.assertIsNone(registro.registrar("eco-1002", "Jabón Artesanal", "dañado"))
+        self.assertIsNone(registro.registrar("ECO-1002", "Cuaderno", "no corresponde"))
+        # Visible antes de escribirse y después
+        self.assertEqual([s["producto"] for s in registro.buscar("Eco-1002")], ["Jabón Artesanal", "Cuaderno"])
+        self.assertTrue(registro.vaciar())
+        solicitudes = registro.buscar("ECO-1002")
+        self.assertEqual([s["producto"] for s in solicitudes], ["Jabón Artesanal", "Cuaderno"])
+        self.assertEqual(solicitudes[0]["pedido"], "eco-1002") # Tal como se escribió
+        self.assertTrue(all(s["id"] for s in solicitudes))
+        self.assertEqual(registro.estado("eco-1002"), "registrada")
+        self.assertIsNone(registro.estado("ECO-9999"))
+        with open(self.ruta_csv, encoding="utf-8") as f:
+            self.assertEqual(list(csv.reader(f))[0], ["eco-1002", "Jabón Artesanal", "dañado"])
+
+    def test_duplicados(self):
+        registro = self._registro()
+        registro.registrar("ECO-1001", "Jabón", "dañado")
+        # Pendiente de escribir
+        self.assertEqual(registro.registrar("eco-1001 ", "jabón", "Dañado")["producto"], "Jabón")
+        registro.vaciar()
+        # Ya en disco
+        self.assertIsNotNone(registro.registrar("ECO-1001", "JABÓN", "dañado"))
+        self.assertIsNone(registro.registrar("ECO-1001", "Jabón", "dañado", detectar_duplicados=False))
+        registro.vaciar()
+        self.assertEqual(len(registro.buscar("ECO-1001")), 2)
+
+    def test_persiste_entre_instancias(self):
+        registro = self._registro()
+        registro.registrar("ECO-1003", "Cepillo", "defectuoso")
+        registro.cerrar()
+        self.assertEqual(self._registro().estado("ECO-1003"), "registrada")
+
+    def test_fsync_desconocido(self):
+        with self.assertRaises(ValueError):
+            RegistroSolicitudes(self.ruta_db, fsync="a veces")
+
+    def test_lote_que_falla_se_descarta_tras_max_intentos(self):
+        registro = self._registro()
+        intentos = []
+
+        def fallar(conexion, lote):
+            intentos.append(len(lote))
+            _disco_lleno(conexion, lote)
+
+        registro._escribir_lote = fallar
+        registro.registrar("ECO-1004", "Cuaderno", "dañado")
+        self.assertTrue(registro.vaciar(timeout=10))
+        self.assertEqual(len(intentos), registro_solicitudes.MAX_INTENTOS_LOTE)
+        self.assertEqual(registro.buscar("ECO-1004"), [])
+
+    def test_cerrar_no_espera_a_un_lote_que_falla(self):
+        registro = RegistroSolicitudes(self.ruta_db, intervalo_flush=5.0)
+        registro._escribir_lote = _disco_lleno
+        registro.registrar("ECO-1004", "Cuaderno", "dañado")
+        inicio = time.monotonic()
+        registro.cerrar()
+        # Sin cerrar() el lote esperaría 5 s por intento
+        self.assertLess(time.monotonic() - inicio, 8.0)
+        self.assertFalse(registro._escritor.is_alive())
+
+    def test_buscar_no_repite_un_lote_recien_escrito(self):
+        registro = self._registro()
+        escrito = threading.Event()
+        lotes = []
+
+        def retener(lote):
+            lotes.append(lote)
+            escrito.set()
+
+        # Simula la ventana entre el commit del lote y su retirada de _pendientes
+        registro._retirar_pendientes = retener
+        registro.registrar("ECO-1005", "Botella", "dañado")
+        self.assertTrue(escrito.wait(5))
+        self.assertEqual(len(registro._pendientes), 1)
+        self.assertEqual(len(registro.buscar("ECO-1005")), 1)
+        RegistroSolicitudes._retirar_pendientes(registro, lotes[0])
+        self.assertEqual(len(registro.buscar("ECO-1005")), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
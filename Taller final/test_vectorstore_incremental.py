@@ -0,0 +1,135 @@
+# ============================================================
+# test_vectorstore_incremental.py — Pruebas de la actualización
+# incremental del vectorstore: sin cambios, archivo nuevo, archivo
+# modificado y archivo eliminado solo embeben o borran lo que cambió,
+# y el resultado se vuelve a cargar igual desde disco.
+# Usa los embeddings deterministas de bench_ecomarket (sin red).
+# Uso:
+#   python -m pytest test_vectorstore_incremental.py
+# ============================================================
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+CARPETA_REPO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _parrafos(nombre, n):
+    return "\n\n".join(
+        f"{nombre} párrafo {i}: " + " ".join(f"{nombre.lower()}{i}_{j}" for j in range(40)) for i in range(n)
+    )
+
+
+class PruebaVectorstoreIncremental(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # app usa rutas relativas (content/, vectorstore/, cache/, data/): todo va a una carpeta temporal
+        cls.directorio_inicial = os.getcwd()
+        cls.carpeta = tempfile.mkdtemp(prefix="test_incremental_")
+        os.chdir(cls.carpeta)
+        sys.path.insert(0, CARPETA_REPO)
+        os.environ["ECOMARKET_EMBEDDINGS_BACKEND"] = "openai"
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app
+            from bench_ecomarket import EmbeddingsFalsos
+        cls.app = app
+        cls.embebidos = []
+
+        class EmbeddingsContados(EmbeddingsFalsos):
+            def embed_documents(self, texts):
+                cls.embebidos.extend(texts)
+                return super().embed_documents(texts)
+
+        app.OpenAIEmbeddings = lambda **_: EmbeddingsContados(64)
+        app.DIMENSIONES_OPENAI[app.EMBEDDING_MODEL] = 64
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.app._embeddings is not None:
+            cls.app._embeddings.cerrar()
+        os.chdir(cls.directorio_inicial)
+        shutil.rmtree(cls.carpeta, ignore_errors=True)
+
+    def setUp(self):
+        for carpeta in ("content", "vectorstore", "cache"):
+            shutil.rmtree(carpeta, ignore_errors=True)
+        os.makedirs("content")
+        # Cada prueba parte de una caché de embeddings vacía
+        if self.app._embeddings is not None:
+            self.app._embeddings.cerrar()
+        self.app._embeddings = None
+        for nombre in ("Alfa", "Beta", "Gamma"):
+            self._escribir(nombre, 4)
+        self.db = self._silencioso(self.app.cargar_o_crear_vectorstore)
+        self.embebidos.clear()
+
+    def _escribir(self, nombre, parrafos):
+        with open(os.path.join("content", f"{nombre.lower()}.txt"), "w", encoding="utf-8") as f:
+            f.write(_parrafos(nombre, parrafos))
+
+    def _silencioso(self, funcion, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return funcion(*args)
+
+    def _fuentes(self, db):
+        return {os.path.basename(db.docstore.search(i).metadata["source"]) for i in db.index_to_docstore_id.values()}
+
+    def _actualizar(self):
+        db = self._silencioso(self.app.actualizar_vectorstore, self.db)
+        self.assertEqual(self.app.informe_construccion["tipo"], "incremental")
+        self.assertEqual(db.index.ntotal, len(db.index_to_docstore_id))
+        return db
+
+    def test_sin_cambios_no_embebe(self):
+        db = self._actualizar()
+        self.assertIs(db, self.db)
+        self.assertEqual(self.embebidos, [])
+
+    def test_archivo_nuevo_solo_embebe_sus_fragmentos(self):
+        antes = self.db.index.ntotal
+        self._escribir("Delta", 3)
+        db = self._actualizar()
+        self.assertTrue(self.embebidos)
+        self.assertTrue(all(texto.startswith("Delta") for texto in self.embebidos))
+        self.assertEqual(db.index.ntotal, antes + len(self.embebidos))
+        self.assertIn("delta.txt", self._fuentes(db))
+
+    def test_archivo_modificado_solo_embebe_lo_nuevo(self):
+        antes = self.db.index.ntotal
+        with open(os.path.join("content", "beta.txt"), "a", encoding="utf-8") as f:
+            f.write("\n\n" + _parrafos("Epsilon", 2))
+        db = self._actualizar()
+        self.assertTrue(self.embebidos)
+        self.assertTrue(all("Epsilon" in texto for texto in self.embebidos))
+        self.assertEqual(db.index.ntotal, antes + len(self.embebidos))
+
+    def test_archivo_eliminado_borra_sus_fragmentos(self):
+        fragmentos_gamma = len(self._silencioso(self.app._cargar_archivos, ["gamma.txt"])[0][0])
+        antes = self.db.index.ntotal
+        os.remove(os.path.join("content", "gamma.txt"))
+        db = self._actualizar()
+        self.assertEqual(self.embebidos, [])
+        self.assertEqual(db.index.ntotal, antes - fragmentos_gamma)
+        self.assertEqual(self._fuentes(db), {"alfa.txt", "beta.txt"})
+        # Las posiciones de FAISS siguen alineadas con los ids tras renumerar
+        resultado = db.similarity_search(_parrafos("Beta", 1), k=1)[0]
+        self.assertTrue(resultado.page_content.startswith("Beta párrafo 0"))
+
+    def test_recarga_desde_disco(self):
+        self._escribir("Delta", 2)
+        db = self._actualizar()
+        self.embebidos.clear()
+        recargado = self._silencioso(self.app.cargar_o_crear_vectorstore)
+        self.assertEqual(self.embebidos, [])
+        self.assertEqual(recargado.index.ntotal, db.index.ntotal)
+        self.assertEqual(self._fuentes(recargado), {"alfa.txt", "beta.txt", "gamma.txt", "delta.txt"})
+
+
+if __name__ == "__main__":
+    unittest.main()